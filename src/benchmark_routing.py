@@ -0,0 +1,210 @@
+import warnings
+warnings.filterwarnings("ignore")
+
+import sumolib
+import numpy as np
+import time
+import argparse
+
+from routing_utils import (from_sumo_to_igraph_network, load_igraph_network, apply_randomization_my_duarouter, 
+                           load_contraction_hierarchy, get_shortest_paths_nodes, ellipse_subgraph, get_shortest_path_ellipse, 
+                           sumo_node_to_ig_vertices, get_contraction_hierarchy)
+from contraction_hierarchy import ch_shortest_path, ch_shortest_paths
+
+
+def time_function(fun, n_runs=3, **kwargs):
+    """
+    Run a function several times and measure its execution time.
+
+    Args:
+    fun (callable): Function to benchmark.
+    n_runs (int): Number of runs.
+    kwargs: Arguments passed to the function.
+
+    Returns:
+    tuple: (median elapsed time in seconds, output of the last run).
+    """
+    elapsed_list = []
+
+    for _ in range(n_runs):
+        start_time = time.perf_counter()
+        res = fun(**kwargs)
+        elapsed_list.append(time.perf_counter() - start_time)
+
+    return float(np.median(elapsed_list)), res
+
+
+def benchmark_build_network(road_network_path, n_runs=3):
+    """
+    Compare the per-node and the vectorized conversion of a SUMO network to igraph,
+    and check that both produce the same vertex and edge indices.
+    """
+    road_network = sumolib.net.readNet(road_network_path, withInternal=False)
+
+    t_loop, G_loop = time_function(from_sumo_to_igraph_network, n_runs=n_runs,
+                                   road_network=road_network, vectorized=False)
+    t_vect, G_vect = time_function(from_sumo_to_igraph_network, n_runs=n_runs,
+                                   road_network=road_network, vectorized=True)
+
+    assert G_loop.vs["name"] == G_vect.vs["name"], "Error vertex indices"
+    assert G_loop.get_edgelist() == G_vect.get_edgelist(), "Error edge indices"
+    assert G_loop.es["id"] == G_vect.es["id"], "Error edge IDs"
+
+    return {"vertices": G_vect.vcount(), "edges": G_vect.ecount(),
+            "per-node (s)": t_loop, "vectorized (s)": t_vect, "speedup": t_loop/t_vect}
+
+
+def benchmark_cache_network(road_network_path, n_runs=3):
+    """
+    Compare the conversion of a SUMO network file to igraph with the load from the on-disk cache.
+    """
+    t_convert, _ = time_function(load_igraph_network, n_runs=n_runs,
+                                 road_network_path=road_network_path, use_cache=False)
+
+    # the first call writes the cache (if missing)
+    load_igraph_network(road_network_path)
+    t_cache, G = time_function(load_igraph_network, n_runs=n_runs, road_network_path=road_network_path)
+
+    return {"vertices": G.vcount(), "edges": G.ecount(),
+            "readNet + convert (s)": t_convert, "cache (s)": t_cache, "speedup": t_convert/t_cache}
+
+
+def benchmark_randomization(road_network_path, n_runs=3, n_vehicles=100, w=5):
+    """
+    Per-vehicle cost of the random distortion of the edge weights (worker_mydua.py), 
+    edge by edge vs. with a single columnar assignment.
+    """
+    G = load_igraph_network(road_network_path)
+
+    G.es["tmp_traveltime"] = G.es["traveltime"]
+    base_weights = np.array(G.es["traveltime"], dtype=np.float64)
+    connection_mask = np.array(G.es["id"]) == "connection"
+
+    def distort_all(vectorized):
+        for vid in range(n_vehicles):
+            np.random.seed(vid)
+            apply_randomization_my_duarouter(G, w, default_attribute="traveltime", tmp_attribute="tmp_traveltime",
+                                             base_weights=base_weights, connection_mask=connection_mask,
+                                             vectorized=vectorized)
+        return G.es["tmp_traveltime"]
+
+    t_loop, weights_loop = time_function(distort_all, n_runs=n_runs, vectorized=False)
+    t_vect, weights_vect = time_function(distort_all, n_runs=n_runs, vectorized=True)
+
+    assert weights_loop == weights_vect, "Error distorted weights"
+
+    return {"edges": G.ecount(), "per-edge (ms/vehicle)": 1000*t_loop/n_vehicles,
+            "vectorized (ms/vehicle)": 1000*t_vect/n_vehicles, "speedup": t_loop/t_vect}
+
+
+def benchmark_contraction_hierarchy(road_network_path, n_runs=3, n_queries=1000, attribute="traveltime"):
+    """
+    Fastest-path queries between random SUMO nodes: contraction hierarchy vs. plain Dijkstra (igraph).
+    The hierarchy is built the first time and then loaded from the cache next to the network.
+    """
+    G = load_igraph_network(road_network_path)
+
+    t_build, _ = time_function(load_contraction_hierarchy, n_runs=1, G=G, attribute=attribute,
+                               road_network_path=road_network_path)
+
+    np.random.seed(0)
+    sumo_nodes = list(G["vertices_to_subvertices"].keys())
+    od_list = [(sumo_nodes[np.random.randint(0, len(sumo_nodes))], sumo_nodes[np.random.randint(0, len(sumo_nodes))])
+               for _ in range(n_queries)]
+
+    t_dijkstra, res_dijkstra = time_function(get_shortest_paths_nodes, n_runs=n_runs, G=G, od_list=od_list,
+                                             attribute=attribute, backend="igraph")
+    t_ch, res_ch = time_function(get_shortest_paths_nodes, n_runs=n_runs, G=G, od_list=od_list,
+                                 attribute=attribute, backend="ch")
+
+    # search only (no conversion of the paths): one bidirectional query per OD vs. the batch
+    contraction_hierarchy = get_contraction_hierarchy(G, attribute)
+    list_sources_targets = []
+    for from_node_sumo, to_node_sumo in od_list:
+        sources = sumo_node_to_ig_vertices(G, from_node_sumo, "_from")
+        targets = [t for t in sumo_node_to_ig_vertices(G, to_node_sumo, "_to") if t not in sources]
+        if len(sources) > 0 and len(targets) > 0:
+            list_sources_targets.append((sources, targets))
+
+    def search_single():
+        return [ch_shortest_path(contraction_hierarchy, sources, targets) for sources, targets in list_sources_targets]
+
+    t_single, _ = time_function(search_single, n_runs=n_runs)
+    t_batch, _ = time_function(ch_shortest_paths, n_runs=n_runs, contraction_hierarchy=contraction_hierarchy,
+                               list_sources_targets=list_sources_targets)
+
+    max_error = max([abs(r0["cost"]-r1["cost"]) for r0, r1 in zip(res_dijkstra, res_ch) if r0["sumo"] is not None] + [0])
+    assert all((r0["sumo"] is None) == (r1["sumo"] is None) for r0, r1 in zip(res_dijkstra, res_ch)), "Error reachability"
+
+    return {"vertices": G.vcount(), "edges": G.ecount(), "CH build/load (s)": t_build,
+            "Dijkstra (ms/query)": 1000*t_dijkstra/n_queries, "CH (ms/query)": 1000*t_ch/n_queries,
+            "CH search single (ms/query)": 1000*t_single/n_queries, "CH search batch (ms/query)": 1000*t_batch/n_queries,
+            "speedup": t_dijkstra/t_ch, "max cost error": max_error}
+
+
+def benchmark_ellipse_routing(road_network_path, n_runs=3, n_queries=100, attribute="traveltime"):
+    """
+    Fastest paths restricted to the ellipse of each trip between random SUMO edges: 
+    a copy of the ellipse subgraph per trip (ellipse_subgraph) vs. infinite weights 
+    outside the ellipse on the whole graph (get_shortest_path_ellipse).
+    """
+    G = load_igraph_network(road_network_path)
+
+    np.random.seed(0)
+    sumo_edges = list(G["edge_sumo_ig"].keys())
+    od_list = [(sumo_edges[np.random.randint(0, len(sumo_edges))], sumo_edges[np.random.randint(0, len(sumo_edges))])
+               for _ in range(n_queries)]
+
+    def route_subgraph():
+        costs = []
+        for from_edge, to_edge in od_list:
+            _, G_ellipse = ellipse_subgraph(G, from_edge, to_edge)
+            edge_from, edge_to = G.es[G["edge_sumo_ig"][from_edge]], G.es[G["edge_sumo_ig"][to_edge]]
+            names = G_ellipse.vs["name"]
+            cost = -1
+            if edge_from.target == edge_to.source:
+                cost = edge_from[attribute] + edge_to[attribute]
+            elif G.vs[edge_from.target]["name"] in names and G.vs[edge_to.source]["name"] in names:
+                path = G_ellipse.get_shortest_paths(names.index(G.vs[edge_from.target]["name"]), names.index(G.vs[edge_to.source]["name"]), 
+                                                    weights=attribute, output="epath")[0]
+                if len(path) > 0:
+                    cost = sum(G_ellipse.es[path][attribute]) + edge_from[attribute] + edge_to[attribute]
+            costs.append(cost if from_edge != to_edge else edge_from[attribute])
+        return costs
+
+    def route_mask(backend):
+        return [get_shortest_path_ellipse(G, from_edge, to_edge, attribute, backend=backend)["cost"] for from_edge, to_edge in od_list]
+
+    t_subgraph, costs_subgraph = time_function(route_subgraph, n_runs=n_runs)
+    t_mask, costs_mask = time_function(route_mask, n_runs=n_runs, backend="igraph")
+    t_mask_scipy, costs_mask_scipy = time_function(route_mask, n_runs=n_runs, backend="scipy")
+
+    assert np.allclose(costs_subgraph, costs_mask) and np.allclose(costs_subgraph, costs_mask_scipy), "Error costs"
+
+    return {"vertices": G.vcount(), "edges": G.ecount(), "subgraph (ms/query)": 1000*t_subgraph/n_queries,
+            "mask igraph (ms/query)": 1000*t_mask/n_queries, "mask scipy (ms/query)": 1000*t_mask_scipy/n_queries}
+
+
+dict_benchmarks = {"build": benchmark_build_network, "cache": benchmark_cache_network,
+                   "randomization": benchmark_randomization, "ch": benchmark_contraction_hierarchy, 
+                   "ellipse": benchmark_ellipse_routing}
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-b', '--benchmark', type=str, default="build", choices=list(dict_benchmarks.keys()))
+    parser.add_argument('--cities', type=str, default="florence-milan-rome", help="List of cities (e.g., florence-milan)")
+    parser.add_argument('--road-network-folder', type=str, default="../data/road_networks/")
+    parser.add_argument('--n-runs', type=int, default=3)
+
+    args = parser.parse_args()
+
+    for city in args.cities.split("-"):
+
+        road_network_path = f"{args.road_network_folder}sumo_road_network_{city}.net.xml"
+
+        res = dict_benchmarks[args.benchmark](road_network_path, n_runs=args.n_runs)
+
+        print(city, res)
@@ -0,0 +1,439 @@
+import numpy as np
+import heapq
+from heapq import heappush, heappop
+import os
+
+
+INF = float("inf")
+
+
+""" Contraction hierarchies for repeated shortest-path queries on static edge weights """
+
+
+def build_contraction_hierarchy(G, attribute, witness_settled_limit=60):
+    """
+    Builds a contraction hierarchy of an igraph network for the given (static) edge weights.
+
+    The vertices are contracted in order of edge difference (with lazy updates); when a vertex
+    is contracted, a shortcut is added between two of its neighbors unless a witness path, not
+    longer than the path through the vertex, is found by a local Dijkstra search.
+
+    Parameters:
+        G: The igraph graph (e.g., from from_sumo_to_igraph_network)
+        attribute: The edge attribute to optimize the paths on (e.g., "traveltime").
+        witness_settled_limit: Maximum number of vertices settled by each witness search.
+
+    Returns:
+        A dictionary of arrays (see prepare_contraction_hierarchy):
+        - 'rank': order of contraction of each vertex
+        - 'edge_source', 'edge_target', 'edge_weight': edges of the hierarchy (original edges and shortcuts)
+        - 'edge_mid': contracted vertex of each shortcut (-1 for original edges)
+        - 'edge_ig': igraph edge of each original edge (-1 for shortcuts)
+    """
+
+    n_vertices = G.vcount()
+    weights = G.es[attribute]
+
+    # the hierarchy edges: (source, target, weight, mid vertex, igraph edge)
+    ch_edges = []
+
+    # adjacency of the vertices not contracted yet: vertex -> {neighbor: (weight, hierarchy edge)}
+    out_adj = [dict() for _ in range(n_vertices)]
+    in_adj = [dict() for _ in range(n_vertices)]
+
+    # parallel edges: keep the cheapest one (the first in index order in case of ties)
+    for e, (s, t) in enumerate(G.get_edgelist()):
+        if s == t:
+            continue
+        if t not in out_adj[s] or weights[e] < out_adj[s][t][0]:
+            out_adj[s][t] = (weights[e], len(ch_edges))
+            in_adj[t][s] = (weights[e], len(ch_edges))
+            ch_edges.append((s, t, weights[e], -1, e))
+
+    def witness_search(source, excluded, max_cost, targets):
+        # local Dijkstra search, it stops as soon as all the targets are settled
+        dist = {source: 0}
+        heap = [(0, source)]
+        settled = 0
+        targets_left = len(targets)
+        while heap and settled < witness_settled_limit:
+            d, v = heappop(heap)
+            if d > max_cost:
+                break
+            if d > dist[v]:
+                continue
+            settled += 1
+            if v in targets:
+                targets_left -= 1
+                if targets_left == 0:
+                    break
+            for u, (w, _) in out_adj[v].items():
+                du = d + w
+                if du < dist.get(u, INF) and u != excluded:
+                    dist[u] = du
+                    heappush(heap, (du, u))
+        return dist
+
+    def shortcuts_of(v):
+        shortcuts = []
+        for u, (w_in, _) in in_adj[v].items():
+            targets = {x: w_in + w_out for x, (w_out, _) in out_adj[v].items() if x != u}
+            if len(targets) == 0:
+                continue
+            dist = witness_search(u, v, max(targets.values()), targets)
+            for x, cost in targets.items():
+                if dist.get(x, INF) > cost:
+                    shortcuts.append((u, x, cost))
+        return shortcuts
+
+    def priority(v, shortcuts):
+        return len(shortcuts) - len(in_adj[v]) - len(out_adj[v]) + deleted_neighbors[v]
+
+    deleted_neighbors = np.zeros(n_vertices, dtype=np.int64)
+    rank = np.full(n_vertices, -1, dtype=np.int64)
+
+    current_priority = [priority(v, shortcuts_of(v)) for v in range(n_vertices)]
+    heap = [(p, v) for v, p in enumerate(current_priority)]
+    heapq.heapify(heap)
+
+    current_rank = 0
+
+    while heap:
+        p, v = heapq.heappop(heap)
+
+        # outdated entry (v already contracted or its priority changed)
+        if rank[v] >= 0 or p != current_priority[v]:
+            continue
+
+        # lazy update: contract v only if it is still the vertex with the lowest priority
+        shortcuts = shortcuts_of(v)
+        p = priority(v, shortcuts)
+        if heap and p > heap[0][0]:
+            current_priority[v] = p
+            heapq.heappush(heap, (p, v))
+            continue
+
+        for u, x, cost in shortcuts:
+            if x not in out_adj[u] or cost < out_adj[u][x][0]:
+                out_adj[u][x] = (cost, len(ch_edges))
+                in_adj[x][u] = (cost, len(ch_edges))
+                ch_edges.append((u, x, cost, v, -1))
+
+        # remove v from the remaining graph
+        for u in in_adj[v]:
+            del out_adj[u][v]
+            deleted_neighbors[u] += 1
+        for x in out_adj[v]:
+            del in_adj[x][v]
+            deleted_neighbors[x] += 1
+        out_adj[v], in_adj[v] = {}, {}
+
+        rank[v] = current_rank
+        current_rank += 1
+
+    # keep only the best edge for each pair of vertices (the superseded ones are never used)
+    best_edge = {}
+    for ind, (s, t, w, _, _) in enumerate(ch_edges):
+        if (s, t) not in best_edge or w < ch_edges[best_edge[(s, t)]][2]:
+            best_edge[(s, t)] = ind
+    ch_edges = [ch_edges[ind] for ind in sorted(best_edge.values())]
+
+    contraction_hierarchy = {"attribute": np.array(attribute),
+                             "rank": rank,
+                             "edge_source": np.array([e[0] for e in ch_edges], dtype=np.int64),
+                             "edge_target": np.array([e[1] for e in ch_edges], dtype=np.int64),
+                             "edge_weight": np.array([e[2] for e in ch_edges], dtype=np.float64),
+                             "edge_mid": np.array([e[3] for e in ch_edges], dtype=np.int64),
+                             "edge_ig": np.array([e[4] for e in ch_edges], dtype=np.int64)}
+
+    return prepare_contraction_hierarchy(contraction_hierarchy)
+
+
+# arrays of a contraction hierarchy saved by save_contraction_hierarchy (the others are built by prepare_contraction_hierarchy)
+CONTRACTION_HIERARCHY_ARRAYS = ["attribute", "rank", "edge_source", "edge_target", "edge_weight", "edge_mid", "edge_ig"]
+
+
+def upward_graph(tails, heads, weights, edges, n_vertices):
+    """
+    Adjacency of an upward graph in CSR format: the edges leaving vertex v are the positions 
+    offsets[v]:offsets[v+1] of heads, weights and edges (hierarchy edge).
+    """
+
+    order = np.argsort(tails, kind="stable")
+    offsets = np.zeros(n_vertices+1, dtype=np.int64)
+    np.cumsum(np.bincount(tails, minlength=n_vertices), out=offsets[1:])
+
+    return offsets, heads[order], weights[order], edges[order]
+
+
+def prepare_contraction_hierarchy(contraction_hierarchy):
+    """
+    Adds to the arrays of a contraction hierarchy the structures used by the queries:
+    - 'up_forward_offsets', 'up_forward_heads', 'up_forward_weights', 'up_forward_edges': CSR adjacency 
+      of the upward edges (to higher-ranked targets)
+    - 'up_backward_offsets', ...: CSR adjacency of the reversed downward edges (from higher-ranked sources)
+    - 'up_forward', 'up_backward': the same CSR arrays as lists (faster to index in the search loops)
+    - 'edge_index': (source, target) -> hierarchy edge (to unpack the shortcuts)
+    """
+
+    rank = contraction_hierarchy["rank"]
+    n_vertices = len(rank)
+    edge_source, edge_target = contraction_hierarchy["edge_source"], contraction_hierarchy["edge_target"]
+    edge_weight = contraction_hierarchy["edge_weight"]
+
+    is_upward = rank[edge_source] < rank[edge_target]
+    up_edges, down_edges = np.flatnonzero(is_upward), np.flatnonzero(~is_upward)
+
+    for name, tails, heads, edges in [("up_forward", edge_source, edge_target, up_edges), 
+                                      ("up_backward", edge_target, edge_source, down_edges)]:
+        csr = upward_graph(tails[edges], heads[edges], edge_weight[edges], edges, n_vertices)
+        for suffix, array in zip(["offsets", "heads", "weights", "edges"], csr):
+            contraction_hierarchy[f"{name}_{suffix}"] = array
+        contraction_hierarchy[name] = tuple(array.tolist() for array in csr)
+
+    sources, targets = edge_source.tolist(), edge_target.tolist()
+    contraction_hierarchy["edge_index"] = {(s, t): ind for ind, (s, t) in enumerate(zip(sources, targets))}
+    contraction_hierarchy["edge_source_list"] = sources
+    contraction_hierarchy["edge_target_list"] = targets
+    contraction_hierarchy["edge_mid_list"] = contraction_hierarchy["edge_mid"].tolist()
+    contraction_hierarchy["edge_ig_list"] = contraction_hierarchy["edge_ig"].tolist()
+
+    return contraction_hierarchy
+
+
+def save_contraction_hierarchy(contraction_hierarchy, filename):
+    """
+    Saves the arrays of a contraction hierarchy in an uncompressed .npz file.
+    """
+
+    arrays = {k: contraction_hierarchy[k] for k in CONTRACTION_HIERARCHY_ARRAYS}
+
+    # write to a temporary file first, parallel workers may build the same hierarchy
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    tmp_filename = f"{filename}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_filename, **arrays)
+    os.replace(tmp_filename, filename)
+
+
+def load_contraction_hierarchy_file(filename):
+    """
+    Loads a contraction hierarchy saved with save_contraction_hierarchy.
+    """
+
+    with np.load(filename, allow_pickle=False) as npz_file:
+        contraction_hierarchy = {k: npz_file[k] for k in CONTRACTION_HIERARCHY_ARRAYS}
+
+    return prepare_contraction_hierarchy(contraction_hierarchy)
+
+
+def is_stalled(v, d, dist, opposite_graph):
+    """
+    Stall-on-demand: v (at distance d) is not settled correctly if a higher-ranked vertex u already 
+    reached reaches it with a lower distance (through an edge u -> v of the opposite upward graph); 
+    the edges of a stalled vertex are not relaxed.
+    """
+
+    offsets, heads, weights, _ = opposite_graph
+
+    for i in range(offsets[v], offsets[v+1]):
+        du = dist.get(heads[i])
+        if du is not None and du + weights[i] < d:
+            return True
+
+    return False
+
+
+def upward_search(graph, opposite_graph, sources):
+    """
+    Dijkstra search (with stall-on-demand) on an upward graph (forward or backward) from a list of 
+    sources, until all the reachable vertices are settled.
+
+    Returns:
+        The distances and the parent hierarchy edges of the reached vertices (the distances of 
+        the stalled vertices are upper bounds, i.e., lengths of valid paths).
+    """
+
+    offsets, heads, weights, edges = graph
+
+    dist = {s: 0 for s in sources}
+    parent = {s: -1 for s in sources}
+    heap = [(0, s) for s in sources]
+    heapq.heapify(heap)
+
+    while heap:
+        d, v = heappop(heap)
+        if d > dist[v] or is_stalled(v, d, dist, opposite_graph):
+            continue
+        for i in range(offsets[v], offsets[v+1]):
+            u, du = heads[i], d + weights[i]
+            if du < dist.get(u, INF):
+                dist[u] = du
+                parent[u] = edges[i]
+                heappush(heap, (du, u))
+
+    return dist, parent
+
+
+def unpack_edge(contraction_hierarchy, ind):
+    """
+    Translates a hierarchy edge (possibly a shortcut) into the list of igraph edges it represents.
+    """
+
+    edge_mid = contraction_hierarchy["edge_mid_list"]
+    edge_ig = contraction_hierarchy["edge_ig_list"]
+    edge_index = contraction_hierarchy["edge_index"]
+    sources, targets = contraction_hierarchy["edge_source_list"], contraction_hierarchy["edge_target_list"]
+
+    path = []
+    stack = [ind]
+
+    while stack:
+        ind = stack.pop()
+        mid = edge_mid[ind]
+        if mid < 0:
+            path.append(edge_ig[ind])
+        else:
+            s, t = sources[ind], targets[ind]
+            # the first half is processed first
+            stack.append(edge_index[(mid, t)])
+            stack.append(edge_index[(s, mid)])
+
+    return path
+
+
+def unpack_path(contraction_hierarchy, meet, parent_f, parent_b):
+    """
+    Translates the hierarchy edges from the sources to the meeting vertex (parent_f) and from the 
+    meeting vertex to the targets (parent_b) into the list of igraph edges of the path.
+    """
+
+    edge_source, edge_target = contraction_hierarchy["edge_source_list"], contraction_hierarchy["edge_target_list"]
+
+    # hierarchy edges from the source to the meeting vertex
+    forward_edges = []
+    v = meet
+    while parent_f[v] >= 0:
+        forward_edges.append(parent_f[v])
+        v = edge_source[parent_f[v]]
+
+    # hierarchy edges from the meeting vertex to the target
+    backward_edges = []
+    v = meet
+    while parent_b[v] >= 0:
+        backward_edges.append(parent_b[v])
+        v = edge_target[parent_b[v]]
+
+    path = []
+    for ind in forward_edges[::-1] + backward_edges:
+        path += unpack_edge(contraction_hierarchy, ind)
+
+    return path
+
+
+def ch_shortest_path(contraction_hierarchy, sources, targets):
+    """
+    Shortest path from any of the sources to any of the targets with a bidirectional upward search.
+
+    The forward and the backward searches alternate (the one with the closest vertex goes on), 
+    with stall-on-demand, until the closest vertex of both is not closer than the best meeting distance.
+
+    Parameters:
+        contraction_hierarchy: The dictionary returned by build_contraction_hierarchy
+        sources: List of igraph vertices where the path can start
+        targets: List of igraph vertices where the path can end
+
+    Returns:
+        The list of igraph edges of the path (None if no path exists).
+    """
+
+    graphs = [contraction_hierarchy["up_forward"], contraction_hierarchy["up_backward"]]
+
+    dist = [{s: 0 for s in sources}, {t: 0 for t in targets}]
+    parent = [{s: -1 for s in sources}, {t: -1 for t in targets}]
+    heaps = [[(0, s) for s in sources], [(0, t) for t in targets]]
+    heapq.heapify(heaps[0])
+    heapq.heapify(heaps[1])
+
+    best, meet = INF, None
+
+    while True:
+        top_f = heaps[0][0][0] if heaps[0] else INF
+        top_b = heaps[1][0][0] if heaps[1] else INF
+
+        if min(top_f, top_b) >= best:
+            break
+
+        side = 0 if top_f <= top_b else 1
+        d, v = heappop(heaps[side])
+        dist_side = dist[side]
+
+        if d > dist_side[v]:
+            continue
+
+        dv_other = dist[1-side].get(v)
+        if dv_other is not None and d + dv_other < best:
+            best, meet = d + dv_other, v
+
+        if is_stalled(v, d, dist_side, graphs[1-side]):
+            continue
+
+        offsets, heads, weights, edges = graphs[side]
+        parent_side, heap = parent[side], heaps[side]
+
+        for i in range(offsets[v], offsets[v+1]):
+            u, du = heads[i], d + weights[i]
+            if du < dist_side.get(u, INF):
+                dist_side[u] = du
+                parent_side[u] = edges[i]
+                heappush(heap, (du, u))
+
+    if meet is None:
+        return None
+
+    return unpack_path(contraction_hierarchy, meet, parent[0], parent[1])
+
+
+def ch_shortest_paths(contraction_hierarchy, list_sources_targets):
+    """
+    Shortest paths of a batch of queries (sources, targets), as ch_shortest_path.
+
+    The upward search spaces (forward of the sources, backward of the targets) are computed once 
+    for each distinct list of vertices and reused by all the queries sharing it (e.g., the trips 
+    from or to the same SUMO node); the path of a query meets at the vertex minimizing the sum of 
+    the distances in the two spaces.
+
+    Returns:
+        The list of the paths (lists of igraph edges, None if no path exists), in the order of the queries.
+    """
+
+    forward, backward = contraction_hierarchy["up_forward"], contraction_hierarchy["up_backward"]
+
+    forward_spaces, backward_spaces = {}, {}
+
+    paths = []
+
+    for sources, targets in list_sources_targets:
+        key_f, key_b = tuple(sources), tuple(targets)
+
+        if key_f not in forward_spaces:
+            forward_spaces[key_f] = upward_search(forward, backward, sources)
+        if key_b not in backward_spaces:
+            backward_spaces[key_b] = upward_search(backward, forward, targets)
+
+        (dist_f, parent_f), (dist_b, parent_b) = forward_spaces[key_f], backward_spaces[key_b]
+
+        # meeting vertex (scanning the smaller space)
+        if len(dist_f) > len(dist_b):
+            candidates, other = dist_b, dist_f
+        else:
+            candidates, other = dist_f, dist_b
+
+        best, meet = INF, None
+        for v, d in candidates.items():
+            d_other = other.get(v)
+            if d_other is not None and d + d_other < best:
+                best, meet = d + d_other, v
+
+        paths.append(None if meet is None else unpack_path(contraction_hierarchy, meet, parent_f, parent_b))
+
+    return paths
@@ -1,7 +1,5 @@
 import subprocess
-import xml
 import os
-import pandas as pd
 import xml.etree.ElementTree as ET
 from datetime import datetime
 import numpy as np
@@ -9,6 +7,9 @@ import time
 import json
 import argparse
 import shutil
+from sumo_outputs import extract_edge_data, extract_tripinfo, save_columns
+from route_store import ROUTE_STORE_SUFFIX, store_to_route_file
+from simulation_jobs import get_sumo_version
 
 
 
@@ -16,7 +17,7 @@ def create_additional_file_emissions(emissions_filename, output_filename):
 
     # Create the root element
     root = ET.Element("additional")
-    
+
     # use the absoulte path
     abs_emissions_filename = os.path.abspath(emissions_filename)
 
@@ -34,235 +35,281 @@ def create_additional_file_emissions(emissions_filename, output_filename):
     # Save the XML tree to a file
     tree.write(output_filename)
 
-    
-def convert_xml_to_csv(xml_filename, csv_filename):
-    """Convert XML output to CSV."""
-    command = ["python", script_xml_csv, xml_filename,"-o", csv_filename]
-    
-    script = subprocess.Popen(command, cwd=".")
-    script.wait()
-    
-    
+
 def create_sim_id(rand_int=False):
 
     now = datetime.now()
     dt_string = now.strftime("%d_%m_%H_%M_%S")
-    
+
     if rand_int:
         return f"{dt_string}_{str(np.random.randint(0, 1e7))}"
     else:
         return dt_string
 
 
+def run_simulation(net_file, route_file, experiment_id, results_folder, sim_key="", mix_info=None,
+                   output_edges=True, output_trips=True, output_log=True, use_gui=False, sumo_opt="",
+                   sumo_version=None, timeout=None, verbose=True, live=False):
+    """
+    Runs a SUMO simulation and post-processes its outputs (edge emissions, trip info and log) in the
+    output folder results_folder + simulation ID.
+
+    Args:
+    net_file (str): SUMO network file.
+    route_file (str): SUMO route file or route store (.rou.npz, written as a route file for SUMO).
+    experiment_id (str): Prefix of the simulation ID.
+    results_folder (str): Folder of the output folders of the simulations.
+    sim_key (str): Key of the simulation (see simulation_jobs.simulation_key): the simulation ID is
+        experiment_id + sim_key, and the output of a previous run with the same key is replaced.
+        If empty, a random ID is used.
+    mix_info (dict): Info about the mix (e.g., pct and rep) saved in the log.
+    output_edges, output_trips, output_log (bool): Outputs to collect.
+    use_gui (bool): Whether to run sumo-gui.
+    sumo_opt (str): Additional SUMO options.
+    sumo_version (str): Version of SUMO saved in the log (asked to SUMO if None, pass it to avoid
+        a call to "sumo --version" for each simulation).
+    timeout (float): Seconds after which SUMO is killed (subprocess.TimeoutExpired is raised).
+    verbose (bool): Whether to print the progress and the output of SUMO.
+    live (bool): Whether to aggregate the measures of the edges and of the trips during the simulation
+        (TraCI/libsumo, see sumo_live.py) instead of extracting them from the XML outputs of SUMO.
+
+    Returns:
+    str: The output folder of the simulation.
+    """
+    # Create a simulation identifier
+    if sim_key != "":
+        simulation_id = f"{experiment_id}{sim_key}"
+    else:
+        simulation_id = f"{experiment_id}{create_sim_id(rand_int=True)}"
+
 
-# Parse the arguments
+    # create a folder in the output directory with a name equal to the simulation id
+    output_folder = results_folder+simulation_id+"/"
 
-parser = argparse.ArgumentParser()
+    # the output of a previous (incomplete) run with the same key is replaced
+    if sim_key != "" and os.path.exists(output_folder):
+        shutil.rmtree(output_folder)
 
-# network and route file
-parser.add_argument('-n', '--net-file', required=True)
-parser.add_argument('-r', '--route-file', required=True)
+    if not os.path.exists(output_folder):
+        os.makedirs(output_folder)
 
-# experiment info
-parser.add_argument('-i', '--exp-id', required=True)
-parser.add_argument('-o', '--output-dir', required=True)
+    os.makedirs("./tmp_folder_add_files", exist_ok=True)
 
-# output
-parser.add_argument('--edges-info', type=int, default=1)
-parser.add_argument('--trips-info', type=int, default=1)
-parser.add_argument('--log', type=int, default=1)
+    if verbose:
+        print("TraffiCO2 version 3.0")
+        print("\nSimulation id: "+simulation_id)
+        print("\nParameters: \n")
+        print("Network file:",net_file)
+        print("Route file:",route_file)
+        print("SUMO options: "+str(sumo_opt))
+        print("Output Directory:",output_folder)
+        print("Collect measures edges:",output_edges)
+        print("Collect measures trips:",output_trips)
+        print("Create log:",output_log)
+        print("<><><><><>")
 
 
-# sim info
-parser.add_argument('--gui', type=int, default=0)
-parser.add_argument('--sumo-opt', default="")
+
+    # Output Filenames
+    emissions_filename = f"{output_folder}edge_emissions.xml"
+    trip_info_filename = f"{output_folder}trips_info.xml"
+    add_file_filename = f"./tmp_folder_add_files/add_{simulation_id}.xml"
+    stats_filename = f"{output_folder}simulation_info.xml"
+    log_filename = f"{output_folder}log.json"
+
+
+    # The route stores are written as SUMO route files only now
+    if route_file.endswith(ROUTE_STORE_SUFFIX):
+        sumo_route_file = f"./tmp_folder_add_files/routes_{simulation_id}.rou.xml"
+        store_to_route_file(route_file, sumo_route_file)
+    else:
+        sumo_route_file = route_file
 
 
-args = parser.parse_args()
+    # Create additional file for the emissions
+    if output_edges and not live:
+        create_additional_file_emissions(emissions_filename, add_file_filename)
 
 
-# path to the xml2csv.py script
-path_sumo = shutil.which("sumo").replace("\\","/")
+    # Launch the SUMO simulation
 
-script_xml_csv = "./xml2csv.py"
+    opt_measures = ""
 
+    if output_edges and not live:
+        #absolute_path_add_file = os.path.abspath(add_file_filename)
+        opt_measures += f"-a {add_file_filename}"
 
-# Parameters
-net_file = args.net_file
-route_file = args.route_file
-experiment_id = args.exp_id
-results_folder = args.output_dir
+    if output_trips and not live:
+        opt_measures += f" --device.emissions.probability 1 --tripinfo-output {trip_info_filename}"
 
-output_edges = True if int(args.edges_info) == 1 else False
-output_trips = True if int(args.trips_info) == 1 else False
-output_log = True if int(args.log) == 1 else False
+    if output_log:
+        opt_measures += f" --statistic-output {stats_filename}"
 
-use_gui = True if int(args.gui) == 1 else False
+        # the trip statistics of the log need the tripinfo devices (without tripinfo output)
+        if live:
+            opt_measures += " --duration-log.statistics true"
+
+    if sumo_opt != "":
+        opt_measures += f" {sumo_opt}"
+
+    # Run command
+    if use_gui:
+        command_sumo = f"sumo-gui -n {net_file} -r {sumo_route_file} -W {opt_measures}".split()
+    else:
+        command_sumo = f"sumo -n {net_file} -r {sumo_route_file} -W {opt_measures}".split()
+
+    if live:
+        # TraCI is needed only here
+        from sumo_live import run_live_simulation
+
+        if verbose:
+            print("Simulation started (live measures).")
+
+        try:
+            trip_columns, edge_columns = run_live_simulation(command_sumo, timeout=timeout, 
+                                                             stdout=None if verbose else subprocess.DEVNULL)
+        finally:
+            if sumo_route_file != route_file:
+                os.remove(sumo_route_file)
+
+    else:
+        sumo_output = None if verbose else subprocess.DEVNULL
+        script = subprocess.Popen(command_sumo, cwd=".", stdout=sumo_output, stderr=sumo_output)
 
-sumo_opt = args.sumo_opt
+        if verbose:
+            print("Simulation started.")
 
+        try:
+            returncode = script.wait(timeout=timeout)
+        except BaseException:
+            # timeout or interruption (e.g., the pool of launcher_traffico2 is terminated)
+            script.kill()
+            script.wait()
+            raise
+        finally:
+            if sumo_route_file != route_file:
+                os.remove(sumo_route_file)
 
+        if returncode != 0:
+            raise RuntimeError(f"SUMO exited with code {returncode} (simulation {simulation_id})")
 
-# Create a simulation identifier
-simulation_id = f"{experiment_id}{create_sim_id(rand_int=True)}"
+    if verbose:
+        print("Simulation ended!")
 
 
-# create a folder in the output directory with a name equal to the simulation id
-output_folder = results_folder+simulation_id+"/"
-if not os.path.exists(output_folder):
-    os.makedirs(output_folder)
 
+    # Save the columns of the edges and of the trips (.npz, see sumo_outputs.py), extracted from the XML outputs if not live
 
-print("TraffiCO2 version 3.0")
-print("\nSimulation id: "+simulation_id)
-print("\nParameters: \n")
-print("Network file:",net_file)
-print("Route file:",route_file)
-print("SUMO options: "+str(sumo_opt))
-print("Output Directory:",output_folder)
-print("Collect measures edges:",output_edges)
-print("Collect measures trips:",output_trips)
-print("Create log:",output_log)
-print("<><><><><>") 
+    # Edge Emissions
 
-    
+    if output_edges:
 
-# Output Filenames
-emissions_filename = f"{output_folder}edge_emissions.xml"
-trip_info_filename = f"{output_folder}trips_info.xml"
-add_file_filename = f"./tmp_folder_add_files/add_{simulation_id}.xml"
-stats_filename = f"{output_folder}simulation_info.xml"
-log_filename = f"{output_folder}log.json"
+        if not live:
+            edge_columns = extract_edge_data(emissions_filename)
 
+            # Remove unnecessary files
+            # Emissions
+            os.remove(emissions_filename)
 
-# Create additional file for the emissions
-if output_edges:
-    create_additional_file_emissions(emissions_filename, add_file_filename)
+            # Additional File for emissions
+            os.remove(add_file_filename)
 
+        save_columns(edge_columns, emissions_filename.replace(".xml", ".npz"))
 
-# Launch the SUMO simulation
 
-opt_measures = ""
 
-if output_edges:
-    #absolute_path_add_file = os.path.abspath(add_file_filename)
-    opt_measures += f"-a {add_file_filename}"
-    
-if output_trips:
-    opt_measures += f" --device.emissions.probability 1 --tripinfo-output {trip_info_filename}"
-    
-if output_log:   
-    opt_measures += f" --statistic-output {stats_filename}"
+    # Trip Info
+    total_co2_mg = None
 
-if sumo_opt != "":
-    opt_measures += f" {sumo_opt}"
+    if output_trips:
 
-# Run command
-if use_gui:
-    command_sumo = f"sumo-gui -n {net_file} -r {route_file} -W {opt_measures}".split(" ")
-else:
-    command_sumo = f"sumo -n {net_file} -r {route_file} -W {opt_measures}".split(" ")
+        if not live:
+            trip_columns = extract_tripinfo(trip_info_filename)
 
-script = subprocess.Popen(command_sumo, cwd=".")   
-    
-    
-print("Simulation started.")
-script.wait()
-print("Simulation ended!")
+            # Trips
+            os.remove(trip_info_filename)
 
+        save_columns(trip_columns, trip_info_filename.replace(".xml", ".npz"))
 
+        total_co2_mg = float(np.nansum(trip_columns["emissions_CO2_abs"]))
 
-# Convert XML to CSV
+        if verbose:
+            print(f"Total CO2 (mg): {total_co2_mg}")
+            print(f"Total CO2 (tons): {total_co2_mg/1e9}")
 
-# Edge Emissions
 
-if output_edges:
-    
-    convert_xml_to_csv(emissions_filename, emissions_filename.replace(".xml", ".csv"))
-    df = pd.read_csv(emissions_filename.replace(".xml", ".csv"), sep=";")
+    if output_log:
+        # Log File
+        # Parse the XML file for the statistics
+        tree = ET.parse(stats_filename)
+        root = tree.getroot()
 
-    ''' uncomment to save all the info about the edges
-    df_edge = df[["edge_id", "edge_CO2_abs", "edge_CO_abs", 
-                  "edge_HC_abs", "edge_NOx_abs", "edge_PMx_abs",
-                  "edge_fuel_abs", "edge_traveltime"]]
-    '''
-    
-    # added to save disk space
-    df_edge = df[["edge_id", "edge_CO2_abs", "edge_traveltime"]]
 
-    df_edge.to_csv(emissions_filename.replace(".xml", ".csv.gz"), compression='zip', index=False)
-    
-    # Remove unnecessary files
-    # Emissions
-    os.remove(emissions_filename)
-    os.remove(emissions_filename.replace(".xml", ".csv"))
-    
-    # Additional File for emissions
-    os.remove(add_file_filename)
-    
+        dict_log = {}
+        dict_log["id"] = simulation_id
+        dict_log["net_filename"] = net_file
+        dict_log["route_filename"] = route_file
+        dict_log["total_co2"] = total_co2_mg
 
+        if sim_key != "":
+            dict_log["key"] = sim_key
+        dict_log["mix"] = mix_info if mix_info is not None else {}
+        dict_log["live"] = live
 
+        # version of SUMO (asked once per sweep by launcher_traffico2)
+        if sumo_version is None:
+            sumo_version = get_sumo_version()
+        dict_log["sumo_version"] = sumo_version
 
+        tags_to_include = ["performance", "vehicles", "teleports", "safety", "vehicleTripStatistics"]
 
-# Trip Info
-if output_trips:
-    
-    convert_xml_to_csv(trip_info_filename, trip_info_filename.replace(".xml", ".csv"))
-    df = pd.read_csv(trip_info_filename.replace(".xml", ".csv"), sep=";")
+        for tag in tags_to_include:
+            elements = root.findall(f'.//{tag}')
+            dict_log[tag] = elements[0].attrib
 
-    ''' uncomment to save all the info about the trips
-    df_trips = df[["tripinfo_id", "tripinfo_duration", "tripinfo_routeLength", "tripinfo_stopTime", 
-        "tripinfo_timeLoss", "tripinfo_waitingCount", "tripinfo_waitingTime", 'emissions_CO2_abs', 
-                   'emissions_CO_abs', 'emissions_HC_abs','emissions_NOx_abs', 'emissions_PMx_abs', 
-                   'emissions_electricity_abs','emissions_fuel_abs']]
-    '''
+        # Write the dictionary to a JSON file
+        with open(log_filename, 'w') as json_file:
+            json.dump(dict_log, json_file)
 
-    # added to save disk space
-    df_trips = df[["tripinfo_id", "tripinfo_duration", "tripinfo_routeLength", "tripinfo_stopTime", 
-        "tripinfo_timeLoss", "tripinfo_waitingCount", "tripinfo_waitingTime", 'emissions_CO2_abs']]
-    
-    
-    df_trips.to_csv(trip_info_filename.replace(".xml", ".csv.gz"), compression='zip', index=False)
-    total_co2_mg = df_trips["emissions_CO2_abs"].sum()
+        os.remove(stats_filename)
 
-    print(f"Total CO2 (mg): {total_co2_mg}")
-    print(f"Total CO2 (tons): {total_co2_mg/1e9}")
-    
-    # Trips
-    os.remove(trip_info_filename)
-    os.remove(trip_info_filename.replace(".xml", ".csv"))
+    return output_folder
 
 
-if output_log:
-    # Log File
-    # Parse the XML file for the statistics
-    tree = ET.parse(stats_filename)
-    root = tree.getroot()
 
+if __name__ == "__main__":
 
-    dict_log = {}
-    dict_log["id"] = simulation_id
-    dict_log["net_filename"] = net_file
-    dict_log["route_filename"] = route_file
-    dict_log["total_co2"] = total_co2_mg
+    # Parse the arguments
 
-    # Execute the SUMO command to get the version
-    command_output = subprocess.check_output(["sumo", "--version"]).decode("utf-8")
-    sumo_version = command_output.splitlines()[0].split()[-1]
-    dict_log["sumo_version"] = sumo_version
+    parser = argparse.ArgumentParser()
 
-    tags_to_include = ["performance", "vehicles", "teleports", "safety", "vehicleTripStatistics"]
+    # network and route file
+    parser.add_argument('-n', '--net-file', required=True)
+    parser.add_argument('-r', '--route-file', required=True)
 
-    for tag in tags_to_include:
-        elements = root.findall(f'.//{tag}')
-        dict_log[tag] = elements[0].attrib
+    # experiment info
+    parser.add_argument('-i', '--exp-id', required=True)
+    parser.add_argument('-o', '--output-dir', required=True)
+    parser.add_argument('--sim-key', default="", help="Key of the simulation (deterministic output folder), random if empty")
+    parser.add_argument('--mix-info', default="{}", help="JSON with the info about the mix (e.g., pct and rep) saved in the log")
 
-    # Write the dictionary to a JSON file
-    with open(log_filename, 'w') as json_file:
-        json.dump(dict_log, json_file)
+    # output
+    parser.add_argument('--edges-info', type=int, default=1)
+    parser.add_argument('--trips-info', type=int, default=1)
+    parser.add_argument('--log', type=int, default=1)
 
-    os.remove(stats_filename)
 
+    # sim info
+    parser.add_argument('--gui', type=int, default=0)
+    parser.add_argument('--sumo-opt', default="")
+    parser.add_argument('--live', type=int, default=0, help="Aggregate the measures during the simulation (TraCI/libsumo) instead of using the XML outputs")
+    parser.add_argument('--sumo-version', default=None, help="Version of SUMO for the log (asked to SUMO if missing)")
 
 
+    args = parser.parse_args()
 
+    run_simulation(args.net_file, args.route_file, args.exp_id, args.output_dir, sim_key=args.sim_key,
+                   mix_info=json.loads(args.mix_info), output_edges=int(args.edges_info) == 1,
+                   output_trips=int(args.trips_info) == 1, output_log=int(args.log) == 1,
+                   use_gui=int(args.gui) == 1, sumo_opt=args.sumo_opt, sumo_version=args.sumo_version,
+                   live=int(args.live) == 1)
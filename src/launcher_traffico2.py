@@ -4,49 +4,118 @@ warnings.filterwarnings("ignore")  # Ignore warnings for cleaner output
 import numpy as np
 import os
 import json
-from utils_mobility_demand import create_mixed_route_demands, create_mixed_route_demands_interplay, load_route_file_in_dict
+from utils_mobility_demand import (iter_mixed_route_demands, iter_mixed_route_demands_interplay, mixed_demand_filename, 
+                                   write_mixed_route_demand)
 import time
 import subprocess
 import pandas as pd
 from collections import defaultdict
 import shutil
-import multiprocessing
-from routing_measures import redundancy, distinct_edges_traveled
+from routing_measures import redundancy_encoded, distinct_edges_encoded, redundancy_edge_counts
+from simulation_jobs import run_jobs, JobPool, init_pool_worker, file_sha1, get_sumo_version, simulation_key, load_manifest, add_to_manifest, simulation_completed
+from route_store import find_route_file
+from launcher_sumo_simulation import run_simulation
+import hashlib
 import argparse
 
-def split_list(input_list, chunk_size):
+def compute_measures_demand(mixed_demand):
     """
-    Split a list into smaller chunks of a specified size.
+    Compute redundancy and the number of distinct edges traveled for a mixed demand.
     
     Args:
-    input_list (list): List to be split.
-    chunk_size (int): Size of each chunk.
-    
+    mixed_demand (dict): Route store of the mixed demand (see assemble_mixed_demand).
+
     Returns:
-    list of lists: List containing the chunks.
+    dict: {"redundancy": redundancy, "n_edges": number of distinct edges traveled}.
     """
-    return [input_list[i:i + chunk_size] for i in range(0, len(input_list), chunk_size)]
+    # counts of the edges updated incrementally (nested mixes)
+    if "edge_counts" in mixed_demand:
+        edge_counts = mixed_demand["edge_counts"]
+        return {"redundancy": redundancy_edge_counts(edge_counts), "n_edges": int(np.count_nonzero(edge_counts))}
 
-def compute_measures_route(route, shared_list):
-    """
-    Compute redundancy and the number of distinct edges traveled for a given route.
+    # integer-encoded edges of all the paths
+    edges = mixed_demand["edges"]
     
-    Args:
-    route (str): Path to the route file.
-    shared_list (list): Shared list to store the results.
+    return {"redundancy": redundancy_encoded(edges), "n_edges": len(distinct_edges_encoded(edges))}
+
+def start_simulation(job):
     """
-    pct = int(route.split("/")[-1].split("_")[1])
-    n_rep = int(route.split("/")[-1].split("_")[-1].split(".")[0])
-    
-    dict_route = load_route_file_in_dict(route)
-    path_list = [dict_route[k]["edges"] for k in dict_route]
-    
-    # Calculate redundancy and distinct traveled edges
-    red = redundancy(path_list)
-    n_edges = len(distinct_edges_traveled(path_list))
+    Start the SUMO simulation of a job: run_simulation in a worker of the pool, or 
+    launcher_sumo_simulation.py in a subprocess. 
+    The route file is written when the job starts for the first time.
+    """
+    if "mixed_demand" in job:
+        job["route_file"] = write_mixed_route_demand(job.pop("mixed_demand"), job["route_file"], 
+                                                     lane_best=True, compress=True, checksum=args.checksum == 1)
+
+    if pool is not None:
+        kwargs = {"sim_key": job["key"], "mix_info": job["cell"], "sumo_opt": sumo_opt.replace('"', ""), 
+                  "sumo_version": sumo_version, "timeout": timeout, "verbose": False, "live": args.live == 1}
+        return pool.submit(run_simulation, road_net, job["route_file"], sim_id + '_', output_simulations, **kwargs)
+
+    s = f"-n {road_net} -r {job['route_file']} -i {sim_id + '_'} -o {output_simulations} --sim-key {job['key']}"
+    command_list = ['python', "launcher_sumo_simulation.py"] + s.split(" ") + ["--sumo-opt", sumo_opt.replace('"', ""), 
+                                                                             "--mix-info", json.dumps(job["cell"]), 
+                                                                             "--sumo-version", sumo_version, "--live", str(args.live)]
+
+    return subprocess.Popen(command_list, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+def end_simulation(job_id, job, status):
+    """
+    Delete the route file of a job when its simulation ends, and record the completed simulations in the manifest.
+    """
+    if status == "done":
+        add_to_manifest(output_simulations, job["key"], f"{sim_id}_{job['key']}", job["cell"], job["spec"])
+    else:
+        print(f"Simulation of {job['cell']} failed.")
+    os.remove(job["route_file"])
+
+def mix_spec(pct, rep):
+    """
+    Specification of the simulation of a mix: hashes of the inputs, mix, SUMO options and version.
+    """
+    if pct == 0:
+        routed = "none"
+    elif pct == 100:
+        routed = "all"
+    else:
+        routed = hashlib.sha1(json.dumps(dict_set_vehicles[str(pct)][str(rep)]).encode("utf-8")).hexdigest()
+
+    spec = {"net": dict_input_sha1["net"], "base": dict_input_sha1["base"], "navigators": dict_input_sha1["navigators"], 
+            "navigator": navigator, "pct": int(pct), "rep": int(rep), "routed": routed, "nested": args.nested == 1, 
+            "sumo_opt": sumo_opt, "sumo_version": sumo_version}
+
+    # the live measures approximate the ones of the XML outputs (the keys of the other simulations do not change)
+    if args.live == 1:
+        spec["live"] = True
+
+    # the (non-nested) split among the interplay navigators is drawn from this seed, 
+    # the keys of the former unseeded splits do not match
+    if navigator == "interplay" and args.nested == 0:
+        spec["split_seed"] = interplay_seed
+
+    return spec
+
+def simulation_jobs(mixed_demands):
+    """
+    Jobs (job ID, job) of the mixed demands, generated lazily. 
+    The measures on the demands are computed when they are generated (also for the jobs already done).
+    """
+    for pct, rep, mixed_demand in mixed_demands:
+
+        dict_measures_routes[int(pct)][rep] = compute_measures_demand(mixed_demand)
+
+        spec = mix_spec(pct, rep)
+        key = simulation_key(spec)
+
+        # skip the simulations already done with the same inputs
+        if args.skip_done == 1 and simulation_completed(output_simulations, manifest, key):
+            continue
 
-    # Append results to the shared list
-    shared_list.append({"pct": pct, "n_rep": n_rep, "red": red, "n_edges": n_edges})
+        route_filename = mixed_demand_filename(navigator, pct, rep)
+
+        yield key, {"route_file": output_folder_MRP+route_filename, "mixed_demand": mixed_demand, 
+                    "key": key, "spec": spec, "cell": {"pct": int(pct), "rep": int(rep)}}
 
 # Parse command-line arguments
 parser = argparse.ArgumentParser()
@@ -68,6 +137,14 @@ parser.add_argument('-z', '--zipped', type=int, default=0, help="Zipped option")
 parser.add_argument('--rep-min', type=int, default=0, help="Minimum repetition")
 parser.add_argument('--rep-max', type=int, default=9, help="Maximum repetition")
 parser.add_argument('--njobs', type=int, default=20, help="Number of parallel jobs")
+parser.add_argument('--checksum', type=int, default=0, help="Check the route files written (SHA-1)")
+parser.add_argument('--timeout', type=float, default=0, help="Timeout of each simulation in seconds (0: no timeout)")
+parser.add_argument('--timeout-margin', type=float, default=120, help="Seconds added to the timeout before stopping a worker of the pool that does not return")
+parser.add_argument('--retries', type=int, default=1, help="Number of retries of a failed simulation")
+parser.add_argument('--in-process', type=int, default=1, help="Run the simulations in a pool of worker processes (0: a python subprocess per simulation)")
+parser.add_argument('--skip-done', type=int, default=1, help="Skip the simulations already done with the same inputs (see the manifest)")
+parser.add_argument('--live', type=int, default=0, help="Aggregate the measures during the simulations (TraCI/libsumo) instead of using the XML outputs of SUMO")
+parser.add_argument('--nested', type=int, default=0, help="Nested mixes (the vehicles routed at each pct include the ones of the lower pcts)")
 
 # Parse arguments
 args = parser.parse_args()
@@ -110,66 +187,90 @@ road_net = args.road_network
 # SUMO simulation options
 sumo_opt = '"--tls.actuated.jam-threshold 30 --ignore-junction-blocker 5 --time-to-impatience 20 --time-to-teleport 120"'
 
-# Create the mixed routed demands (MRD)
+# The mixed routed demands (MRD) are generated lazily: 
+# each route file is written right before its simulation and deleted when the simulation ends
+base_sha1 = file_sha1(path_demand_base)
+
+# seed of the split of the routed vehicles among the interplay navigators (drawn for each pct and rep), 
+# so that the split is the same for the same inputs, as the key of the simulation
+interplay_seed = int(base_sha1[:8], 16)
+
 if navigator == "interplay":
     print("Interplay")
 
     list_navs_interplay = ["gmaps", "tomtomFastest", "mapbox", "bing"]
     path_folder_routed_navs = f"../data/{city}/routed_paths/N{n_vehicles}/routed_paths_{city}_N{n_vehicles}_"
     
-    list_process = []
-    for pct in percentages:
-        process = multiprocessing.Process(
-            target=create_mixed_route_demands_interplay, 
-            args=(navigator, list_navs_interplay, path_demand_base, path_folder_routed_navs, 
-                  path_dict_set, output_folder_MRP, n_rep_min, n_rep_max, [pct], True, True)
-        )
-        list_process.append(process)
-    for process in list_process:
-        process.start()
-    for process in list_process:
-        process.join()
+    mixed_demands = iter_mixed_route_demands_interplay(navigator, list_navs_interplay, path_demand_base, path_folder_routed_navs, 
+                                                       path_dict_set, n_rep_min=n_rep_min, n_rep_max=n_rep_max, percentages=percentages, 
+                                                       nested=args.nested == 1, seed=interplay_seed)
 else:
     print("Standard Navigator")
-    if njobs >= len(percentages):
-        list_process = []
-        for pct in percentages:
-            process = multiprocessing.Process(
-                target=create_mixed_route_demands, 
-                args=(navigator, path_demand_base, path_demand_navigator, path_dict_set, 
-                      output_folder_MRP, n_rep_min, n_rep_max, [pct], True, True)
-            )
-            list_process.append(process)
-        for process in list_process:
-            process.start()
-        for process in list_process:
-            process.join()
-    else:
-        create_mixed_route_demands(navigator, path_demand_base, path_demand_navigator, path_dict_set, 
-                                   output_folder_MRP, n_rep_min=n_rep_min, n_rep_max=n_rep_max, 
-                                   percentages=percentages, lane_best=True, compress=True)
 
-# Simulate the MRP using SUMO
-routes_list = [output_folder_MRP + f for f in os.listdir(output_folder_MRP) if "rou.xml" in f]
-print(f"There are {len(routes_list)} mixed routed paths (MRP) to simulate.")
+    mixed_demands = iter_mixed_route_demands(navigator, path_demand_base, path_demand_navigator, path_dict_set, 
+                                             n_rep_min=n_rep_min, n_rep_max=n_rep_max, percentages=percentages, 
+                                             nested=args.nested == 1)
 
-# Create the route chunks
-chunk_size = njobs
-routes_chunks = split_list(routes_list, chunk_size)
+n_routes = sum([1 if pct in [0, 100] else n_rep_max-n_rep_min+1 for pct in percentages])
+print(f"There are {n_routes} mixed routed paths (MRP) to simulate.")
+
+os.makedirs(output_folder_MRP, exist_ok=True)
 
 # Record the start time
 start_time = time.time()
 
-for routes_to_simulate in routes_chunks:
-    processes = []
-    for route_file in routes_to_simulate:
-        s = f"-n {road_net} -r {route_file} -i {sim_id + '_'} -o {output_simulations}"
-        command_list = ['python', "launcher_sumo_simulation.py"] + s.split(" ") + ["--sumo-opt", sumo_opt.replace('"', "")]
+# Measures on the MRP, computed on the demands before writing them
+dict_measures_routes = {int(pct): {} for pct in percentages}
+
+# Each simulation is identified by a key computed from its inputs: the simulations 
+# already in the manifest of the output folder with the same key are not run again
+sumo_version = get_sumo_version()
+
+with open(path_dict_set) as json_file:
+    dict_set_vehicles = json.load(json_file)
+
+if navigator == "interplay":
+    paths_navigators = [find_route_file(f"{path_folder_routed_navs}{nav}") for nav in list_navs_interplay]
+else:
+    paths_navigators = [path_demand_navigator]
+
+dict_input_sha1 = {"net": file_sha1(road_net), "base": base_sha1, 
+                   "navigators": [file_sha1(path) for path in paths_navigators]}
+
+manifest = load_manifest(output_simulations)
+
+# Simulate the MRP using SUMO: a new simulation starts as soon as one of the njobs ends.
+# The state of the jobs is saved (next to the MRPs), so that an interrupted run skips the simulations already done
+state_filename = f"{output_folder_MRP}jobs_state_{n_rep_min}_{n_rep_max}.json"
 
-        script = subprocess.Popen(command_list, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        processes.append(script)
-    for process in processes:
-        process.wait()
+timeout = args.timeout if args.timeout > 0 else None
+
+# Long-lived workers (imports loaded once), the timeout is applied by run_simulation. 
+# A worker that dies (e.g., OOM killer, segfault) fails its simulation, which is retried; 
+# the timeout of run_jobs (plus a margin for the outputs) stops the workers that hang
+pool = JobPool(njobs, initializer=init_pool_worker) if args.in_process == 1 else None
+
+if pool is not None and timeout is not None:
+    jobs_timeout = timeout + args.timeout_margin
+else:
+    jobs_timeout = timeout
+
+try:
+    state = run_jobs(simulation_jobs(mixed_demands), start_simulation, njobs, timeout=jobs_timeout, 
+                     max_retries=args.retries, state_filename=state_filename, end_job=end_simulation)
+except BaseException:
+    # interrupted: stop the workers and their simulations
+    if pool is not None:
+        pool.kill_workers()
+    raise
+
+if pool is not None:
+    pool.shutdown()
+
+failed_jobs = [job_id for job_id in state["jobs"] if state["jobs"][job_id]["status"] != "done"]
+
+if len(failed_jobs) > 0:
+    print(f"{len(failed_jobs)} simulations failed (rerun to retry them).")
 
 # Record the end time
 end_time = time.time()
@@ -178,41 +279,14 @@ end_time = time.time()
 elapsed_time = end_time - start_time
 print("Elapsed Time:", elapsed_time, "seconds")
 
-# Compute measures on the MRP
+# Save the measures on the MRP
 output_folder_route_measures = f"../data/route_measures/{city}/{navigator}_{demand_name_result}/"
 os.makedirs(output_folder_route_measures, exist_ok=True)
 
-# Shared list to store results
-manager = multiprocessing.Manager()
-result_list = manager.list()
-
-routes_chunks = split_list(routes_list, chunk_size)
-
-for routes_to_simulate in routes_chunks:
-    list_process = []
-    for route in routes_to_simulate:
-        process = multiprocessing.Process(target=compute_measures_route, args=(route, result_list))
-        list_process.append(process)
-    for process in list_process:
-        process.start()
-    for process in list_process:
-        process.join()
-
-# Process the results
-result_list = list(result_list)
-dict_measures_routes = {int(pct): {} for pct in percentages}
-
-for elem in result_list:
-    pct = int(elem["pct"])
-    n_rep = int(elem["n_rep"])
-    red = elem["red"]
-    n_edges = elem["n_edges"]
-
-    dict_measures_routes[pct][n_rep] = {"redundancy": red, "n_edges": n_edges}
-
 # Save results to JSON file
 with open(f"{output_folder_route_measures}route_measures_{n_rep_min}_{n_rep_max}.json", 'w') as json_file:
     json.dump(dict_measures_routes, json_file)
 
-# Delete the non-necessary files (MRPs)
-shutil.rmtree(output_folder_MRP)
+# Delete the folder of the MRPs (kept with the state of the jobs if some failed)
+if len(failed_jobs) == 0:
+    shutil.rmtree(output_folder_MRP)
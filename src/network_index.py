@@ -0,0 +1,194 @@
+import numpy as np
+from collections.abc import Mapping
+
+
+""" Compact lookups of the igraph road networks (sorted arrays of keys with a read-only dictionary interface) and road networks made only of arrays """
+
+
+class SortedKeyIndex(Mapping):
+    """
+    Read-only mapping stored as arrays: the keys are sorted once and looked up with a
+    binary search, the values are an array (or a dictionary of arrays) aligned with the keys.
+
+    It keeps the semantics of the dictionaries it replaces (G['edge_sumo_ig'][edge_id],
+    edge_id in G['edge_sumo_ig'], .get, .keys, .items, iteration in insertion order),
+    and positions() looks up an array of keys at once.
+    """
+
+    def __init__(self, keys, values, order=None):
+        keys = np.asarray(keys)
+        self.order = np.argsort(keys, kind="stable") if order is None else order
+        self.sorted_keys = keys[self.order]
+        self.values = values
+
+    @classmethod
+    def from_sorted(cls, sorted_keys, order, values):
+        """
+        Returns an index of keys already sorted (sorted_keys is keys[order]), e.g. arrays
+        in shared memory: the arrays are used as they are, without copies.
+        """
+        index = cls.__new__(cls)
+        index.order = order
+        index.sorted_keys = sorted_keys
+        index.values = values
+        return index
+
+    def with_values(self, values):
+        """
+        Returns an index with the same keys (sorted only once) and different values.
+        """
+        index = self.__class__.__new__(self.__class__)
+        index.__dict__.update(self.__dict__)
+        index.values = values
+        return index
+
+    def encode_key(self, key):
+        return key
+
+    def decode_key(self, key):
+        return key.item()
+
+    def positions(self, keys):
+        """
+        Positions (in insertion order) of an array of keys, -1 for the missing keys.
+        """
+        keys = self.encode_key(np.asarray(keys))
+        if len(self.sorted_keys) == 0:
+            return np.full(np.shape(keys), -1, dtype=np.int64)
+        ind_clip = np.minimum(self.sorted_keys.searchsorted(keys), len(self.sorted_keys)-1)
+        found = self.sorted_keys[ind_clip] == keys
+        return np.where(found, self.order[ind_clip], -1)
+
+    def position(self, key):
+        """
+        Position (in insertion order) of a single key, -1 if missing.
+        """
+        try:
+            key = self.encode_key(key)
+            ind = int(self.sorted_keys.searchsorted(key))
+        except (TypeError, ValueError):
+            # a key of another type (e.g., an integer in an index of strings) is not in the index
+            return -1
+        if ind < len(self.sorted_keys) and self.sorted_keys[ind] == key:
+            return int(self.order[ind])
+        return -1
+
+    def value(self, pos):
+        if isinstance(self.values, dict):
+            return {name: column[pos].item() for name, column in self.values.items()}
+        return self.values[pos].item()
+
+    def __getitem__(self, key):
+        pos = self.position(key)
+        if pos < 0:
+            raise KeyError(key)
+        return self.value(pos)
+
+    def __contains__(self, key):
+        return self.position(key) >= 0
+
+    def __len__(self):
+        return len(self.sorted_keys)
+
+    def __iter__(self):
+        inverse = np.empty(len(self.order), dtype=np.int64)
+        inverse[self.order] = np.arange(len(self.order))
+        for key in self.sorted_keys[inverse]:
+            yield self.decode_key(key)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({len(self)} keys)"
+
+
+class VertexPairIndex(SortedKeyIndex):
+    """
+    SortedKeyIndex keyed by (source, target) pairs of vertices, encoded as source*n_vertices+target.
+    """
+
+    def __init__(self, n_vertices, sources, targets, values):
+        self.n_vertices = max(int(n_vertices), 1)
+        super().__init__(np.asarray(sources, dtype=np.int64)*self.n_vertices + np.asarray(targets, dtype=np.int64), values)
+
+    def encode_key(self, key):
+        key = np.asarray(key, dtype=np.int64)
+        if key.shape[-1:] != (2,):
+            raise ValueError("The keys must be (source, target) pairs")
+        return key[..., 0]*self.n_vertices + key[..., 1]
+
+    def decode_key(self, key):
+        return divmod(int(key), self.n_vertices)
+
+
+class RaggedKeyIndex(SortedKeyIndex):
+    """
+    SortedKeyIndex whose values are lists, stored as a flat array and its offsets (values is
+    the pair (flat, offsets)): the value at position pos is flat[offsets[pos]:offsets[pos+1]]
+    (e.g., SUMO node -> sub-vertices).
+    """
+
+    def value(self, pos):
+        flat, offsets = self.values
+        return flat[offsets[pos]:offsets[pos+1]].tolist()
+
+
+class ArrayEdgeSequence:
+    """
+    Edges of an ArrayNetwork, as G.es of igraph: es[name] is the list of the values of an
+    attribute, es[edges] the sequence of some edges (es[edges][name] their values), and
+    es[name] = values sets an attribute of all the edges.
+    """
+
+    def __init__(self, attributes, edges=None):
+        self.attributes = attributes
+        self.edges = edges
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            column = self.attributes[key]
+            return (column if self.edges is None else column[self.edges]).tolist()
+        return ArrayEdgeSequence(self.attributes, np.asarray(key, dtype=np.int64))
+
+    def __setitem__(self, name, values):
+        if self.edges is not None:
+            raise ValueError("Only the attributes of all the edges can be set")
+        self.attributes[name] = np.asarray(values)
+
+    def attribute_names(self):
+        return list(self.attributes)
+
+    def __len__(self):
+        if self.edges is None:
+            return len(next(iter(self.attributes.values()))) if len(self.attributes) > 0 else 0
+        return len(self.edges)
+
+
+class ArrayNetwork:
+    """
+    Read-only road network made of arrays, without an igraph graph (see
+    routing_utils.attach_igraph_network). It has the part of the igraph interface used by the
+    scipy backend: the graph attributes (G[name], G.attributes()), the edge attributes
+    (G.es, see ArrayEdgeSequence), vcount() and ecount().
+    """
+
+    def __init__(self, n_vertices, edge_attributes, graph_attributes=None):
+        self.n_vertices = int(n_vertices)
+        self.es = ArrayEdgeSequence(dict(edge_attributes))
+        self.graph_attributes = {} if graph_attributes is None else dict(graph_attributes)
+
+    def attributes(self):
+        return list(self.graph_attributes)
+
+    def __getitem__(self, name):
+        return self.graph_attributes[name]
+
+    def __setitem__(self, name, value):
+        self.graph_attributes[name] = value
+
+    def vcount(self):
+        return self.n_vertices
+
+    def ecount(self):
+        return len(self.es)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.vcount()} vertices, {self.ecount()} edges)"
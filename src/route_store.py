@@ -0,0 +1,363 @@
+import numpy as np
+import os
+import gzip
+import hashlib
+import itertools
+import struct
+import zipfile
+import xml.etree.ElementTree as ET
+
+
+""" Routed paths: route stores (integer-encoded ragged arrays in an uncompressed .npz file) and SUMO route files """
+
+
+# extension of the route stores (next to the SUMO route files .rou.xml / .rou.xml.gz)
+ROUTE_STORE_SUFFIX = ".rou.npz"
+
+
+def encode_routes(vehicles, comment=""):
+    """
+    Encodes the routes of a list of vehicles as a route store.
+
+    Parameters:
+        vehicles: Iterable of (vehicle ID, departure time, list of edge IDs), consumed in a single pass.
+        comment: Text stored with the routes (e.g., the seed of the routing).
+
+    Returns:
+        A dictionary of arrays:
+        - 'vehicle_ids': IDs of the vehicles (str)
+        - 'time': departure times (float64)
+        - 'edge_ids': vocabulary of the edges (in order of first appearance)
+        - 'edges', 'offsets': the route of vehicle k is edge_ids[edges[offsets[k]:offsets[k+1]]] (int32 codes)
+        - 'comment': 0-d str array
+    """
+
+    vehicle_ids, times, edges, route_lengths = [], [], [], []
+    vocabulary = {}
+
+    for v_id, dep_time, route in vehicles:
+        edges += [vocabulary.setdefault(e, len(vocabulary)) for e in route]
+        vehicle_ids.append(str(v_id))
+        times.append(float(dep_time))
+        route_lengths.append(len(route))
+
+    return {"vehicle_ids": np.array(vehicle_ids, dtype=str),
+            "time": np.array(times, dtype=np.float64),
+            "edge_ids": np.array(list(vocabulary.keys()), dtype=str),
+            "edges": np.array(edges, dtype=np.int32),
+            "offsets": np.r_[0, np.cumsum(route_lengths, dtype=np.int64)],
+            "comment": np.array(comment, dtype=str)}
+
+
+def route_store_routes(route_store):
+    """
+    Decodes the routes of a route store: list (one per vehicle) of lists of edge IDs.
+    """
+
+    all_edges = route_store["edge_ids"][route_store["edges"]].tolist()
+    offsets = route_store["offsets"].tolist()
+
+    return [all_edges[offsets[k]:offsets[k+1]] for k in range(len(offsets)-1)]
+
+
+def gather_routes(edges, offsets, rows):
+    """
+    Gathers the routes of the given rows of ragged arrays (edges, offsets).
+
+    Returns:
+        tuple: (edges, offsets) of the routes of rows, in the order of rows.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    starts = offsets[rows]
+    lengths = offsets[rows+1] - starts
+
+    new_offsets = np.r_[0, np.cumsum(lengths, dtype=np.int64)]
+    # position in edges of each edge of the gathered routes
+    index = np.arange(new_offsets[-1], dtype=np.int64) + np.repeat(starts - new_offsets[:-1], lengths)
+
+    return edges[index], new_offsets
+
+
+def stack_route_stores(route_stores, vehicle_ids):
+    """
+    Stacks the routes of several route stores (e.g., the same vehicles routed by different navigators) 
+    over a common vocabulary of the edges.
+
+    Parameters:
+        route_stores: List of route stores.
+        vehicle_ids: Vehicle IDs the rows are aligned on (same type of the 'vehicle_ids' of the stores).
+
+    Returns:
+        A dictionary with:
+        - 'edge_ids', 'edges', 'offsets': vocabulary and routes of all the stores, one after the other
+        - 'rows': array (n stores x n vehicles), row in 'offsets' of the route of each vehicle 
+          in each store (-1 if the vehicle is not in the store)
+    """
+    vehicle_ids = np.asarray(vehicle_ids)
+    vocabulary = {}
+    list_edges, list_offsets, rows = [], [], np.full((len(route_stores), len(vehicle_ids)), -1, dtype=np.int64)
+    n_rows, n_edges = 0, 0
+
+    for k, route_store in enumerate(route_stores):
+        # codes of the store -> codes of the common vocabulary
+        codes = np.array([vocabulary.setdefault(e, len(vocabulary)) for e in route_store["edge_ids"].tolist()], dtype=np.int32)
+        list_edges.append(codes[route_store["edges"]])
+        list_offsets.append(route_store["offsets"][:-1] + n_edges)
+
+        store_ids = np.asarray(route_store["vehicle_ids"])
+        sorter = np.argsort(store_ids, kind="stable")
+        pos = np.searchsorted(store_ids, vehicle_ids, sorter=sorter).clip(max=max(len(store_ids)-1, 0))
+        found = store_ids[sorter[pos]] == vehicle_ids if len(store_ids) > 0 else np.zeros(len(vehicle_ids), dtype=bool)
+        rows[k, found] = sorter[pos[found]] + n_rows
+
+        n_rows += len(store_ids)
+        n_edges += len(route_store["edges"])
+
+    return {"edge_ids": np.array(list(vocabulary.keys()), dtype=str),
+            "edges": np.concatenate(list_edges) if list_edges else np.zeros(0, dtype=np.int32),
+            "offsets": np.r_[np.concatenate(list_offsets) if list_offsets else np.zeros(0, dtype=np.int64), n_edges],
+            "rows": rows}
+
+
+def save_route_store(route_store, filename):
+    """
+    Saves a route store in an uncompressed .npz file (so that load_route_store can memory-map it).
+    """
+
+    # write to a temporary file first, parallel processes may read the same store
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    tmp_filename = f"{filename}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_filename, **route_store)
+    os.replace(tmp_filename, filename)
+
+
+def load_route_store(filename, mmap=True):
+    """
+    Loads a route store saved with save_route_store.
+
+    With mmap=True, the arrays are read-only memory maps of the members of the .npz file
+    (stored uncompressed by np.savez): nothing is read until it is used, and the processes
+    reading the same store share the pages of the file.
+    """
+
+    if not mmap:
+        with np.load(filename, allow_pickle=False) as npz_file:
+            return {k: npz_file[k] for k in npz_file.files}
+
+    route_store = {}
+
+    with zipfile.ZipFile(filename) as zip_file, open(filename, "rb") as f:
+        for info in zip_file.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"Member {info.filename} of {filename} is compressed and cannot be memory-mapped")
+
+            # the data follows the local header of the member (30 bytes, name and extra field)
+            f.seek(info.header_offset + 26)
+            name_length, extra_length = struct.unpack("<HH", f.read(4))
+            start = info.header_offset + 30 + name_length + extra_length
+            f.seek(start)
+
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+            key = info.filename[:-len(".npy")]
+
+            if len(shape) == 0 or np.prod(shape) == 0:
+                # 0-d and empty arrays cannot be memory-mapped
+                f.seek(start)
+                route_store[key] = np.lib.format.read_array(f, allow_pickle=False)
+            else:
+                route_store[key] = np.memmap(filename, dtype=dtype, mode="r", offset=f.tell(), shape=shape,
+                                             order="F" if fortran_order else "C")
+
+    return route_store
+
+
+def find_route_file(path_prefix, xml_suffix=".rou.xml.gz"):
+    """
+    Returns the route store path_prefix + ROUTE_STORE_SUFFIX if it exists,
+    otherwise the SUMO route file path_prefix + xml_suffix.
+    """
+
+    if os.path.exists(path_prefix + ROUTE_STORE_SUFFIX):
+        return path_prefix + ROUTE_STORE_SUFFIX
+
+    return path_prefix + xml_suffix
+
+
+
+""" SUMO route files: the elements are written one at a time, with the same layout of minidom's toprettyxml """
+
+
+ROUTES_START_TAG = '<routes xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="http://sumo.dlr.de/xsd/routes_file.xsd">\n'
+
+VTYPE_ELEMENT = '\t<vType id="type1" accel="2.6" decel="4.5" sigma="0.5" length="5" maxSpeed="70"/>\n'
+
+
+def xml_attribute(value):
+    # same escaping of minidom
+    return str(value).replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+
+def xml_tag(tag, attributes, indent="\t", empty=True):
+    """
+    Start tag (or empty-element tag) of an XML element, on its own line.
+
+    Args:
+    tag (str): Name of the element.
+    attributes (list): (name, value) pairs, in the order they are written.
+    indent (str): Indentation of the line.
+    empty (bool): Whether the element has no children (<tag .../>).
+
+    Returns:
+    str: The line of the tag.
+    """
+    str_attributes = "".join(f' {name}="{xml_attribute(value)}"' for name, value in attributes)
+    return f"{indent}<{tag}{str_attributes}{'/' if empty else ''}>\n"
+
+
+def write_route_file(filename, elements, compress=False, text_comment="", checksum=False):
+    """
+    Writes a SUMO route file streaming its elements: the routes, the vehicle type "type1" 
+    and the lines of the elements, in the order they are produced.
+
+    Args:
+    filename (str): Path of the route file (gzipped if compress is True).
+    elements (iterable): Strings with the lines of each element (e.g., built with xml_tag).
+    compress (bool): Whether to write a gzipped file.
+    text_comment (str): Comment written before the routes.
+    checksum (bool): Whether to compute the SHA-1 of the text while it is written.
+
+    Returns:
+    str: The SHA-1 of the text (to compare with route_file_checksum), None if checksum is False.
+    """
+    if "--" in text_comment:
+        raise ValueError("'--' is not allowed in a comment node")
+
+    lines = ['<?xml version="1.0" ?>\n']
+    if text_comment != "":
+        lines.append(f"<!--{text_comment}-->\n")
+    lines += [ROUTES_START_TAG, VTYPE_ELEMENT]
+
+    if compress:
+        f = gzip.open(filename, "wt", encoding="utf-8")
+    else:
+        f = open(filename, "w", encoding="utf-8", buffering=2**20)
+
+    digest = hashlib.sha1() if checksum else None
+
+    with f:
+        for line in itertools.chain(lines, elements, ["</routes>\n"]):
+            f.write(line)
+            if digest is not None:
+                digest.update(line.encode("utf-8"))
+
+    return digest.hexdigest() if digest is not None else None
+
+
+def route_file_checksum(filename):
+    """
+    SHA-1 of the (uncompressed) text of a route file, as returned by write_route_file.
+    """
+    digest = hashlib.sha1()
+
+    with (gzip.open(filename, "rb") if ".gz" in filename else open(filename, "rb")) as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def iter_route_file(filename):
+    """
+    Streams the vehicles of a SUMO route file (gzipped if the name contains ".gz") with 
+    xml.etree.ElementTree.iterparse: the parsed elements are cleared after each vehicle, 
+    so the memory does not grow with the size of the file.
+
+    Yields:
+    tuple: (vehicle ID, departure time as string, edges of the route as string).
+    """
+    if ".gz" in filename:
+        f = gzip.open(filename, "rb")
+    else:
+        f = open(filename, "rb")
+
+    with f:
+        context = ET.iterparse(f, events=("start", "end"))
+        _, root = next(context)
+
+        for event, element in context:
+            if event == "end" and element.tag == "vehicle":
+                route = next(element.iter("route"))
+                yield element.get("id"), element.get("depart"), route.get("edges")
+                # drop the vehicles already parsed
+                root.clear()
+
+
+def route_file_comment(filename):
+    """
+    Returns the comment written before the routes by write_route_file ("" if there is none).
+    """
+    with (gzip.open(filename, "rt") if ".gz" in filename else open(filename)) as f:
+        f.readline()
+        line = f.readline()
+
+    if line.startswith("<!--") and line.rstrip().endswith("-->"):
+        return line.rstrip()[4:-3]
+    return ""
+
+
+def route_file_to_store(filename, store_filename=None):
+    """
+    Converts a SUMO route file to a route store (see encode_routes), saved in store_filename if given.
+    The vehicle IDs and the comment are the ones of the file.
+    """
+    route_store = encode_routes(((v_id, depart, edges.split(" ")) for v_id, depart, edges in iter_route_file(filename)), 
+                                comment=route_file_comment(filename))
+
+    if store_filename is not None:
+        save_route_store(route_store, store_filename)
+
+    return route_store
+
+
+def route_dict_to_store(dict_routes, comment=""):
+    """
+    Converts a dictionary of routes (vehicle ID -> {"edges": list or string of edges, "time": departure time}, 
+    as in create_xml_vehicles) to a route store.
+    """
+    return encode_routes(((v_id, route["time"], route["edges"].split(" ") if isinstance(route["edges"], str) else route["edges"]) 
+                          for v_id, route in dict_routes.items()), comment=comment)
+
+
+def store_to_route_file(route_store, filename, lane_best=True, compress=False, checksum=False):
+    """
+    Writes a route store as a SUMO route file, as create_xml_vehicles (the vehicles are sorted 
+    by departure time, the comment of the store is written before the routes).
+
+    Args:
+    route_store (dict or str): The route store or the path of the .rou.npz file.
+    filename (str): Path of the route file (".gz" is appended if compress is True).
+    """
+    if isinstance(route_store, str):
+        route_store = load_route_store(route_store)
+
+    vehicle_ids = route_store["vehicle_ids"].tolist()
+    times = route_store["time"].tolist()
+    edge_ids = route_store["edge_ids"]
+    edges, offsets = route_store["edges"], route_store["offsets"]
+
+    def vehicle_elements():
+        for k in np.argsort(route_store["time"], kind="stable").tolist():
+            attributes = [("color", "blue"), ("id", vehicle_ids[k]), ("type", "type1")]
+            if lane_best:
+                attributes.append(("departLane", "best"))
+            attributes.append(("depart", times[k]))
+            str_edges = " ".join(edge_ids[edges[offsets[k]:offsets[k+1]]].tolist())
+            yield xml_tag("vehicle", attributes, empty=False) + xml_tag("route", [("edges", str_edges)], indent="\t\t") + "\t</vehicle>\n"
+
+    return write_route_file(filename+".gz" if compress else filename, vehicle_elements(), compress=compress, 
+                            text_comment=str(route_store.get("comment", "")), checksum=checksum)
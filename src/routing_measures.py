@@ -1,4 +1,5 @@
 import igraph
+import numpy as np
 
 
 def distinct_edges_traveled(path_list):
@@ -20,6 +21,24 @@ def redundancy(path_list):
     return redundancy_score
 
 
+def distinct_edges_encoded(edges):
+    
+    # distinct_edges_traveled on the integer codes of the edges of all the paths (see route_store.py)
+    return np.unique(edges)
+
+
+def redundancy_encoded(edges):
+    
+    # redundancy on the integer codes of the edges of all the paths (see route_store.py)
+    return len(edges)/len(distinct_edges_encoded(edges))
+
+
+def redundancy_edge_counts(edge_counts):
+    
+    # redundancy from the number of paths traversing each edge (e.g., updated incrementally)
+    return edge_counts.sum()/np.count_nonzero(edge_counts)
+
+
 def normalized_jaccard_coefficient(list1, list2):
     
     # Find the intersection of the two lists
@@ -2,6 +2,14 @@ import igraph
 from igraph import Graph
 import sumolib
 import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+import os
+import hashlib
+import json
+import weakref
+from multiprocessing import shared_memory, resource_tracker
 import folium
 import warnings
 import seaborn as sns
@@ -9,6 +17,10 @@ from tqdm.notebook import tqdm
 
 from typing import List
 
+from network_index import SortedKeyIndex, VertexPairIndex, RaggedKeyIndex, ArrayNetwork
+from contraction_hierarchy import (build_contraction_hierarchy, save_contraction_hierarchy, 
+                                   load_contraction_hierarchy_file, ch_shortest_path, ch_shortest_paths)
+
 # for the ellipse
 import math
 from matplotlib.patches import Ellipse
@@ -17,7 +29,18 @@ from matplotlib.patches import Ellipse
 """ utilities for road routing """
 
 
-def from_sumo_to_igraph_network(road_network, geo=True):
+# version of the format of the cached igraph networks (see load_igraph_network)
+IGRAPH_CACHE_VERSION = 1
+
+# sidecar of a cache folder with the hashes of the road networks (see cached_road_network_hash)
+NETWORK_HASHES_FILENAME = "network_hashes.json"
+
+# arrays of the network put in shared memory (see share_igraph_network), the coordinates are not shared
+SHARED_NETWORK_ARRAYS = ["n_edges", "vertex_names", "sumo_node_ids", "subvertices", "subvertices_offsets", 
+                         "edge_source", "edge_target", "edge_id", "length", "speed_limit", "traveltime"]
+
+
+def from_sumo_to_igraph_network(road_network, geo=True, vectorized=True):
     
     """
     Converts a SUMO road network to an igraph network.
@@ -26,6 +49,11 @@ def from_sumo_to_igraph_network(road_network, geo=True):
     -----------
     road_network : SUMO road network
         A SUMO road network object.
+    geo : bool
+        Whether to store the GPS coordinates of edges and vertices.
+    vectorized : bool
+        If True, use the array-based builder (from_sumo_to_igraph_network_vectorized),
+        otherwise use the original per-node implementation.
 
     Returns:
     --------
@@ -33,6 +61,8 @@ def from_sumo_to_igraph_network(road_network, geo=True):
         An igraph graph representing the road network.
     """
     
+    if vectorized:
+        return from_sumo_to_igraph_network_vectorized(road_network, geo=geo)
     
     nodes_dict = {}
     edges_dict = {}
@@ -205,32 +235,21 @@ def from_sumo_to_igraph_network(road_network, geo=True):
     G_igraph_new.es['original_id'] = range(len(G_igraph_new.es))
     G_igraph_new.vs['original_id'] = range(len(G_igraph_new.vs))
     
-    G_igraph_new['edge_sumo_ig'] = dict() # to store the current edge index
-    G_igraph_new['vertex_sumo_ig'] = dict() # to store the current edge index
-    G_igraph_new['edge_vertices'] = dict() # to convert edges to vertices
-    G_igraph_new['vertices_edge'] = dict() # to convert vertices to edges
     G_igraph_new['vertices_to_subvertices'] = dict() # to convert vertices and the expanded vertices (for connection)
+    G_igraph_new['connection_edges'] = set() # to store the connection edges
     if geo:
-        G_igraph_new['connection_edges'] = set() # to store the connection edges
         G_igraph_new['vertices_coords'] = set() # to store the location of vertices (for the ellipse)
-        
-    for v in G_igraph_new.vs:
-        G_igraph_new['vertex_sumo_ig'][v["name"]] = v.index
-
+    
+    # lookups: vertex/edge ID -> index, edge -> vertices, vertices -> edge
+    edge_list = np.array(G_igraph_new.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+    n_edges = len(edges_list)
+    network_lookups(G_igraph_new, G_igraph_new.vs["name"], G_igraph_new.es[:n_edges]["id"], edge_list[:, 0], edge_list[:, 1], 
+                    G_igraph_new.es["length"], G_igraph_new.es["traveltime"])
+    
     for e in G_igraph_new.es:
-        if e['id'] != 'connection':
-            G_igraph_new['edge_sumo_ig'][e['id']] = e.index
-            G_igraph_new['edge_vertices'][e['id']] = {'from' : e.source, 'to' : e.target}
-        else:
+        if e['id'] == 'connection':
             G_igraph_new['connection_edges'].add(e.index)
         
-        G_igraph_new['vertices_edge'][(e.source, e.target)] = {'length' : e['length'], 'traveltime' : e['traveltime'], 'id' : G_igraph_new.get_eid(e.source, e.target)}
-
-        try:
-            G_igraph_new['vertices_edge'][(e.target, e.source)] = {'length' : e['length'], 'traveltime' : e['traveltime'], 'id' : G_igraph_new.get_eid(e.target, e.source)}
-        except:
-            pass
-        
         if geo:
             G_igraph_new['vertices_coords'].add((e.source, e['coordinates']['from']))
             G_igraph_new['vertices_coords'].add((e.target, e['coordinates']['to']))
@@ -243,241 +262,1717 @@ def from_sumo_to_igraph_network(road_network, geo=True):
     return G_igraph_new
 
 
-def get_shortest_path(G, from_edge, to_edge, attribute):
+def from_sumo_to_igraph_network_vectorized(road_network, geo=True):
+    
     """
-    Find the shortest path between two edges in a igraph graph, and translate it to SUMO format.
+    Array-based version of from_sumo_to_igraph_network.
+
+    The SUMO nodes are visited once to collect the endpoints of edges and connections 
+    into NumPy arrays (sumo_network_to_arrays), and the igraph graph is created from 
+    these arrays with a single add_edges call using columnar attributes 
+    (igraph_network_from_arrays). Vertex indices, edge indices, attributes and lookup 
+    dictionaries are the same produced by the per-node implementation.
 
     Parameters:
-        G: The igraph graph
-        from_edge: ID of the edge where the path starts
-        to_edge: ID of the edge where the path ends
-        optimize: The edge attribute to optimize the path on.
+    -----------
+    road_network : SUMO road network
+        A SUMO road network object.
+    geo : bool
+        Whether to store the GPS coordinates of edges and vertices.
 
     Returns:
-        A dictionary with the following keys:
-        - 'sumo' (List[str]): The edges of the path in SUMO format
-        - 'ig' (List[str]): The igraph edges ID of the path
-        - 'cost' (float): The total cost of the path
+    --------
+    G : igraph graph
+        An igraph graph representing the road network.
     """
     
-            
+    network_arrays = sumo_network_to_arrays(road_network, geo=geo)
     
-    edge_from = G.es[G["edge_sumo_ig"][from_edge]]
-    edge_to = G.es[G["edge_sumo_ig"][to_edge]]
+    return igraph_network_from_arrays(network_arrays)
+
+
+def sumo_network_to_arrays(road_network, geo=True):
     
-    if from_edge == to_edge:
-        edges_ig = edge_from.index
-        edges_sumo = [from_edge]
-        total_cost = edge_from[attribute]
-        
-        return {"sumo": edges_sumo, "ig": edges_ig, "cost": total_cost}
+    """
+    Collects the vertices, edges and connections of a SUMO road network into NumPy arrays.
     
-    index_from = edge_from.target
-    index_to = edge_to.source
+    The edges of the resulting graph are the SUMO edges, sorted by the first time they 
+    are visited in road_network.getNodes(), followed by the connections. The coordinates 
+    of all the nodes are projected with a single call to convertXY2LonLat.
+
+    Parameters:
+    -----------
+    road_network : SUMO road network
+        A SUMO road network object.
+    geo : bool
+        Whether to compute the GPS coordinates of the nodes.
+
+    Returns:
+    --------
+    network_arrays : dict
+        A dictionary of NumPy arrays describing the graph (see igraph_network_from_arrays).
+    """
+    
+    sumo_nodes = road_network.getNodes()
+    sumo_edges = road_network.getEdges()
+    
+    edge_ids = [e.getID() for e in sumo_edges]
+    edge_index = {edge_id: ind for ind, edge_id in enumerate(edge_ids)}
+    
+    fully_connected = np.zeros(len(sumo_nodes), dtype=bool)
+    
+    # every edge is visited twice: at its "to" node (side 0) and at its "from" node (side 1)
+    visit_node, visit_edge, visit_side, visit_vertex = [], [], [], []
+    
+    vertex_names, vertex_node = [], []
+    conn_node, conn_from, conn_to = [], [], []
+    subvertices, subvertices_offsets = [], [0]
+    
+    for ind_node, node in enumerate(sumo_nodes):
         
-    id_ig_edge_from = edge_from.index
-    id_ig_edge_to = edge_to.index
+        in_edges = [e.getID() for e in node.getIncoming()]
+        out_edges = [e.getID() for e in node.getOutgoing()]
+        connections = [(c.getFrom().getID(), c.getTo().getID()) for c in node.getConnections()]
+        
+        node_subvertices = [e+"_to" for e in in_edges]+[e+"_from" for e in out_edges]
+        subvertices += node_subvertices
+        subvertices_offsets.append(len(subvertices))
+        
+        visit_node += [ind_node]*len(node_subvertices)
+        visit_edge += [edge_index[e] for e in in_edges]+[edge_index[e] for e in out_edges]
+        visit_side += [0]*len(in_edges)+[1]*len(out_edges)
+        
+        # Fully connected nodes
+        if len(in_edges)*len(out_edges) == len(set(connections)):
+            fully_connected[ind_node] = True
+            visit_vertex += [len(vertex_names)]*len(node_subvertices)
+            vertex_names.append(node.getID())
+            vertex_node.append(ind_node)
+        
+        # Nodes with connections
+        else:
+            visit_vertex += list(range(len(vertex_names), len(vertex_names)+len(node_subvertices)))
+            vertex_names += node_subvertices
+            vertex_node += [ind_node]*len(node_subvertices)
+            
+            conn_node += [ind_node]*len(connections)
+            conn_from += [edge_index[ef] for ef, _ in connections]
+            conn_to += [edge_index[et] for _, et in connections]
     
-    path = G.get_shortest_paths(index_from, index_to, weights=attribute, output="epath")
+    visit_node = np.array(visit_node, dtype=np.int64)
+    visit_edge = np.array(visit_edge, dtype=np.int64)
+    visit_side = np.array(visit_side, dtype=np.int64)
+    visit_vertex = np.array(visit_vertex, dtype=np.int64)
+    visit_pos = np.arange(len(visit_edge))
     
-    if index_from != index_to:
-        if len(path[0]) == 0:
-            return {"sumo": [], "ig": [], "cost": -1}
+    conn_node = np.array(conn_node, dtype=np.int64)
+    conn_from = np.array(conn_from, dtype=np.int64)
+    conn_to = np.array(conn_to, dtype=np.int64)
     
-    edges_ig = [id_ig_edge_from]+path[0]+[id_ig_edge_to]
+    # endpoints of each SUMO edge (indexed as in road_network.getEdges())
+    n_edges = len(sumo_edges)
+    edge_source, edge_target = np.empty(n_edges, dtype=np.int64), np.empty(n_edges, dtype=np.int64)
+    edge_node_from, edge_node_to = np.empty(n_edges, dtype=np.int64), np.empty(n_edges, dtype=np.int64)
+    pos_from, pos_to = np.empty(n_edges, dtype=np.int64), np.empty(n_edges, dtype=np.int64)
     
-    total_cost = compute_path_cost(G, edges_ig, attribute)
-
-    edges_sumo = [from_edge]+[e for e in G.es[path[0]]["id"] if e != "connection"]+[to_edge]
-
-    return {"sumo": edges_sumo, "ig": edges_ig, "cost": total_cost}
-
-
+    mask_to, mask_from = visit_side == 0, visit_side == 1
+    edge_target[visit_edge[mask_to]] = visit_vertex[mask_to]
+    edge_node_to[visit_edge[mask_to]] = visit_node[mask_to]
+    pos_to[visit_edge[mask_to]] = visit_pos[mask_to]
+    edge_source[visit_edge[mask_from]] = visit_vertex[mask_from]
+    edge_node_from[visit_edge[mask_from]] = visit_node[mask_from]
+    pos_from[visit_edge[mask_from]] = visit_pos[mask_from]
+    
+    # the igraph edges are sorted by the first time they are visited
+    order = np.argsort(np.minimum(pos_from, pos_to), kind="stable")
+    
+    edge_length = np.array([e.getLength() for e in sumo_edges], dtype=np.float64)[order]
+    edge_speed = np.array([e.getSpeed() for e in sumo_edges], dtype=np.float64)[order]
+    n_conn = len(conn_node)
+    
+    network_arrays = {}
+    network_arrays["n_edges"] = np.array(n_edges, dtype=np.int64)
+    network_arrays["vertex_names"] = np.array(vertex_names, dtype=str)
+    network_arrays["vertex_node"] = np.array(vertex_node, dtype=np.int64)
+    network_arrays["sumo_node_ids"] = np.array([node.getID() for node in sumo_nodes], dtype=str)
+    network_arrays["subvertices"] = np.array(subvertices, dtype=str)
+    network_arrays["subvertices_offsets"] = np.array(subvertices_offsets, dtype=np.int64)
+    
+    # the connections link the "_to" vertex of an edge to the "_from" vertex of another one
+    network_arrays["edge_source"] = np.concatenate([edge_source[order], edge_target[conn_from]])
+    network_arrays["edge_target"] = np.concatenate([edge_target[order], edge_source[conn_to]])
+    network_arrays["edge_id"] = np.array([edge_ids[ind] for ind in order]+["connection"]*n_conn, dtype=str)
+    network_arrays["length"] = np.concatenate([edge_length, np.zeros(n_conn)])
+    network_arrays["speed_limit"] = np.concatenate([edge_speed, np.full(n_conn, -1.0)])
+    network_arrays["traveltime"] = np.concatenate([edge_length/edge_speed, np.zeros(n_conn)])
+    
+    if geo:
+        # project all the nodes at once
+        node_xy = np.array([node.getCoord()[:2] for node in sumo_nodes], dtype=np.float64).reshape(-1, 2)
+        node_lon, node_lat = road_network.convertXY2LonLat(node_xy[:, 0].copy(), node_xy[:, 1].copy())
+        network_arrays["node_lon"] = np.asarray(node_lon, dtype=np.float64)
+        network_arrays["node_lat"] = np.asarray(node_lat, dtype=np.float64)
+        
+        network_arrays["edge_node_from"] = np.concatenate([edge_node_from[order], conn_node])
+        network_arrays["edge_node_to"] = np.concatenate([edge_node_to[order], conn_node])
+        
+        # the center of an edge depends on the node where the edge is visited for the second time:
+        # the middle point if it is fully connected, otherwise the node location (twice)
+        second_is_to = (pos_to > pos_from)[order]
+        second_node = np.where(second_is_to, edge_node_to[order], edge_node_from[order])
+        network_arrays["center_node"] = np.concatenate([second_node, conn_node])
+        network_arrays["center_pair"] = np.concatenate([~fully_connected[second_node], np.zeros(n_conn, dtype=bool)])
+    
+    return network_arrays
 
 
-def compute_path_cost(G: igraph.Graph, edge_list: List[str], attribute: str) -> float:     
+def igraph_network_from_arrays(network_arrays):
+    
     """
-    This function is used to compute the cost of a path in a graph.
+    Creates the igraph network (with its lookup dictionaries) from the arrays 
+    computed by sumo_network_to_arrays.
 
     Parameters:
-    G (igraph graph): An igraph graph representing the road network.
-    edge_list (list): A list of edges that form the path.
-    attribute (str): The key to use to compute the cost, the key must be in the edge_data
+    -----------
+    network_arrays : dict
+        A dictionary of NumPy arrays describing the graph. The GPS coordinates are 
+        stored only if the arrays contain the projected nodes ("node_lon", "node_lat").
 
     Returns:
-    total_cost (float): The total cost of the path
+    --------
+    G : igraph graph
+        An igraph graph representing the road network.
     """
-    if type(edge_list) is not list:
-        edge_list = [edge_list]
     
-    total_cost = sum(G.es[edge_list][attribute])
+    geo = "node_lon" in network_arrays
+    
+    n_edges = int(network_arrays["n_edges"])
+    vertex_names = network_arrays["vertex_names"].tolist()
+    all_source = np.asarray(network_arrays["edge_source"], dtype=np.int64)
+    all_target = np.asarray(network_arrays["edge_target"], dtype=np.int64)
+    n_conn = len(all_source)-n_edges
+    
+    # connections keep the integer attributes of the per-node implementation
+    edges_attr = {"id": network_arrays["edge_id"].tolist(), 
+                  "length": network_arrays["length"][:n_edges].tolist()+[0]*n_conn, 
+                  "speed_limit": network_arrays["speed_limit"][:n_edges].tolist()+[-1]*n_conn, 
+                  "traveltime": network_arrays["traveltime"][:n_edges].tolist()+[0]*n_conn}
+    
+    if geo:
+        node_lon, node_lat = network_arrays["node_lon"], network_arrays["node_lat"]
+        node_coords = list(zip(node_lon.tolist(), node_lat.tolist()))
+        
+        node_from, node_to = network_arrays["edge_node_from"], network_arrays["edge_node_to"]
+        center_node = network_arrays["center_node"].tolist()
+        center_pair = network_arrays["center_pair"].tolist()
+        center_lon = ((node_lon[node_to] + node_lon[node_from]) / 2).tolist()
+        center_lat = ((node_lat[node_to] + node_lat[node_from]) / 2).tolist()
+        
+        edges_attr["coordinates"] = [{'from': node_coords[nf], 'to': node_coords[nt]} 
+                                     for nf, nt in zip(node_from.tolist(), node_to.tolist())]
+        edges_attr["center_coord"] = [(node_coords[nc], node_coords[nc]) if pair else (c_lon, c_lat) 
+                                      for c_lon, c_lat, pair, nc in zip(center_lon[:n_edges], center_lat[:n_edges], 
+                                                                        center_pair[:n_edges], center_node[:n_edges])]
+        edges_attr["center_coord"] += [node_coords[nc] for nc in center_node[n_edges:]]
+    
+    G_igraph_new = igraph.Graph(directed=True)
+    G_igraph_new.add_vertices(vertex_names)
+    G_igraph_new.add_edges(list(zip(all_source.tolist(), all_target.tolist())), edges_attr)
+    G_igraph_new.es['original_id'] = range(len(G_igraph_new.es))
+    G_igraph_new.vs['original_id'] = range(len(G_igraph_new.vs))
+    
+    network_lookups(G_igraph_new, network_arrays["vertex_names"], network_arrays["edge_id"][:n_edges], 
+                    all_source, all_target, edges_attr["length"], edges_attr["traveltime"])
+    G_igraph_new['connection_edges'] = set(range(n_edges, n_edges+n_conn))
+    
+    if geo:
+        # location of vertices (for the ellipse)
+        vertex_node = network_arrays["vertex_node"]
+        endpoints = np.unique(np.concatenate([all_source, all_target])).tolist()
+        G_igraph_new['vertices_coords'] = np.array([(v, node_coords[vertex_node[v]]) for v in endpoints], dtype=object)
+    
+    # SUMO node -> sub-vertices (for connection)
+    offsets = network_arrays["subvertices_offsets"].tolist()
+    subvertices = network_arrays["subvertices"].tolist()
+    G_igraph_new['vertices_to_subvertices'] = {node_id: subvertices[offsets[ind]:offsets[ind+1]] 
+                                               for ind, node_id in enumerate(network_arrays["sumo_node_ids"].tolist())}
+    
+    return G_igraph_new
 
-    return total_cost
+
+def network_lookups(G, vertex_names, edge_ids, edge_source, edge_target, length, traveltime):
+    
+    """
+    Stores in G the lookups of the network as compact sorted-key indexes (see network_index.py), 
+    with the same semantics of the dictionaries of the per-node implementation:
+    - G['vertex_sumo_ig']: vertex name -> igraph vertex
+    - G['edge_sumo_ig']: SUMO edge ID -> igraph edge
+    - G['edge_vertices']: SUMO edge ID -> {'from': source vertex, 'to': target vertex}
+    - G['vertices_edge']: (source, target) -> {'length', 'traveltime', 'id'}: the length and 
+      traveltime are the ones of the last edge, in index order, connecting the two vertices 
+      in any direction, 'id' is the edge returned by G.get_eid(source, target)
+    
+    The SUMO edges are the first len(edge_ids) edges of G (the connections follow).
+    """
+    
+    n_vertices = len(vertex_names)
+    n_edges = len(edge_ids)
+    edge_source = np.asarray(edge_source, dtype=np.int64)
+    edge_target = np.asarray(edge_target, dtype=np.int64)
+    
+    G['vertex_sumo_ig'] = SortedKeyIndex(vertex_names, np.arange(n_vertices))
+    G['edge_sumo_ig'] = SortedKeyIndex(edge_ids, np.arange(n_edges))
+    G['edge_vertices'] = G['edge_sumo_ig'].with_values({'from': edge_source[:n_edges], 'to': edge_target[:n_edges]})
+    
+    directed_key = edge_source*n_vertices + edge_target
+    undirected_key = np.minimum(edge_source, edge_target)*n_vertices + np.maximum(edge_source, edge_target)
+    _, undirected_inv = np.unique(undirected_key, return_inverse=True)
+    last_writer = np.full(undirected_inv.max()+1 if len(undirected_inv) > 0 else 0, -1, dtype=np.int64)
+    np.maximum.at(last_writer, undirected_inv, np.arange(len(edge_source)))
+    
+    _, first_ind = np.unique(directed_key, return_index=True)
+    key_source, key_target = edge_source[first_ind], edge_target[first_ind]
+    key_writer = last_writer[undirected_inv[first_ind]]
+    key_eid = np.array(G.get_eids(pairs=list(zip(key_source.tolist(), key_target.tolist()))), dtype=np.int64)
+    
+    G['vertices_edge'] = VertexPairIndex(n_vertices, key_source, key_target, 
+                                         {'length': np.asarray(length, dtype=np.float64)[key_writer], 
+                                          'traveltime': np.asarray(traveltime, dtype=np.float64)[key_writer], 
+                                          'id': key_eid})
 
 
+def road_network_hash(road_network_path, chunk_size=2**20):
+    
+    """
+    Computes the content hash (SHA-1) of a SUMO road network file.
+    """
+    
+    sha1 = hashlib.sha1()
+    
+    with open(road_network_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha1.update(chunk)
+    
+    return sha1.hexdigest()
 
 
-def test_sumo_ig_shortest_paths(road_network_sumo, G, n_tests, attribute, th=1e-4):
+def cached_road_network_hash(road_network_path, cache_folder):
     
+    """
+    Returns the content hash (SHA-1) of a SUMO road network file. The hash is stored in the 
+    sidecar NETWORK_HASHES_FILENAME of the cache folder (absolute path -> [size, mtime_ns, SHA-1]), 
+    and the file is hashed again only when its size or modification time change.
+    """
     
-    sumo_edges = road_network_sumo.getEdges()
+    path = os.path.abspath(road_network_path)
+    stat = os.stat(path)
+    sidecar_filename = os.path.join(cache_folder, NETWORK_HASHES_FILENAME)
     
-    fastest = True if attribute == "traveltime" else False
+    hashes = {}
+    if os.path.exists(sidecar_filename):
+        try:
+            with open(sidecar_filename) as f:
+                hashes = json.load(f)
+        except (OSError, ValueError):
+            # unreadable sidecar: hash the file and write it again
+            hashes = {}
     
-    for i in tqdm(range(n_tests)):
+    entry = hashes.get(path)
+    if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+        return entry[2]
     
-        from_edge = sumo_edges[np.random.randint(0,len(sumo_edges))]
-        to_edge = sumo_edges[np.random.randint(0,len(sumo_edges))]
-        
-        res_sumo = road_network_sumo.getOptimalPath(from_edge, to_edge, fastest=fastest)
-        
-        if res_sumo[0] is not None:
-            edges_sumo = []
-            for e in res_sumo[0]:
-                edges_sumo.append(e.getID())
+    key = road_network_hash(path)
+    hashes[path] = [stat.st_size, stat.st_mtime_ns, key]
+    
+    # write to a temporary file first, parallel workers may update the same sidecar
+    os.makedirs(cache_folder, exist_ok=True)
+    tmp_filename = f"{sidecar_filename}.{os.getpid()}.tmp"
+    with open(tmp_filename, "w") as f:
+        json.dump(hashes, f)
+    os.replace(tmp_filename, sidecar_filename)
+    
+    return key
 
-            cost_sumo = res_sumo[1]
 
-            res_ig = get_shortest_path(G, from_edge.getID(), to_edge.getID(), attribute)
+def network_cache_filename(road_network_path, suffix, cache_folder=None):
+    
+    """
+    Returns the path of a file cached for a SUMO road network file, keyed by the content 
+    hash of the .net.xml and by suffix. By default the cache is stored in the folder 
+    "igraph_cache" next to the road network file.
+    """
+    
+    if cache_folder is None:
+        cache_folder = os.path.join(os.path.dirname(os.path.abspath(road_network_path)), "igraph_cache")
+    
+    net_name = os.path.basename(road_network_path).split(".")[0]
+    key = cached_road_network_hash(road_network_path, cache_folder)
+    
+    return os.path.join(cache_folder, f"{net_name}_{key[:16]}_{suffix}.npz")
 
-            edges_sumo_ig = res_ig["sumo"]
-            cost_ig = res_ig["cost"]
 
+def igraph_network_cache_filename(road_network_path, geo=True, cache_folder=None):
+    
+    """
+    Returns the path of the cached igraph network for a SUMO road network file.
+    
+    The cache is keyed by the content hash of the .net.xml, the geo flag and the 
+    version of the cache format.
+    """
+    
+    return network_cache_filename(road_network_path, f"geo{int(geo)}_v{IGRAPH_CACHE_VERSION}", cache_folder=cache_folder)
 
-            if len(edges_sumo_ig)==0 and len(edges_sumo)==0:
-                continue
 
-            assert abs(cost_ig-cost_sumo)<th, f"Error {from_edge.getID()}, {to_edge.getID()}"
-            
-            
-            
+def load_igraph_network(road_network_path, geo=True, cache_folder=None, use_cache=True):
+    
+    """
+    Loads the igraph network of a SUMO road network file, using an on-disk cache.
+    
+    The first call parses the network with sumolib, converts it and stores the arrays 
+    of the graph in an uncompressed .npz file (see igraph_network_cache_filename). 
+    The following calls read the .npz file and skip sumolib entirely.
 
+    Parameters:
+    -----------
+    road_network_path : str
+        Path to the SUMO road network file (.net.xml).
+    geo : bool
+        Whether to store the GPS coordinates of edges and vertices.
+    cache_folder : str
+        Folder of the cache (default: "igraph_cache" next to the road network file).
+    use_cache : bool
+        If False, always convert the SUMO network and do not write the cache.
 
-def visualize_paths(path_list, road_network, colors=None, opacity=1, map_f=None, dotted=False, show_markers=False):
-        
-    if colors is None:
-        color_list = ["blue"]*len(path_list)
-    elif isinstance(colors, str) and colors!="rand":
-        color_list = [colors]*len(path_list)
-    elif colors == "rand":
-        color_list = sns.color_palette("colorblind", len(path_list)).as_hex()
-        
-        
-    # transform to GPS points
-    paths_gps = [edge_list_to_gps_list(edge_list, road_network) for edge_list in path_list]
+    Returns:
+    --------
+    G : igraph graph
+        An igraph graph representing the road network.
+    """
+    
+    if not use_cache:
+        road_network = sumolib.net.readNet(road_network_path, withInternal=False)
+        return from_sumo_to_igraph_network(road_network, geo=geo)
+    
+    network_arrays = load_network_arrays(road_network_path, geo=geo, cache_folder=cache_folder)
+    
+    return igraph_network_from_arrays(network_arrays)
 
-    if map_f is None:
-        map_f = folium.Map(location=[paths_gps[0][1][1], paths_gps[0][1][0]], tiles='cartodbpositron', zoom_start=13)
 
-    for path, col in zip(paths_gps, color_list): 
-          
-          folium.PolyLine(locations=[list(reversed(coord)) for coord in path], 
-                          weigth=4, color=col, opacity=opacity, 
-                          dash_array='10' if dotted else None).add_to(map_f)
+def load_network_arrays(road_network_path, geo=True, cache_folder=None):
+    
+    """
+    Returns the arrays of the igraph network of a SUMO road network file (see sumo_network_to_arrays), 
+    reading them from the on-disk cache or writing the cache if missing.
+    """
+    
+    cache_filename = igraph_network_cache_filename(road_network_path, geo=geo, cache_folder=cache_folder)
+    
+    if os.path.exists(cache_filename):
+        with np.load(cache_filename, allow_pickle=False) as npz_file:
+            return {k: npz_file[k] for k in npz_file.files}
+    
+    road_network = sumolib.net.readNet(road_network_path, withInternal=False)
+    network_arrays = sumo_network_to_arrays(road_network, geo=geo)
+    
+    # write to a temporary file first, parallel workers may build the same cache
+    os.makedirs(os.path.dirname(cache_filename), exist_ok=True)
+    tmp_filename = f"{cache_filename}.{os.getpid()}.tmp.npz"
+    np.savez(tmp_filename, **network_arrays)
+    os.replace(tmp_filename, cache_filename)
+    
+    return network_arrays
 
-    if show_markers:
-        lon_from, lat_from = paths_gps[0][0]
-        lon_to, lat_to = paths_gps[0][-1]
-        folium.Marker(location=[lat_from, lon_from], icon = folium.Icon(color='lightgreen'), popup='ORIGIN').add_to(map_f)
-        folium.Marker(location=[lat_to, lon_to], icon = folium.Icon(color='lightred'), popup='TARGET').add_to(map_f)
 
-    return map_f
+def share_network_arrays(network_arrays, name=None):
+    
+    """
+    Copies a dictionary of NumPy arrays into a single shared memory block, so that other 
+    processes can attach to them without copies (see attach_network_arrays).
+    
+    The block starts with its own layout (8 bytes with the size of the header, then the JSON 
+    header: key -> [offset, dtype, shape]), so its name is all a worker needs to attach.
 
+    Parameters:
+        network_arrays: Dictionary of NumPy arrays (object arrays are not supported).
+        name: Name of the block (default: a random name chosen by multiprocessing).
 
-def edge_list_to_gps_list(edge_list, road_network):
+    Returns:
+        The multiprocessing.shared_memory.SharedMemory block. The creator must keep it 
+        open while the workers run, then close() and unlink() it.
+    """
+    
+    arrays = {k: np.asarray(v) for k, v in network_arrays.items()}
+    
+    layout = {}
+    size = 0
+    for k, v in arrays.items():
+        if v.dtype.hasobject:
+            raise ValueError(f"Array '{k}' has dtype object and cannot be shared")
+        size = shared_offset(size)
+        layout[k] = [size, v.dtype.str, list(v.shape)]
+        size += v.nbytes
     
-    gps_points = []
+    header = json.dumps(layout).encode()
+    data_start = shared_offset(8 + len(header))
+    
+    shm = shared_memory.SharedMemory(name=name, create=True, size=max(data_start + size, 1))
+    shm.buf[:8] = len(header).to_bytes(8, "little")
+    shm.buf[8:8+len(header)] = header
+    
+    for k, v in arrays.items():
+        offset, dtype, shape = layout[k]
+        np.ndarray(tuple(shape), dtype=dtype, buffer=shm.buf, offset=data_start+offset)[...] = v
+    
+    return shm
 
-    for edge_id in edge_list:
-        
-        sumo_edge = road_network.getEdge(edge_id)
 
-        x, y = sumo_edge.getFromNode().getCoord()
-        lon_from, lat_from = road_network.convertXY2LonLat(x, y)
+def shared_offset(offset, alignment=64):
+    """
+    Rounds an offset in the shared memory block up to a multiple of alignment.
+    """
+    
+    return -(-offset // alignment) * alignment
 
-        x, y = sumo_edge.getToNode().getCoord()
-        lon_to, lat_to = road_network.convertXY2LonLat(x, y)
 
-        gps_points.append((lon_from, lat_from))
-        gps_points.append((lon_to, lat_to))
-        
-        
-    return gps_points
+def attach_network_arrays(name):
+    
+    """
+    Attaches to a shared memory block created by share_network_arrays.
 
-def compute_ellipse(G, from_edge, to_edge, phi = 1.5, eta = 2, min_dist = 0.05):
+    Returns:
+        - The SharedMemory block (it must stay referenced while the arrays are used).
+        - A dictionary of read-only NumPy arrays backed by the shared memory (no copies).
+    """
     
-    def get_center(s_lon, s_lat, t_lon, t_lat):
-        return (s_lon + t_lon) / 2, (s_lat + t_lat) / 2
+    try:
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13: the block is owned by its creator, a worker must not unlink it at exit
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+    
+    header_size = int.from_bytes(bytes(shm.buf[:8]), "little")
+    layout = json.loads(bytes(shm.buf[8:8+header_size]).decode())
+    data_start = shared_offset(8 + header_size)
+    
+    network_arrays = {}
+    for k, (offset, dtype, shape) in layout.items():
+        array = np.ndarray(tuple(shape), dtype=dtype, buffer=shm.buf, offset=data_start+offset)
+        array.flags.writeable = False
+        network_arrays[k] = array
+    
+    return shm, network_arrays
 
-    def get_pythagoras(s_lon, s_lat, t_lon, t_lat):
-        # Calculate the distance using the Pythagorean theorem
-        return math.sqrt((t_lon - s_lon)**2 + (t_lat - s_lat)**2)
 
-    def get_angle(s_lon, s_lat, t_lon, t_lat):
-        # Calculate the angle in radians
-        angle_rad = math.atan2(t_lat - s_lat, t_lon - s_lon)
-        # Convert the angle to degrees
-        angle_deg = math.degrees(angle_rad)
-        return angle_deg
+def share_igraph_network(road_network_path, geo=True, cache_folder=None, name=None):
+    
+    """
+    Puts the arrays of the igraph network of a SUMO road network file in shared memory, for the 
+    workers attaching with attach_igraph_network: the edges and their attributes (SHARED_NETWORK_ARRAYS), 
+    the CSR adjacency used by the scipy backend and the sorted keys of the lookups. geo selects the 
+    cache to read (see load_network_arrays), the coordinates are not shared.
+
+    Example (notebook 3):
+        shm = share_igraph_network(road_network_path)
+        try:
+            # ... launch the workers with --shared-network {shm.name} and wait for them
+        finally:
+            shm.close()
+            shm.unlink()
+
+    Returns:
+        The multiprocessing.shared_memory.SharedMemory block (see share_network_arrays).
+    """
+    
+    network_arrays = load_network_arrays(road_network_path, geo=geo, cache_folder=cache_folder)
+    
+    shared_arrays = {k: network_arrays[k] for k in SHARED_NETWORK_ARRAYS}
+    
+    csr_network = csr_network_from_edges(len(network_arrays["vertex_names"]), 
+                                         network_arrays["edge_source"], network_arrays["edge_target"])
+    shared_arrays.update({f"csr_{k}": np.asarray(v) for k, v in csr_network.items()})
+    
+    # the keys of the lookups are sorted once here, the workers binary search the shared arrays
+    n_edges = int(network_arrays["n_edges"])
+    lookup_keys = {"vertex_names": network_arrays["vertex_names"], "edge_id": network_arrays["edge_id"][:n_edges], 
+                   "sumo_node_ids": network_arrays["sumo_node_ids"]}
+    for k, keys in lookup_keys.items():
+        order = np.argsort(keys, kind="stable")
+        shared_arrays[f"order_{k}"] = order
+        shared_arrays[f"sorted_{k}"] = keys[order]
+    
+    return share_network_arrays(shared_arrays, name=name)
+
+
+def attach_igraph_network(name):
+    
+    """
+    Attaches to the network shared by share_igraph_network, without reading the road network 
+    (or its cache) from disk and without building an igraph graph.
+    
+    The network is an ArrayNetwork (see network_index.py) over the shared arrays, to be routed 
+    with the scipy backend, e.g. get_shortest_path_nodes(G, from_node, to_node, weights, backend="scipy") 
+    with an array of weights (one per edge). Nothing is copied: 
+    - G["csr_network"]: the CSR adjacency
+    - G["vertex_sumo_ig"], G["edge_sumo_ig"], G["edge_vertices"] and G["vertices_to_subvertices"]: 
+      SortedKeyIndex views over the shared arrays (as in igraph_network_from_arrays)
+    - G.es["id"], G.es["length"], G.es["speed_limit"], G.es["traveltime"]: the edge attributes
+    The coordinates (and the lookups based on them) are not available. G["shared_memory"] keeps 
+    the block attached for the lifetime of the network.
+    """
+    
+    shm, shared_arrays = attach_network_arrays(name)
+    
+    n_edges = int(shared_arrays["n_edges"])
+    n_vertices = len(shared_arrays["vertex_names"])
+    edge_source, edge_target = shared_arrays["edge_source"], shared_arrays["edge_target"]
+    
+    G = ArrayNetwork(n_vertices, {"id": shared_arrays["edge_id"], "length": shared_arrays["length"], 
+                                  "speed_limit": shared_arrays["speed_limit"], "traveltime": shared_arrays["traveltime"]})
+    
+    G["vertex_sumo_ig"] = SortedKeyIndex.from_sorted(shared_arrays["sorted_vertex_names"], shared_arrays["order_vertex_names"], 
+                                                     np.arange(n_vertices))
+    G["edge_sumo_ig"] = SortedKeyIndex.from_sorted(shared_arrays["sorted_edge_id"], shared_arrays["order_edge_id"], 
+                                                   np.arange(n_edges))
+    G["edge_vertices"] = G["edge_sumo_ig"].with_values({"from": edge_source[:n_edges], "to": edge_target[:n_edges]})
+    G["vertices_to_subvertices"] = RaggedKeyIndex.from_sorted(shared_arrays["sorted_sumo_node_ids"], shared_arrays["order_sumo_node_ids"], 
+                                                              (shared_arrays["subvertices"], shared_arrays["subvertices_offsets"]))
+    
+    csr_network = {k[len("csr_"):]: v for k, v in shared_arrays.items() if k.startswith("csr_")}
+    csr_network["n_vertices"] = int(csr_network["n_vertices"])
+    G["csr_network"] = csr_network
+    G["shared_memory"] = shm
+    
+    return G
+
+
+
+def get_shortest_path(G, from_edge, to_edge, attribute, backend="igraph"):
+    """
+    Find the shortest path between two edges in a igraph graph, and translate it to SUMO format.
+
+    Parameters:
+        G: The igraph graph
+        from_edge: ID of the edge where the path starts
+        to_edge: ID of the edge where the path ends
+        optimize: The edge attribute to optimize the path on.
+        backend: "igraph", "scipy" (see get_shortest_path_scipy) or "ch" (see get_shortest_path_ch).
+
+    Returns:
+        A dictionary with the following keys:
+        - 'sumo' (List[str]): The edges of the path in SUMO format
+        - 'ig' (List[str]): The igraph edges ID of the path
+        - 'cost' (float): The total cost of the path
+    """
+    
+    if backend == "scipy":
+        return get_shortest_path_scipy(G, from_edge, to_edge, attribute)
+    
+    if backend == "ch":
+        return get_shortest_path_ch(G, from_edge, to_edge, attribute)
+    
+    edge_from = G.es[G["edge_sumo_ig"][from_edge]]
+    edge_to = G.es[G["edge_sumo_ig"][to_edge]]
+    
+    if from_edge == to_edge:
+        edges_ig = edge_from.index
+        edges_sumo = [from_edge]
+        total_cost = edge_from[attribute] if isinstance(attribute, str) else float(attribute[edges_ig])
+        
+        return {"sumo": edges_sumo, "ig": edges_ig, "cost": total_cost}
+    
+    index_from = edge_from.target
+    index_to = edge_to.source
+        
+    id_ig_edge_from = edge_from.index
+    id_ig_edge_to = edge_to.index
+    
+    # attribute can also be an array of weights (e.g., from get_shortest_path_ellipse)
+    weights = None if isinstance(attribute, str) else edge_weights(G, attribute)
+    
+    path = G.get_shortest_paths(index_from, index_to, weights=attribute if weights is None else weights.tolist(), output="epath")
+    
+    if index_from != index_to:
+        if len(path[0]) == 0:
+            return {"sumo": [], "ig": [], "cost": -1}
+    
+    edges_ig = [id_ig_edge_from]+path[0]+[id_ig_edge_to]
+    
+    total_cost = path_cost(G, edges_ig, attribute, weights)
+
+    edges_sumo = [from_edge]+[e for e in G.es[path[0]]["id"] if e != "connection"]+[to_edge]
+
+    return {"sumo": edges_sumo, "ig": edges_ig, "cost": total_cost}
+
+
+
+
+def apply_randomization_my_duarouter(G, w, default_attribute="", tmp_attribute="", base_weights=None, connection_mask=None, vectorized=True):
+    """
+    Apply random noise to the edge weights of a graph.
+
+    Args:
+    - G: The graph object.
+    - w: The randomization factor for the random noise.
+    - default_attribute: The name of the default edge attribute representing the original edge weights (optional).
+    - tmp_attribute: The name of the temporary edge attribute to store the distorted edge weights (optional).
+    - base_weights: Array of the default edge weights, to avoid reading default_attribute at each call (optional).
+    - connection_mask: Boolean array, True for the "connection" edges (optional).
+    - vectorized: If True, the distorted weights are written with a single columnar assignment, 
+      otherwise edge by edge. The random noise (and the result) is the same.
+
+    Returns:
+    None
+    """
+    
+    # Apply random noise to each edge weight
+    rand_noise_list = np.random.uniform(1, w, size=G.ecount())
+    
+    if not vectorized:
+        for ind, e in enumerate(G.es()):
+            # Check if the edge is not a "connection" (optional)
+            if e["id"] != "connection":
+                # Apply the random noise to the edge weight
+                e[tmp_attribute] = e[default_attribute] * rand_noise_list[ind]
+        return
+    
+    if base_weights is None:
+        base_weights = np.array(G.es[default_attribute], dtype=np.float64)
+    
+    if connection_mask is None:
+        connection_mask = np.array(G.es["id"]) == "connection"
+    
+    G.es[tmp_attribute] = distort_weights(base_weights, connection_mask, rand_noise_list).tolist()
+
+
+def distort_weights(base_weights, connection_mask, rand_noise_list):
+    """
+    Multiply the edge weights by the random noise, the "connection" edges keep their default weight.
+
+    Args:
+    - base_weights: Array of the default edge weights.
+    - connection_mask: Boolean array, True for the "connection" edges.
+    - rand_noise_list: Array of the random noise of each edge.
+
+    Returns:
+    Array of the distorted edge weights.
+    """
+    
+    return np.where(connection_mask, base_weights, base_weights * rand_noise_list)
+
+
+
+def compute_path_cost(G: igraph.Graph, edge_list: List[str], attribute: str) -> float:     
+    """
+    This function is used to compute the cost of a path in a graph.
+
+    Parameters:
+    G (igraph graph): An igraph graph representing the road network.
+    edge_list (list): A list of edges that form the path.
+    attribute (str): The key to use to compute the cost, the key must be in the edge_data
+
+    Returns:
+    total_cost (float): The total cost of the path
+    """
+    if type(edge_list) is not list:
+        edge_list = [edge_list]
+    
+    total_cost = sum(G.es[edge_list][attribute])
+
+    return total_cost
+
+
+
+
+def test_sumo_ig_shortest_paths(road_network_sumo, G, n_tests, attribute, th=1e-4):
+    
+    
+    sumo_edges = road_network_sumo.getEdges()
+    
+    fastest = True if attribute == "traveltime" else False
+    
+    for i in tqdm(range(n_tests)):
+    
+        from_edge = sumo_edges[np.random.randint(0,len(sumo_edges))]
+        to_edge = sumo_edges[np.random.randint(0,len(sumo_edges))]
+        
+        res_sumo = road_network_sumo.getOptimalPath(from_edge, to_edge, fastest=fastest)
+        
+        if res_sumo[0] is not None:
+            edges_sumo = []
+            for e in res_sumo[0]:
+                edges_sumo.append(e.getID())
+
+            cost_sumo = res_sumo[1]
+
+            res_ig = get_shortest_path(G, from_edge.getID(), to_edge.getID(), attribute)
+
+            edges_sumo_ig = res_ig["sumo"]
+            cost_ig = res_ig["cost"]
+
+
+            if len(edges_sumo_ig)==0 and len(edges_sumo)==0:
+                continue
+
+            assert abs(cost_ig-cost_sumo)<th, f"Error {from_edge.getID()}, {to_edge.getID()}"
+            
+            
+            
+
+
+def visualize_paths(path_list, road_network, colors=None, opacity=1, map_f=None, dotted=False, show_markers=False):
+        
+    if colors is None:
+        color_list = ["blue"]*len(path_list)
+    elif isinstance(colors, str) and colors!="rand":
+        color_list = [colors]*len(path_list)
+    elif colors == "rand":
+        color_list = sns.color_palette("colorblind", len(path_list)).as_hex()
+        
+        
+    # transform to GPS points
+    paths_gps = [edge_list_to_gps_list(edge_list, road_network) for edge_list in path_list]
+
+    if map_f is None:
+        map_f = folium.Map(location=[paths_gps[0][1][1], paths_gps[0][1][0]], tiles='cartodbpositron', zoom_start=13)
+
+    for path, col in zip(paths_gps, color_list): 
+          
+          folium.PolyLine(locations=[list(reversed(coord)) for coord in path], 
+                          weigth=4, color=col, opacity=opacity, 
+                          dash_array='10' if dotted else None).add_to(map_f)
+
+    if show_markers:
+        lon_from, lat_from = paths_gps[0][0]
+        lon_to, lat_to = paths_gps[0][-1]
+        folium.Marker(location=[lat_from, lon_from], icon = folium.Icon(color='lightgreen'), popup='ORIGIN').add_to(map_f)
+        folium.Marker(location=[lat_to, lon_to], icon = folium.Icon(color='lightred'), popup='TARGET').add_to(map_f)
+
+    return map_f
+
+
+def edge_list_to_gps_list(edge_list, road_network, coordinate_table=None):
+    
+    if coordinate_table is None:
+        coordinate_table = network_coordinate_table(road_network)
+    
+    lon_from, lat_from = table_coordinates(coordinate_table["edges"], edge_list, point="from")
+    lon_to, lat_to = table_coordinates(coordinate_table["edges"], edge_list, point="to")
+    
+    # from and to node of each edge
+    lon = np.stack([lon_from, lon_to], axis=1).flatten().tolist()
+    lat = np.stack([lat_from, lat_to], axis=1).flatten().tolist()
+        
+    return list(zip(lon, lat))
+
+
+
+""" coordinate tables: GPS coordinates of the SUMO nodes and edges, projected once per network """
+
+
+# coordinate tables of the sumolib networks already seen (see network_coordinate_table)
+_coordinate_tables = weakref.WeakKeyDictionary()
+
+
+def sumo_coordinate_arrays(road_network):
+    
+    """
+    Collects the GPS coordinates of the nodes of a SUMO road network (projected with a single 
+    call to convertXY2LonLat) and the from / to node of each edge, in the order of 
+    road_network.getNodes() and road_network.getEdges().
+    """
+    
+    sumo_nodes = road_network.getNodes()
+    sumo_edges = road_network.getEdges()
+    
+    node_index = {node.getID(): ind for ind, node in enumerate(sumo_nodes)}
+    
+    node_xy = np.array([node.getCoord()[:2] for node in sumo_nodes], dtype=np.float64).reshape(-1, 2)
+    node_lon, node_lat = road_network.convertXY2LonLat(node_xy[:, 0].copy(), node_xy[:, 1].copy())
+    
+    return {"node_ids": np.array(list(node_index.keys()), dtype=str), 
+            "node_lon": np.asarray(node_lon, dtype=np.float64).reshape(-1), 
+            "node_lat": np.asarray(node_lat, dtype=np.float64).reshape(-1), 
+            "edge_ids": np.array([e.getID() for e in sumo_edges], dtype=str), 
+            "edge_node_from": np.array([node_index[e.getFromNode().getID()] for e in sumo_edges], dtype=np.int64), 
+            "edge_node_to": np.array([node_index[e.getToNode().getID()] for e in sumo_edges], dtype=np.int64)}
+
+
+def coordinate_table_from_arrays(coordinate_arrays):
+    
+    """
+    Builds the coordinate table of a network from the arrays of sumo_coordinate_arrays:
+    - 'nodes': node ID -> {'lon', 'lat'}
+    - 'edges': edge ID -> {'lon_from', 'lat_from', 'lon_to', 'lat_to', 'lon_avg', 'lat_avg'} 
+      (GPS coordinates of the from node, of the to node and their average)
+    
+    Both are SortedKeyIndex (see network_index.py) over contiguous float arrays, in the order 
+    of the SUMO network: table['nodes'].values['lon'][k] is the longitude of table['node_ids'][k].
+    """
+    
+    node_lon, node_lat = coordinate_arrays["node_lon"], coordinate_arrays["node_lat"]
+    node_from, node_to = coordinate_arrays["edge_node_from"], coordinate_arrays["edge_node_to"]
+    
+    lon_from, lat_from = node_lon[node_from], node_lat[node_from]
+    lon_to, lat_to = node_lon[node_to], node_lat[node_to]
+    
+    coordinate_table = dict(coordinate_arrays)
+    coordinate_table["nodes"] = SortedKeyIndex(coordinate_arrays["node_ids"], {"lon": node_lon, "lat": node_lat})
+    coordinate_table["edges"] = SortedKeyIndex(coordinate_arrays["edge_ids"], 
+                                               {"lon_from": lon_from, "lat_from": lat_from, 
+                                                "lon_to": lon_to, "lat_to": lat_to, 
+                                                "lon_avg": (lon_from + lon_to) / 2, "lat_avg": (lat_from + lat_to) / 2})
+    
+    return coordinate_table
+
+
+def network_coordinate_table(road_network):
+    
+    """
+    Returns the coordinate table of a sumolib road network (see coordinate_table_from_arrays), 
+    computed the first time and then reused for the same network object.
+    """
+    
+    if road_network not in _coordinate_tables:
+        _coordinate_tables[road_network] = coordinate_table_from_arrays(sumo_coordinate_arrays(road_network))
+    
+    return _coordinate_tables[road_network]
+
+
+def load_coordinate_table(road_network_path, road_network=None, cache_folder=None):
+    
+    """
+    Loads the coordinate table of a SUMO road network file, using an on-disk cache 
+    next to the network (see network_cache_filename).
+    
+    Parameters:
+        road_network_path: Path to the SUMO road network file (.net.xml).
+        road_network: The sumolib network of the file, if already loaded (it is read only 
+            if the cache is missing); the table is then reused by network_coordinate_table.
+        cache_folder: Folder of the cache (default: "igraph_cache" next to the road network file).
+    """
+    
+    cache_filename = network_cache_filename(road_network_path, f"coords_v{IGRAPH_CACHE_VERSION}", cache_folder=cache_folder)
+    
+    if os.path.exists(cache_filename):
+        with np.load(cache_filename, allow_pickle=False) as npz_file:
+            coordinate_table = coordinate_table_from_arrays({k: npz_file[k] for k in npz_file.files})
+    else:
+        if road_network is None:
+            road_network = sumolib.net.readNet(road_network_path, withInternal=False)
+        coordinate_arrays = sumo_coordinate_arrays(road_network)
+        
+        # write to a temporary file first, parallel workers may build the same cache
+        os.makedirs(os.path.dirname(cache_filename), exist_ok=True)
+        tmp_filename = f"{cache_filename}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_filename, **coordinate_arrays)
+        os.replace(tmp_filename, cache_filename)
+        
+        coordinate_table = coordinate_table_from_arrays(coordinate_arrays)
+    
+    if road_network is not None:
+        _coordinate_tables[road_network] = coordinate_table
+    
+    return coordinate_table
+
+
+def table_coordinates(index, ids, point=None):
+    
+    """
+    GPS coordinates of a list of IDs in a coordinate table (see coordinate_table_from_arrays).
+
+    Parameters:
+        index: table['nodes'] or table['edges']
+        ids: List of node or edge IDs.
+        point: For the edges, "from", "to" or "avg".
+
+    Returns:
+        (lon, lat) float64 arrays.
+    """
+    
+    positions = index.positions(np.array(ids, dtype=str))
+    
+    if (positions < 0).any():
+        raise KeyError(ids[int(np.flatnonzero(positions < 0)[0])])
+    
+    suffix = "" if point is None else f"_{point}"
+    
+    return index.values[f"lon{suffix}"][positions], index.values[f"lat{suffix}"][positions]
+
+def compute_ellipse(G, from_edge, to_edge, phi = 1.5, eta = 2, min_dist = 0.05):
+    
+    def get_center(s_lon, s_lat, t_lon, t_lat):
+        return (s_lon + t_lon) / 2, (s_lat + t_lat) / 2
+
+    def get_pythagoras(s_lon, s_lat, t_lon, t_lat):
+        # Calculate the distance using the Pythagorean theorem
+        return math.sqrt((t_lon - s_lon)**2 + (t_lat - s_lat)**2)
+
+    def get_angle(s_lon, s_lat, t_lon, t_lat):
+        # Calculate the angle in radians
+        angle_rad = math.atan2(t_lat - s_lat, t_lon - s_lon)
+        # Convert the angle to degrees
+        angle_deg = math.degrees(angle_rad)
+        return angle_deg
+
+    if type(from_edge) != str or type(to_edge) != str:
+        from_edge, to_edge = from_edge.getID(), to_edge.getID()
+
+    s_lon, s_lat = G.es[G["edge_sumo_ig"][from_edge]]['coordinates']['to']
+    t_lon, t_lat = G.es[G["edge_sumo_ig"][to_edge]]['coordinates']['from']
+    
+    center_point = get_center(s_lon, s_lat, t_lon, t_lat)
+    st_dist = get_pythagoras(s_lon, s_lat, t_lon, t_lat)
+    angle = get_angle(s_lon, s_lat, t_lon, t_lat)
+    
+    if st_dist <= min_dist:
+        st_dist = min_dist
+        eta = 1
+
+    # draw the ellipse using matplotlib
+    ellipse = Ellipse(center_point, st_dist * phi, st_dist * phi / eta, angle=angle)
+
+    return ellipse
+
+def ellipse_subgraph(G, from_edge, to_edge, phi = 1.5, eta = 2, min_dist = 0.05):
+    ellipse = compute_ellipse(G, from_edge, to_edge, phi = phi, eta = eta, min_dist = min_dist)
+    ellipsed_vert = vertices_in_ellipse(G, ellipse).tolist()
+    
+    return ellipse, G.subgraph(ellipsed_vert)
+
+
+def vertices_spatial_index(G):
+    """
+    Returns the spatial index of the vertices with a location (G['vertices_coords']), 
+    built the first time and stored in G["vertices_spatial_index"]:
+    - 'vertices': the igraph vertices (int64 array)
+    - 'coords': their (lon, lat) coordinates (float64 array, one row per vertex)
+    - 'tree': a scipy.spatial.cKDTree on the coordinates
+    """
+    
+    if "vertices_spatial_index" in G.attributes():
+        return G["vertices_spatial_index"]
+    
+    vertices_coords = G['vertices_coords']
+    coords = np.array(vertices_coords[:, 1].tolist(), dtype=np.float64).reshape(-1, 2)
+    
+    spatial_index = {"vertices": vertices_coords[:, 0].astype(np.int64), "coords": coords, "tree": cKDTree(coords)}
+    G["vertices_spatial_index"] = spatial_index
+    
+    return spatial_index
+
+
+def vertices_in_ellipse(G, ellipse):
+    """
+    Returns the igraph vertices (int64 array, sorted as G['vertices_coords']) inside a 
+    matplotlib Ellipse (see compute_ellipse).
+    
+    The candidates within the circle circumscribing the ellipse are selected with the 
+    spatial index of the vertices, then the analytic ellipse equation is tested on them.
+    The result is the one of Ellipse.contains_points, except for vertices close to the 
+    boundary (within a few percent of the semi-axes): matplotlib tests an approximation 
+    of the ellipse, while here the test is exact.
+    """
+    
+    spatial_index = vertices_spatial_index(G)
+    
+    center = np.asarray(ellipse.center, dtype=np.float64)
+    semi_width, semi_height = ellipse.width / 2, ellipse.height / 2
+    
+    candidates = np.array(spatial_index["tree"].query_ball_point(center, max(semi_width, semi_height)), dtype=np.int64)
+    candidates.sort()
+    
+    delta = spatial_index["coords"][candidates] - center
+    angle = np.deg2rad(ellipse.angle)
+    cos_a, sin_a = np.cos(angle), np.sin(angle)
+    
+    # coordinates along the axes of the ellipse
+    u = (delta[:, 0]*cos_a + delta[:, 1]*sin_a) / semi_width
+    v = (-delta[:, 0]*sin_a + delta[:, 1]*cos_a) / semi_height
+    
+    return spatial_index["vertices"][candidates[u**2 + v**2 < 1]]
+
+
+
+def edge_endpoints(G):
+    """
+    Returns the source and target vertices of the edges (int64 arrays), stored in G["edge_endpoints"].
+    """
+    
+    if "edge_endpoints" not in G.attributes():
+        edge_list = np.array(G.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+        G["edge_endpoints"] = (edge_list[:, 0], edge_list[:, 1])
+    
+    return G["edge_endpoints"]
+
+
+def ellipse_edge_mask(G, ellipse):
+    """
+    Boolean array with True for the edges having both endpoints inside the ellipse, 
+    i.e., the edges of the subgraph returned by ellipse_subgraph.
+    """
+    
+    inside = np.zeros(G.vcount(), dtype=bool)
+    inside[vertices_in_ellipse(G, ellipse)] = True
+    
+    edge_source, edge_target = edge_endpoints(G)
+    
+    return inside[edge_source] & inside[edge_target]
+
+
+def get_shortest_path_ellipse(G, from_edge, to_edge, attribute, phi = 1.5, eta = 2, min_dist = 0.05, backend="igraph"):
+    """
+    Shortest path between two edges restricted to the ellipse of the trip (see compute_ellipse), 
+    i.e., the path found on ellipse_subgraph, without copying the graph for every trip: 
+    the edges outside the ellipse get an infinite weight.
+
+    Parameters:
+        G: The igraph graph
+        from_edge: ID of the edge where the path starts
+        to_edge: ID of the edge where the path ends
+        attribute: The edge attribute to optimize the path on.
+        phi, eta, min_dist: Parameters of the ellipse (see compute_ellipse).
+        backend: "igraph" or "scipy".
+
+    Returns:
+        The dictionary returned by get_shortest_path (the edges refer to G), the cost is 
+        -1 if the destination cannot be reached inside the ellipse.
+    """
+    
+    ellipse = compute_ellipse(G, from_edge, to_edge, phi = phi, eta = eta, min_dist = min_dist)
+    
+    base_weights = edge_weights(G, attribute)
+    weights = np.where(ellipse_edge_mask(G, ellipse), base_weights, np.inf)
+    
+    # the first and last edges belong to the path in any case
+    id_ig_edges = [G["edge_sumo_ig"][from_edge], G["edge_sumo_ig"][to_edge]]
+    weights[id_ig_edges] = base_weights[id_ig_edges]
+    
+    if backend == "scipy":
+        res = get_shortest_path_scipy(G, from_edge, to_edge, weights)
+    else:
+        res = get_shortest_path(G, from_edge, to_edge, weights)
+    
+    # igraph can return a path through the edges outside the ellipse if there is no other path
+    if res["cost"] == float('inf'):
+        return {"sumo": [], "ig": [], "cost": -1}
+    
+    return res
+
+
+def get_shortest_path_nodes(G, from_node_sumo, to_node_sumo, attribute, backend="igraph"):
+    """
+    Find the shortest path between two SUMO nodes (junctions) in a igraph graph.
+    
+    A node that is not fully connected is expanded into sub-vertices: the path starts 
+    from one of its "_from" sub-vertices and ends in one of the "_to" sub-vertices of 
+    the destination, the cheapest combination is returned.
+
+    Parameters:
+        G: The igraph graph
+        from_node_sumo: ID of the SUMO node where the path starts
+        to_node_sumo: ID of the SUMO node where the path ends
+        attribute: The edge attribute to optimize the path on.
+        backend: "igraph", "scipy" (see get_shortest_paths_nodes_scipy) or "ch" (see get_shortest_paths_nodes_ch).
+
+    Returns:
+        A dictionary with the following keys:
+        - 'sumo' (List[str]): The edges of the path in SUMO format (None if no path exists)
+        - 'ig' (List[int]): The igraph edges ID of the path (None if no path exists)
+        - 'cost' (float): The total cost of the path (inf if no path exists)
+    """
+    
+    return get_shortest_paths_nodes(G, [(from_node_sumo, to_node_sumo)], attribute, backend=backend)[0]
 
-    if type(from_edge) != str or type(to_edge) != str:
-        from_edge, to_edge = from_edge.getID(), to_edge.getID()
 
-    s_lon, s_lat = G.es.find(id = from_edge)['coordinates']['to']
-    t_lon, t_lat = G.es.find(id = to_edge)['coordinates']['from']
+def sumo_node_to_ig_vertices(G, node_sumo, suffix):
+    """
+    Returns the igraph vertices of a SUMO node: the vertex itself if the node is fully 
+    connected, otherwise its sub-vertices ending with suffix ("_from" or "_to").
+    """
     
-    center_point = get_center(s_lon, s_lat, t_lon, t_lat)
-    st_dist = get_pythagoras(s_lon, s_lat, t_lon, t_lat)
-    angle = get_angle(s_lon, s_lat, t_lon, t_lat)
+    if node_sumo in G["vertex_sumo_ig"]:
+        return [G["vertex_sumo_ig"][node_sumo]]
     
-    if st_dist <= min_dist:
-        st_dist = min_dist
-        eta = 1
+    return [G["vertex_sumo_ig"][n] for n in G["vertices_to_subvertices"][node_sumo] if n.endswith(suffix)]
 
-    # draw the ellipse using matplotlib
-    ellipse = Ellipse(center_point, st_dist * phi, st_dist * phi / eta, angle)
 
-    return ellipse
+def get_shortest_paths_nodes(G, od_list, attribute, backend="igraph"):
+    """
+    Batched version of get_shortest_path_nodes.
+    
+    The trips are grouped by origin, and a single Dijkstra is run from each sub-vertex 
+    of the origin towards all the destination sub-vertices of the group. The paths and 
+    the costs are the same returned by get_shortest_path_nodes on each trip.
 
-def ellipse_subgraph(G, from_edge, to_edge, phi = 1.5, eta = 2, min_dist = 0.05):
-    ellipse = compute_ellipse(G, from_edge, to_edge, phi = phi, eta = eta, min_dist = min_dist)
-    vertices_coords = G['vertices_coords']
-    idx_in_ellipse = ellipse.contains_points(vertices_coords[:,1].tolist())
-    ellipsed_vert = vertices_coords[:,0][idx_in_ellipse].tolist()
+    Parameters:
+        G: The igraph graph
+        od_list: List of (from_node_sumo, to_node_sumo) pairs
+        attribute: The edge attribute to optimize the paths on.
+        backend: "igraph", "scipy" (see get_shortest_paths_nodes_scipy) or "ch" (see get_shortest_paths_nodes_ch).
+
+    Returns:
+        A list with, for each trip, the dictionary returned by get_shortest_path_nodes.
+    """
     
-    return ellipse, G.subgraph(ellipsed_vert)
+    if backend == "scipy":
+        return get_shortest_paths_nodes_scipy(G, od_list, attribute)
+    
+    if backend == "ch":
+        return get_shortest_paths_nodes_ch(G, od_list, attribute)
+    
+    # group the trips by origin
+    dict_origin_trips = {}
+    for ind, (from_node_sumo, _) in enumerate(od_list):
+        dict_origin_trips.setdefault(from_node_sumo, []).append(ind)
+    
+    results = [None]*len(od_list)
+    
+    for from_node_sumo, list_ind in dict_origin_trips.items():
+        
+        list_ig_nodes_from = sumo_node_to_ig_vertices(G, from_node_sumo, "_from")
+        dict_ig_nodes_to = {ind: sumo_node_to_ig_vertices(G, od_list[ind][1], "_to") for ind in list_ind}
+        
+        targets = list(dict.fromkeys(nt for ind in list_ind for nt in dict_ig_nodes_to[ind]))
+        
+        # (from sub-vertex, to sub-vertex) -> (path, cost)
+        dict_paths = {}
+        
+        if len(targets) > 0:
+            for nf in list_ig_nodes_from:
+                sp_ig = G.get_shortest_paths(nf, to=targets, weights=attribute, output="epath")
+                
+                for nt, path in zip(targets, sp_ig):
+                    if len(path) > 0:
+                        dict_paths[(nf, nt)] = (path, compute_path_cost(G, path, attribute))
+        
+        for ind in list_ind:
+            
+            min_cost = float('inf')
+            min_sp_sumo = None
+            min_sp_ig = None
+            
+            for nf in list_ig_nodes_from:
+                for nt in dict_ig_nodes_to[ind]:
+                    if (nf, nt) in dict_paths:
+                        path, cost = dict_paths[(nf, nt)]
+                        
+                        if cost < min_cost:
+                            min_cost = cost
+                            min_sp_ig = path
+            
+            if min_sp_ig is not None:
+                min_sp_sumo = [e for e in G.es[min_sp_ig]["id"] if e != "connection"]
+                min_sp_ig = list(min_sp_ig)
+            
+            results[ind] = {"sumo": min_sp_sumo, "ig": min_sp_ig, "cost": min_cost}
+    
+    return results
+
+
+
+def strongly_connected_labels(G):
+    """
+    Returns the strongly connected component of each vertex (int64 array), stored in G["scc_labels"].
+    
+    Two vertices with the same label are connected in both directions (a sufficient 
+    condition for a path between them, used to check the ODs without a shortest path).
+    """
+    
+    if "scc_labels" not in G.attributes():
+        G["scc_labels"] = np.array(G.connected_components(mode="strong").membership, dtype=np.int64)
+    
+    return G["scc_labels"]
+
+
+
+def reachability_index(G):
+    """
+    Returns the reachability index of the graph, built the first time and stored in G["reachability_index"]:
+    - 'scc': strongly connected component of each vertex (see strongly_connected_labels)
+    - 'to_giant', 'from_giant': whether each component reaches / is reached from the largest component
+    - 'desc_row', 'desc_bits': for the components not reaching the largest one, the row (-1 otherwise) 
+      of the bitset of their descendants in the condensation DAG (packed with np.packbits)
+    - 'anc_row', 'anc_bits': the same for the ancestors of the components not reached from the largest one
+    
+    A vertex reaching the largest component reaches every vertex reached from it, so the bitsets 
+    are stored only for the other components (dead ends and sources of the road network, closed 
+    under descendants / ancestors): every query is answered by array lookups (see vertices_reachable), 
+    without the quadratic memory of the bitsets of all the components.
+    """
+    
+    if "reachability_index" in G.attributes():
+        return G["reachability_index"]
+    
+    scc = strongly_connected_labels(G)
+    n_scc = int(scc.max())+1 if len(scc) > 0 else 0
+    
+    # condensation DAG: edges between different components
+    edge_source, edge_target = edge_endpoints(G)
+    scc_edges = np.unique(np.stack([scc[edge_source], scc[edge_target]], axis=1), axis=0).reshape(-1, 2)
+    scc_edges = scc_edges[scc_edges[:, 0] != scc_edges[:, 1]]
+    dag = Graph(n=n_scc, edges=scc_edges.tolist(), directed=True)
+    
+    giant = int(np.argmax(np.bincount(scc))) if n_scc > 0 else 0
+    to_giant = np.zeros(n_scc, dtype=bool)
+    from_giant = np.zeros(n_scc, dtype=bool)
+    if n_scc > 0:
+        to_giant[dag.subcomponent(giant, mode="in")] = True
+        from_giant[dag.subcomponent(giant, mode="out")] = True
+    
+    topo_order = dag.topological_sorting()
+    
+    def closure_bits(selected, order, mode):
+        # components in reverse topological order (for descendants): the neighbors are done first
+        row = np.full(n_scc, -1, dtype=np.int64)
+        components = [c for c in order if selected[c]]
+        row[components] = np.arange(len(components))
+        bits = np.zeros((len(components), (n_scc+7)//8), dtype=np.uint8)
+        for c in components:
+            neighbors = row[dag.neighbors(c, mode=mode)]
+            if len(neighbors) > 0:
+                bits[row[c]] = np.bitwise_or.reduce(bits[neighbors], axis=0)
+            bits[row[c], c >> 3] |= np.uint8(128 >> (c & 7))
+        return row, bits
+    
+    desc_row, desc_bits = closure_bits(~to_giant, topo_order[::-1], "out")
+    anc_row, anc_bits = closure_bits(~from_giant, topo_order, "in")
+    
+    G["reachability_index"] = {"scc": scc, "to_giant": to_giant, "from_giant": from_giant, 
+                               "desc_row": desc_row, "desc_bits": desc_bits, 
+                               "anc_row": anc_row, "anc_bits": anc_bits}
+    
+    return G["reachability_index"]
+
+
+def vertices_reachable(G, sources, targets):
+    """
+    Whether each target vertex is reachable from the corresponding source vertex (boolean array), 
+    using the reachability index of the graph (see reachability_index).
+    """
+    
+    index = reachability_index(G)
+    scc_from = index["scc"][np.asarray(sources, dtype=np.int64)]
+    scc_to = index["scc"][np.asarray(targets, dtype=np.int64)]
+    
+    def has_bit(bits, rows, c):
+        return (bits[rows, c >> 3] & (128 >> (c & 7)).astype(np.uint8)) > 0
+    
+    # same component, or through the largest component
+    reachable = (scc_from == scc_to) | (index["to_giant"][scc_from] & index["from_giant"][scc_to])
+    
+    # the source does not reach the largest component: descendants of the source
+    k = np.flatnonzero(~reachable & ~index["to_giant"][scc_from])
+    reachable[k] = has_bit(index["desc_bits"], index["desc_row"][scc_from[k]], scc_to[k])
+    
+    # the target is not reached from the largest component: ancestors of the target
+    k = np.flatnonzero(~reachable & index["to_giant"][scc_from] & ~index["from_giant"][scc_to])
+    reachable[k] = has_bit(index["anc_bits"], index["anc_row"][scc_to[k]], scc_from[k])
+    
+    return reachable
+
+
+
+""" scipy backend: Dijkstra on a CSR adjacency of the igraph network """
+
+
+def igraph_to_csr(G):
+    """
+    Exports the structure of the igraph network to a CSR adjacency, and stores it in G["csr_network"].
+    
+    Parallel edges (e.g., the connections of different lanes) are merged into a single entry of 
+    the adjacency, which holds the cheapest of them for the weights of each call (see csr_graph).
+
+    Parameters:
+        G: The igraph graph
+
+    Returns:
+        A dictionary with the CSR structure (indptr, indices) and the mapping between 
+        entries of the adjacency and igraph edges.
+    """
+    
+    edge_list = np.array(G.get_edgelist(), dtype=np.int64).reshape(-1, 2)
+    
+    csr_network = csr_network_from_edges(G.vcount(), edge_list[:, 0], edge_list[:, 1])
+    
+    G["csr_network"] = csr_network
+    
+    return csr_network
+
+
+def csr_network_from_edges(n_vertices, edge_source, edge_target):
+    """
+    CSR adjacency of a directed graph given as arrays of edge endpoints (see igraph_to_csr).
+    """
+    
+    edge_source = np.asarray(edge_source, dtype=np.int64)
+    edge_target = np.asarray(edge_target, dtype=np.int64)
+    
+    # sort the edges by (source, target), the parallel edges are contiguous
+    edge_key = edge_source*n_vertices + edge_target
+    edge_perm = np.argsort(edge_key, kind="stable")
+    sorted_key = edge_key[edge_perm]
+    
+    entry_start = np.flatnonzero(np.r_[True, sorted_key[1:] != sorted_key[:-1]]) if len(sorted_key) > 0 else np.array([], dtype=np.int64)
+    entry_key = sorted_key[entry_start]
+    entry_size = np.diff(np.r_[entry_start, len(sorted_key)])
+    entry_of_pos = np.repeat(np.arange(len(entry_start)), entry_size)
+    
+    # positions (in the sorted order) of the edges belonging to a parallel group
+    multi_pos = np.flatnonzero(entry_size[entry_of_pos] > 1)
+    
+    return {"n_vertices": n_vertices, 
+            "indptr": np.searchsorted(entry_key // max(n_vertices, 1), np.arange(n_vertices+1)), 
+            "indices": entry_key % max(n_vertices, 1), 
+            "entry_key": entry_key, 
+            "entry_edge": edge_perm[entry_start], 
+            "multi_edge": edge_perm[multi_pos], 
+            "multi_entry": entry_of_pos[multi_pos]}
+
+
+def edge_weights(G, attribute):
+    """
+    Returns the weights of the edges as a float array, attribute is the name of 
+    an edge attribute or an array (or list) with a weight for each edge.
+    """
+    
+    if isinstance(attribute, str):
+        return np.array(G.es[attribute], dtype=np.float64)
+    
+    return np.asarray(attribute, dtype=np.float64)
+
+
+def csr_graph(G, weights):
+    """
+    Builds the scipy CSR matrix of the igraph network for the given edge weights.
+
+    Parameters:
+        G: The igraph graph
+        weights: Array with the weight of each igraph edge.
+
+    Returns:
+        - The CSR matrix (scipy.sparse.csr_matrix) to be used with scipy.sparse.csgraph.
+        - The array with the igraph edge of each entry of the matrix.
+    """
+    
+    csr_network = G["csr_network"] if "csr_network" in G.attributes() else igraph_to_csr(G)
+    
+    entry_edge = csr_network["entry_edge"].copy()
+    
+    # cheapest edge among the parallel ones (the first in index order in case of ties)
+    multi_edge, multi_entry = csr_network["multi_edge"], csr_network["multi_entry"]
+    if len(multi_edge) > 0:
+        order = np.lexsort((multi_edge, weights[multi_edge], multi_entry))
+        first = np.r_[True, multi_entry[order][1:] != multi_entry[order][:-1]]
+        entry_edge[multi_entry[order][first]] = multi_edge[order][first]
+    
+    n_vertices = csr_network["n_vertices"]
+    matrix = csr_matrix((weights[entry_edge], csr_network["indices"], csr_network["indptr"]), shape=(n_vertices, n_vertices))
+    
+    return matrix, entry_edge
+
+
+def csr_path_to_edges(G, predecessors, target, entry_edge):
+    """
+    Translates the predecessors of a scipy Dijkstra into the igraph edges of the path ending in target.
+    """
+    
+    vertex_path = [target]
+    while predecessors[vertex_path[-1]] >= 0:
+        vertex_path.append(predecessors[vertex_path[-1]])
+    vertex_path = np.array(vertex_path[::-1], dtype=np.int64)
+    
+    csr_network = G["csr_network"]
+    keys = vertex_path[:-1]*csr_network["n_vertices"] + vertex_path[1:]
+    
+    return entry_edge[np.searchsorted(csr_network["entry_key"], keys)].tolist()
+
+
+def path_cost(G, edge_list, attribute, weights):
+    """
+    Cost of a path, computed as compute_path_cost when attribute is the name of an edge attribute.
+    """
+    
+    if isinstance(attribute, str):
+        return compute_path_cost(G, edge_list, attribute)
+    
+    return sum(weights[edge_list].tolist())
+
+
+def get_shortest_path_scipy(G, from_edge, to_edge, attribute):
+    """
+    Same as get_shortest_path, using scipy.sparse.csgraph.dijkstra on the CSR adjacency of the graph.
+    
+    attribute is the name of an edge attribute or an array with a weight for each igraph edge.
+    In case of paths with the same cost, the path may differ from the one found by igraph.
+    """
+    
+    weights = edge_weights(G, attribute)
+    
+    id_ig_edge_from = G["edge_sumo_ig"][from_edge]
+    id_ig_edge_to = G["edge_sumo_ig"][to_edge]
+    
+    if from_edge == to_edge:
+        return {"sumo": [from_edge], "ig": id_ig_edge_from, "cost": path_cost(G, id_ig_edge_from, attribute, weights)}
+    
+    index_from = G.es[id_ig_edge_from].target
+    index_to = G.es[id_ig_edge_to].source
+    
+    path = []
+    
+    if index_from != index_to:
+        matrix, entry_edge = csr_graph(G, weights)
+        _, predecessors = dijkstra(matrix, directed=True, indices=index_from, return_predecessors=True)
+        
+        if predecessors[index_to] < 0:
+            return {"sumo": [], "ig": [], "cost": -1}
+        
+        path = csr_path_to_edges(G, predecessors, index_to, entry_edge)
+    
+    edges_ig = [id_ig_edge_from]+path+[id_ig_edge_to]
+    
+    total_cost = path_cost(G, edges_ig, attribute, weights)
+    
+    edges_sumo = [from_edge]+[e for e in G.es[path]["id"] if e != "connection"]+[to_edge]
+    
+    return {"sumo": edges_sumo, "ig": edges_ig, "cost": total_cost}
+
+
+def get_shortest_paths_nodes_scipy(G, od_list, attribute, chunk_size=16):
+    """
+    Same as get_shortest_paths_nodes, using scipy.sparse.csgraph.dijkstra on the CSR adjacency of the graph.
+    
+    The trips are grouped by origin. The origins with a single vertex are routed in chunks 
+    (many sources in one dijkstra call); for the origins expanded into sub-vertices, a single 
+    dijkstra call starts from all of them at once (min_only, i.e., a virtual super-source). 
+    attribute is the name of an edge attribute or an array with a weight for each igraph edge.
+    In case of paths with the same cost, the path may differ from the one found by igraph.
+
+    Parameters:
+        G: The igraph graph
+        od_list: List of (from_node_sumo, to_node_sumo) pairs
+        attribute: The edge attribute (or the array of weights) to optimize the paths on.
+        chunk_size: Number of single-vertex origins routed in each dijkstra call.
 
+    Returns:
+        A list with, for each trip, the dictionary returned by get_shortest_path_nodes.
+    """
+    
+    weights = edge_weights(G, attribute)
+    matrix, entry_edge = csr_graph(G, weights)
+    
+    # group the trips by origin
+    dict_origin_trips = {}
+    for ind, (from_node_sumo, _) in enumerate(od_list):
+        dict_origin_trips.setdefault(from_node_sumo, []).append(ind)
+    
+    results = [None]*len(od_list)
+    
+    def route_trips(list_ig_nodes_from, list_ind, distances, predecessors):
+        for ind in list_ind:
+            
+            # a target that is also a source is reached with an empty path (not valid)
+            list_ig_nodes_to = [nt for nt in sumo_node_to_ig_vertices(G, od_list[ind][1], "_to") 
+                                if nt not in list_ig_nodes_from and predecessors[nt] >= 0]
+            
+            if len(list_ig_nodes_to) == 0:
+                results[ind] = {"sumo": None, "ig": None, "cost": float('inf')}
+                continue
+            
+            nt = min(list_ig_nodes_to, key=lambda v: distances[v])
+            path = csr_path_to_edges(G, predecessors, nt, entry_edge)
+            
+            results[ind] = {"sumo": [e for e in G.es[path]["id"] if e != "connection"], "ig": path, 
+                            "cost": path_cost(G, path, attribute, weights)}
+    
+    single_origins, multi_origins = [], []
+    for from_node_sumo in dict_origin_trips:
+        list_ig_nodes_from = sumo_node_to_ig_vertices(G, from_node_sumo, "_from")
+        if len(list_ig_nodes_from) == 1:
+            single_origins.append((list_ig_nodes_from, dict_origin_trips[from_node_sumo]))
+        else:
+            multi_origins.append((list_ig_nodes_from, dict_origin_trips[from_node_sumo]))
+    
+    # many sources in one call
+    for i in range(0, len(single_origins), chunk_size):
+        chunk = single_origins[i:i+chunk_size]
+        sources = [list_ig_nodes_from[0] for list_ig_nodes_from, _ in chunk]
+        distances, predecessors = dijkstra(matrix, directed=True, indices=sources, return_predecessors=True)
+        
+        for ind_source, (list_ig_nodes_from, list_ind) in enumerate(chunk):
+            route_trips(list_ig_nodes_from, list_ind, distances[ind_source], predecessors[ind_source])
+    
+    # virtual super-source on the sub-vertices of the origin
+    for list_ig_nodes_from, list_ind in multi_origins:
+        
+        if len(list_ig_nodes_from) == 0:
+            for ind in list_ind:
+                results[ind] = {"sumo": None, "ig": None, "cost": float('inf')}
+            continue
+        
+        distances, predecessors, _ = dijkstra(matrix, directed=True, indices=list_ig_nodes_from, 
+                                              return_predecessors=True, min_only=True)
+        route_trips(list_ig_nodes_from, list_ind, distances, predecessors)
+    
+    return results
 
 
-def get_shortest_path_nodes(G, from_node_sumo, to_node_sumo, attribute):
+def test_scipy_ig_shortest_paths(G, n_tests, attribute, th=1e-4, nodes=True):
+    """
+    Compares the costs of the shortest paths computed with the scipy and the igraph backends
+    on random pairs of SUMO nodes (nodes=True) or SUMO edges (nodes=False).
+    """
     
-    if from_node_sumo in G["vertex_sumo_ig"]:
-        list_ig_nodes_from = [G["vertex_sumo_ig"][from_node_sumo]]
+    if nodes:
+        sumo_elements = list(G["vertices_to_subvertices"].keys())
     else:
-        list_sumo_nodes_from = [n for n in G["vertices_to_subvertices"][from_node_sumo] if n.endswith("_from")]
-        list_ig_nodes_from = [G["vertex_sumo_ig"][n] for n in list_sumo_nodes_from]
+        sumo_elements = list(G["edge_sumo_ig"].keys())
+    
+    od_list = [(sumo_elements[np.random.randint(0, len(sumo_elements))], 
+                sumo_elements[np.random.randint(0, len(sumo_elements))]) for _ in range(n_tests)]
     
-    if to_node_sumo in G["vertex_sumo_ig"]:
-        list_ig_nodes_to = [G["vertex_sumo_ig"][to_node_sumo]]
+    if nodes:
+        res_ig = get_shortest_paths_nodes(G, od_list, attribute, backend="igraph")
+        res_scipy = get_shortest_paths_nodes(G, od_list, attribute, backend="scipy")
     else:
-        list_sumo_nodes_to = [n for n in G["vertices_to_subvertices"][to_node_sumo] if n.endswith("_to")]
-        list_ig_nodes_to = [G["vertex_sumo_ig"][n] for n in list_sumo_nodes_to]
+        res_ig = [get_shortest_path(G, o, d, attribute, backend="igraph") for o, d in od_list]
+        res_scipy = [get_shortest_path(G, o, d, attribute, backend="scipy") for o, d in od_list]
     
-    min_cost = float('inf')
-    min_sp_sumo = None
-    min_sp_ig = None
+    for (o, d), r_ig, r_scipy in zip(od_list, res_ig, res_scipy):
+        
+        if r_ig["cost"] in [-1, float('inf')] or r_scipy["cost"] in [-1, float('inf')]:
+            assert r_ig["cost"] == r_scipy["cost"], f"Error {o}, {d}"
+            continue
+        
+        assert abs(r_ig["cost"]-r_scipy["cost"])<th, f"Error {o}, {d}"
 
-    for nf in list_ig_nodes_from:
-        for nt in list_ig_nodes_to:
-            sp_ig = G.get_shortest_paths(nf, nt, weights=attribute, output="epath")
-            
-            if len(sp_ig[0]) > 0:
-                cost = compute_path_cost(G, sp_ig[0], attribute)
 
-                if cost < min_cost:
-                    min_cost = cost
-                    min_sp_sumo = [e for e in G.es[sp_ig[0]]["id"] if e != "connection"]
-                    min_sp_ig = sp_ig[0]
-                
-                
-    return {"sumo": min_sp_sumo, "ig": min_sp_ig, "cost": min_cost}
+
+
+""" contraction hierarchies backend: bidirectional upward search on a precomputed hierarchy """
+
+
+def load_contraction_hierarchy(G, attribute="traveltime", road_network_path=None, cache_folder=None):
+    """
+    Loads (or builds) the contraction hierarchy of the graph for an edge attribute, and stores it 
+    in G["contraction_hierarchies"][attribute] to be used by the "ch" backend.
+    
+    If road_network_path is given, the hierarchy is persisted next to the network (see 
+    network_cache_filename) and built only the first time.
+
+    Parameters:
+        G: The igraph graph (from from_sumo_to_igraph_network or load_igraph_network)
+        attribute: The (static) edge attribute to optimize the paths on.
+        road_network_path: Path to the SUMO road network file of G (optional).
+        cache_folder: Folder of the cache (default: "igraph_cache" next to the road network file).
+
+    Returns:
+        The contraction hierarchy (see contraction_hierarchy.build_contraction_hierarchy).
+    """
+    
+    if "contraction_hierarchies" not in G.attributes():
+        G["contraction_hierarchies"] = {}
+    
+    if road_network_path is None:
+        contraction_hierarchy = build_contraction_hierarchy(G, attribute)
+    
+    else:
+        cache_filename = network_cache_filename(road_network_path, f"ch_{attribute}_v{IGRAPH_CACHE_VERSION}", cache_folder=cache_folder)
+        
+        if os.path.exists(cache_filename):
+            contraction_hierarchy = load_contraction_hierarchy_file(cache_filename)
+        else:
+            contraction_hierarchy = build_contraction_hierarchy(G, attribute)
+            save_contraction_hierarchy(contraction_hierarchy, cache_filename)
+    
+    G["contraction_hierarchies"][attribute] = contraction_hierarchy
+    
+    return contraction_hierarchy
+
+
+def get_contraction_hierarchy(G, attribute):
+    """
+    Returns the contraction hierarchy of the graph for an edge attribute (built if not loaded yet).
+    """
+    
+    if "contraction_hierarchies" in G.attributes() and attribute in G["contraction_hierarchies"]:
+        return G["contraction_hierarchies"][attribute]
+    
+    warnings.warn(f"Building the contraction hierarchy for '{attribute}', use load_contraction_hierarchy to persist it.")
+    
+    return load_contraction_hierarchy(G, attribute)
+
+
+def get_shortest_path_ch(G, from_edge, to_edge, attribute):
+    """
+    Same as get_shortest_path, using the contraction hierarchy of the graph for attribute.
+    
+    In case of paths with the same cost, the path may differ from the one found by igraph.
+    """
+    
+    contraction_hierarchy = get_contraction_hierarchy(G, attribute)
+    
+    edge_from = G.es[G["edge_sumo_ig"][from_edge]]
+    edge_to = G.es[G["edge_sumo_ig"][to_edge]]
+    
+    if from_edge == to_edge:
+        return {"sumo": [from_edge], "ig": edge_from.index, "cost": edge_from[attribute]}
+    
+    path = []
+    
+    if edge_from.target != edge_to.source:
+        path = ch_shortest_path(contraction_hierarchy, [edge_from.target], [edge_to.source])
+        
+        if path is None:
+            return {"sumo": [], "ig": [], "cost": -1}
+    
+    edges_ig = [edge_from.index]+path+[edge_to.index]
+    
+    total_cost = compute_path_cost(G, edges_ig, attribute)
+    
+    edges_sumo = [from_edge]+[e for e in G.es[path]["id"] if e != "connection"]+[to_edge]
+    
+    return {"sumo": edges_sumo, "ig": edges_ig, "cost": total_cost}
+
+
+def get_shortest_paths_nodes_ch(G, od_list, attribute):
+    """
+    Same as get_shortest_paths_nodes, using the contraction hierarchy of the graph for attribute.
+    
+    All the sub-vertices of the origin (destination) are the sources (targets) of the query. 
+    The queries are solved in a batch (see contraction_hierarchy.ch_shortest_paths): the upward 
+    search space of each origin and of each destination is computed once. In case of paths with 
+    the same cost, the path may differ from the one found by igraph.
+    """
+    
+    contraction_hierarchy = get_contraction_hierarchy(G, attribute)
+    
+    list_sources_targets = []
+    valid_queries = []
+    
+    for from_node_sumo, to_node_sumo in od_list:
+        
+        list_ig_nodes_from = sumo_node_to_ig_vertices(G, from_node_sumo, "_from")
+        
+        # a target that is also a source is reached with an empty path (not valid)
+        list_ig_nodes_to = [nt for nt in sumo_node_to_ig_vertices(G, to_node_sumo, "_to") if nt not in list_ig_nodes_from]
+        
+        valid_queries.append(len(list_ig_nodes_from) > 0 and len(list_ig_nodes_to) > 0)
+        if valid_queries[-1]:
+            list_sources_targets.append((list_ig_nodes_from, list_ig_nodes_to))
+    
+    paths = iter(ch_shortest_paths(contraction_hierarchy, list_sources_targets))
+    
+    results = []
+    
+    for valid in valid_queries:
+        
+        path = next(paths) if valid else None
+        
+        if path is None:
+            results.append({"sumo": None, "ig": None, "cost": float('inf')})
+        else:
+            results.append({"sumo": [e for e in G.es[path]["id"] if e != "connection"], "ig": path, 
+                            "cost": compute_path_cost(G, path, attribute)})
+    
+    return results
@@ -0,0 +1,442 @@
+import os
+import json
+import time
+import signal
+import hashlib
+import subprocess
+import multiprocessing
+from datetime import datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+""" Scheduler of the simulation jobs: a bounded pool of subprocesses with timeouts, retries and a persisted state """
+
+
+def load_job_state(state_filename):
+    """
+    Loads the state of the jobs saved by save_job_state (empty if state_filename is None or missing).
+
+    Returns:
+    dict: {"jobs": job ID -> {"status": "pending"/"running"/"done"/"failed", "attempts": number of attempts}}.
+    """
+    if state_filename is None or not os.path.exists(state_filename):
+        return {"jobs": {}}
+
+    with open(state_filename) as json_file:
+        return json.load(json_file)
+
+
+def save_json(data, filename):
+    # write to a temporary file first, so that an interruption does not corrupt the file
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    with open(tmp_filename, "w") as json_file:
+        json.dump(data, json_file, indent=1)
+    os.replace(tmp_filename, filename)
+
+
+def save_job_state(state, state_filename):
+
+    if state_filename is not None:
+        save_json(state, state_filename)
+
+
+# exit code of the workers of a JobPool stopped by SIGTERM (see init_pool_worker)
+WORKER_TERMINATED_EXIT_CODE = 75
+
+# state of a worker of a JobPool: the queue where the started jobs are reported, and whether a job is running
+worker_started_jobs = None
+worker_running_job = False
+
+
+class WorkerTerminated(BaseException):
+    """
+    Raised in a job of a JobPool when its worker receives SIGTERM, so that the job can stop its subprocesses.
+    """
+
+
+class PoolJob:
+    """
+    Job submitted to a JobPool, with the methods of subprocess.Popen used by run_jobs.
+    """
+
+    def __init__(self, future, pool, executor, token):
+        self.future = future
+        self.pool = pool
+        self.executor = executor
+        self.token = token
+
+    def poll(self):
+        # None while running, 0 if the job ended, 1 if it raised an exception (or its worker died), 
+        # "interrupted" if it was stopped because of another job (see JobPool.broken_job_returncode)
+        if not self.future.done():
+            return None
+        if self.future.cancelled() or isinstance(self.future.exception(), BrokenProcessPool):
+            return self.pool.broken_job_returncode(self)
+        if self.future.exception() is not None:
+            return 1
+        return 0
+
+    def kill(self):
+        # a job cannot be stopped alone: all the workers are stopped (see JobPool)
+        self.pool.kill_workers()
+
+    def wait(self):
+        pass
+
+
+class JobPool:
+    """
+    Long-lived worker processes (concurrent.futures.ProcessPoolExecutor) running the jobs of run_jobs.
+
+    A worker that dies (e.g., killed by the OOM killer, a segfault, an abort of libsumo) breaks the 
+    executor: all its jobs end with BrokenProcessPool, and the next job starts a new executor. 
+    A job cannot be stopped alone (e.g., at the timeout of run_jobs): kill_workers stops all the workers.
+    Only the job whose worker died fails (and counts an attempt), the other jobs stopped with it 
+    are "interrupted" and run_jobs starts them again.
+    The workers started with init_pool_worker lead their own process group: the subprocesses left 
+    by a stopped (or dead) worker, e.g. SUMO, are killed with it.
+
+    Args:
+    n_workers (int): Number of worker processes.
+    initializer (callable): Called at the start of each worker (e.g., init_pool_worker).
+    kill_grace (float): Seconds given to the workers to exit after SIGTERM, before SIGKILL.
+    """
+
+    def __init__(self, n_workers, initializer=None, kill_grace=5):
+        self.n_workers = n_workers
+        self.initializer = initializer
+        self.kill_grace = kill_grace
+        self.executor = None
+        self.n_jobs = 0
+        # the workers report the jobs they start (token, pid), written without a feeder thread
+        self.started_jobs = multiprocessing.SimpleQueue()
+        # token of a job -> pid of its worker, pid -> worker process
+        self.job_pids = {}
+        self.worker_processes = {}
+        # process groups of the workers not killed yet
+        self.worker_pids = set()
+        # executors stopped by kill_workers
+        self.killed_executors = set()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Submits fn(*args, **kwargs) to a worker.
+
+        Returns:
+        PoolJob: The job, to be returned by the start_job of run_jobs.
+        """
+        if self.executor is not None:
+            try:
+                return self.submit_job(fn, *args, **kwargs)
+            except BrokenProcessPool:
+                # a worker died: the jobs start in a new executor
+                self.stop_executor()
+
+        self.executor = ProcessPoolExecutor(self.n_workers, initializer=init_job_worker, 
+                                            initargs=(self.started_jobs, self.initializer))
+        return self.submit_job(fn, *args, **kwargs)
+
+    def submit_job(self, fn, *args, **kwargs):
+        self.n_jobs += 1
+        future = self.executor.submit(run_pool_job, self.n_jobs, fn, args, kwargs)
+        # the executor starts its processes when the jobs are submitted (pid -> process, there is 
+        # no public access to them before ProcessPoolExecutor.terminate_workers in Python 3.14)
+        self.worker_processes.update(self.executor._processes)
+        self.worker_pids.update(self.executor._processes)
+        return PoolJob(future, self, self.executor, self.n_jobs)
+
+    def broken_job_returncode(self, job):
+        """
+        Return code of a job ended with BrokenProcessPool (or cancelled): "interrupted" if it was stopped 
+        because of another job (by kill_workers, or by the executor when another worker died), 1 if its worker died.
+        """
+        if job.executor in self.killed_executors:
+            return "interrupted"
+
+        while not self.started_jobs.empty():
+            token, pid = self.started_jobs.get()
+            self.job_pids[token] = pid
+
+        # a job that did not start yet
+        if job.token not in self.job_pids:
+            return "interrupted"
+
+        # the other workers are stopped by the executor with SIGTERM
+        process = self.worker_processes[self.job_pids[job.token]]
+        process.join(self.kill_grace)
+
+        return "interrupted" if process.exitcode == WORKER_TERMINATED_EXIT_CODE else 1
+
+    def kill_process_groups(self):
+        # kill what is left of the process groups of the workers (see init_pool_worker)
+        for pid in self.worker_pids:
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+        self.worker_pids = set()
+
+    def kill_workers(self):
+        """
+        Stops all the workers (SIGTERM, so that the jobs can stop their subprocesses, then SIGKILL 
+        after kill_grace seconds) and cancels the jobs not started yet: the jobs of the workers are 
+        "interrupted" (except the one killed by run_jobs). The next job starts a new executor.
+        """
+        if self.executor is None:
+            return
+
+        self.killed_executors.add(self.executor)
+
+        for process in self.executor._processes.values():
+            if process.is_alive():
+                process.terminate()
+
+        self.stop_executor()
+
+    def stop_executor(self):
+        # waits kill_grace seconds for the workers, then kills what is left of them
+        processes = list(self.executor._processes.values())
+
+        deadline = time.time() + self.kill_grace
+        for process in processes:
+            process.join(max(0, deadline - time.time()))
+
+        self.kill_process_groups()
+        for process in processes:
+            process.join()
+
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = None
+
+    def shutdown(self):
+        # waits for the running jobs, stops the workers and what is left of their subprocesses
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        self.kill_process_groups()
+
+
+def init_job_worker(started_jobs, initializer):
+    # initializer of the workers of a JobPool
+    global worker_started_jobs
+    worker_started_jobs = started_jobs
+    if initializer is not None:
+        initializer()
+
+
+def run_pool_job(token, fn, args, kwargs):
+    # runs a job of a JobPool in a worker, reporting its start
+    global worker_running_job
+    worker_started_jobs.put((token, os.getpid()))
+    try:
+        worker_running_job = True
+        return fn(*args, **kwargs)
+    except WorkerTerminated:
+        # the subprocesses of the job are stopped: the worker exits (without the tracebacks of the executor)
+        os._exit(WORKER_TERMINATED_EXIT_CODE)
+    finally:
+        worker_running_job = False
+
+
+def terminate_pool_worker(signum, frame):
+    # SIGTERM in a worker of a JobPool: the running job stops its subprocesses, an idle worker exits
+    if worker_running_job:
+        raise WorkerTerminated()
+    os._exit(WORKER_TERMINATED_EXIT_CODE)
+
+
+def init_pool_worker():
+    # the workers lead their own process group (with their subprocesses, see JobPool), 
+    # ignore Ctrl-C (handled by the main process, which stops the workers) 
+    # and exit on SIGTERM (see terminate_pool_worker)
+    os.setsid()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, terminate_pool_worker)
+
+
+def kill_job(process):
+    # kill the job and its children (e.g., SUMO started by launcher_sumo_simulation.py)
+    if isinstance(process, PoolJob):
+        process.kill()
+        return
+
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        process.kill()
+    process.wait()
+
+
+def run_jobs(jobs, start_job, n_slots, timeout=None, max_retries=0, state_filename=None, end_job=None, poll_interval=0.5):
+    """
+    Runs the jobs in a pool of n_slots subprocesses: a new job starts as soon as a slot is free.
+
+    Args:
+    jobs (iterable): (job ID, job) pairs, consumed lazily (a job is taken only when a slot is free).
+    start_job (callable): start_job(job) starts the job and returns its subprocess.Popen, which should
+        be started with start_new_session=True so that kill_job also stops its children, or a PoolJob
+        (see JobPool.submit).
+    n_slots (int): Maximum number of jobs running at the same time.
+    timeout (float): Seconds after which a running job is killed (and retried), None for no limit. 
+        With a JobPool, a backstop for the workers that hang (all the workers are stopped).
+    max_retries (int): Number of times a failed (or killed) job is started again. The jobs of a JobPool 
+        "interrupted" because of another job are started again without counting the attempt.
+    state_filename (str): JSON file where the state of the jobs is saved after each change. The jobs
+        already "done" in it are skipped, so that an interrupted run resumes where it stopped
+        (the jobs running when the run is interrupted are killed).
+    end_job (callable): end_job(job ID, job, status) called when a job ends, with status "done" or "failed".
+    poll_interval (float): Seconds between two checks of the running jobs.
+
+    Returns:
+    dict: The final state of the jobs (see load_job_state).
+    """
+    state = load_job_state(state_filename)
+    jobs = iter(jobs)
+    jobs_exhausted = False
+
+    running = {}
+    retry_queue = deque()
+
+    try:
+        while True:
+
+            # fill the free slots (retries first)
+            while len(running) < n_slots:
+                if len(retry_queue) > 0:
+                    job_id, job = retry_queue.popleft()
+                elif not jobs_exhausted:
+                    try:
+                        job_id, job = next(jobs)
+                    except StopIteration:
+                        jobs_exhausted = True
+                        continue
+                    if state["jobs"].get(job_id, {}).get("status") == "done":
+                        continue
+                    state["jobs"][job_id] = {"status": "pending", "attempts": 0}
+                else:
+                    break
+
+                state["jobs"][job_id]["status"] = "running"
+                state["jobs"][job_id]["attempts"] += 1
+                running[job_id] = (job, start_job(job), time.time())
+                save_job_state(state, state_filename)
+
+            if len(running) == 0:
+                break
+
+            time.sleep(poll_interval)
+
+            for job_id, (job, process, start_time) in list(running.items()):
+
+                returncode = process.poll()
+
+                if returncode is None:
+                    if timeout is None or time.time() - start_time < timeout:
+                        continue
+                    kill_job(process)
+                    returncode = "timeout"
+
+                del running[job_id]
+                state["jobs"][job_id]["returncode"] = returncode
+
+                if returncode == "interrupted":
+                    # stopped because of another job (see JobPool): started again, the attempt does not count
+                    state["jobs"][job_id]["attempts"] -= 1
+                    state["jobs"][job_id]["status"] = "pending"
+                    retry_queue.append((job_id, job))
+                elif returncode == 0:
+                    state["jobs"][job_id]["status"] = "done"
+                elif state["jobs"][job_id]["attempts"] <= max_retries:
+                    state["jobs"][job_id]["status"] = "pending"
+                    retry_queue.append((job_id, job))
+                else:
+                    state["jobs"][job_id]["status"] = "failed"
+
+                save_job_state(state, state_filename)
+
+                if end_job is not None and state["jobs"][job_id]["status"] in ["done", "failed"]:
+                    end_job(job_id, job, state["jobs"][job_id]["status"])
+
+    except BaseException:
+        # interrupted (e.g., KeyboardInterrupt): stop the running jobs, they are started again on resume
+        for job, process, start_time in running.values():
+            kill_job(process)
+        raise
+
+    return state
+
+
+
+""" Content-addressed simulations: each simulation is identified by a hash of its inputs, 
+and the manifest of an output folder indexes the simulations completed in it """
+
+
+MANIFEST_FILENAME = "manifest.json"
+
+
+def file_sha1(filename):
+    """
+    SHA-1 of the content of a file.
+    """
+    digest = hashlib.sha1()
+
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def get_sumo_version(sumo_binary="sumo"):
+    # version of SUMO (e.g., "1.19.0"), as in the log of launcher_sumo_simulation.py
+    command_output = subprocess.check_output([sumo_binary, "--version"]).decode("utf-8")
+    return command_output.splitlines()[0].split()[-1]
+
+
+def simulation_key(spec):
+    """
+    Deterministic key of a simulation: hash of its specification (a JSON-serializable dict with, 
+    e.g., the hashes of the network and of the route files, the mix, the SUMO options and version).
+    """
+    return hashlib.sha1(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def load_manifest(output_folder):
+    """
+    Loads the manifest of an output folder of simulations (empty if missing).
+
+    Returns:
+    dict: {"simulations": key -> {"folder" (in output_folder), "cell", "spec", "status": "current"/"stale", "date"}}.
+    """
+    manifest_filename = os.path.join(output_folder, MANIFEST_FILENAME)
+
+    if not os.path.exists(manifest_filename):
+        return {"simulations": {}}
+
+    with open(manifest_filename) as json_file:
+        return json.load(json_file)
+
+
+def add_to_manifest(output_folder, key, simulation_folder, cell, spec):
+    """
+    Records a completed simulation in the manifest of output_folder. The simulations of the same 
+    cell (e.g., {"pct": 10, "rep": 0}) with a different key (i.e., other inputs) become "stale".
+    """
+    manifest = load_manifest(output_folder)
+
+    for other_key, entry in manifest["simulations"].items():
+        if other_key != key and entry["cell"] == cell:
+            entry["status"] = "stale"
+
+    manifest["simulations"][key] = {"folder": os.path.basename(os.path.normpath(simulation_folder)), "cell": cell, "spec": spec, 
+                                    "status": "current", "date": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+
+    save_json(manifest, os.path.join(output_folder, MANIFEST_FILENAME))
+
+
+def simulation_completed(output_folder, manifest, key):
+    # the simulation is in the manifest and its output is complete (log.json is written last)
+    entry = manifest["simulations"].get(key)
+    return entry is not None and entry["status"] == "current" and os.path.exists(os.path.join(output_folder, entry["folder"], "log.json"))
@@ -0,0 +1,130 @@
+import time
+import subprocess
+import numpy as np
+
+# libsumo runs SUMO in the same process, traci (same API) in a subprocess connected through a socket
+try:
+    import libsumo as traci
+except ImportError:
+    import traci
+
+import traci.constants as tc
+
+from sumo_outputs import TRIPINFO_COLUMNS
+
+
+""" Live aggregation of the measures of a SUMO simulation (TraCI/libsumo), instead of the XML outputs """
+
+
+# speed (m/s) under which a vehicle is waiting (as SUMO_const_haltingSpeed)
+HALTING_SPEED = 0.1
+
+# columns of the trips (the ones of TRIPINFO_COLUMNS)
+LIVE_TRIP_COLUMNS = ["tripinfo_id", "tripinfo_duration", "tripinfo_routeLength", "tripinfo_stopTime",
+                     "tripinfo_timeLoss", "tripinfo_waitingCount", "tripinfo_waitingTime", "emissions_CO2_abs"]
+
+VEHICLE_VARIABLES = [tc.VAR_ROAD_ID, tc.VAR_SPEED, tc.VAR_CO2EMISSION, tc.VAR_DISTANCE, tc.VAR_TIMELOSS]
+
+
+def run_live_simulation(sumo_command, timeout=None, stdout=None):
+    """
+    Runs a SUMO simulation through TraCI (libsumo if installed) and aggregates, step by step, the
+    measures of the trips and of the edges saved by launcher_sumo_simulation.py (same columns as
+    sumo_outputs.extract_tripinfo and sumo_outputs.extract_edge_data), without tripinfo and edgeData outputs.
+
+    The measures are computed from the state of the vehicles at the end of each step, so they
+    approximate the ones of SUMO's outputs:
+    - CO2 of a trip and of an edge: sum of the CO2 emission rate (mg/s) * step length, the emissions of
+      a step are assigned to the edge of the vehicle at the end of the step (internal edges included).
+    - edge_traveltime: edge length / mean speed of the vehicles on the edge (as edgeData).
+    - tripinfo_routeLength and tripinfo_timeLoss: last values of the odometer and of the time loss.
+    - tripinfo_waitingTime and tripinfo_waitingCount: steps (and stops) with a speed under HALTING_SPEED.
+    - tripinfo_stopTime is 0 (the demands have no stops).
+    The vehicles that did not arrive (e.g., still running at the end) are not in the trip columns.
+
+    Parameters:
+    sumo_command (list): Command of SUMO (binary and options) without the tripinfo and edgeData outputs.
+    timeout (float): Seconds after which the simulation is stopped (subprocess.TimeoutExpired is raised).
+    stdout: Output of SUMO (e.g., subprocess.DEVNULL), as in traci.start.
+
+    Returns:
+    tuple: (trip columns, edge columns), dicts column -> np.array.
+    """
+    traci.start(sumo_command, stdout=stdout)
+
+    try:
+        step_length = traci.simulation.getDeltaT()
+        start_time = time.time()
+
+        # vehicle -> [depart, CO2, distance, time loss, waiting time, waiting count, is waiting]
+        dict_vehicles = {}
+        list_trips = []
+
+        # edge -> [CO2, sampled seconds, travelled distance]
+        dict_edges = {}
+
+        while traci.simulation.getMinExpectedNumber() > 0:
+
+            traci.simulationStep()
+            sim_time = traci.simulation.getTime()
+
+            for vehicle_id in traci.simulation.getDepartedIDList():
+                traci.vehicle.subscribe(vehicle_id, VEHICLE_VARIABLES)
+                dict_vehicles[vehicle_id] = [sim_time, 0.0, 0.0, 0.0, 0.0, 0, False]
+
+            for vehicle_id, values in traci.vehicle.getAllSubscriptionResults().items():
+                if vehicle_id not in dict_vehicles:
+                    continue
+
+                vehicle = dict_vehicles[vehicle_id]
+                edge_id = values[tc.VAR_ROAD_ID]
+                speed = values[tc.VAR_SPEED]
+                co2 = values[tc.VAR_CO2EMISSION] * step_length
+
+                vehicle[1] += co2
+                vehicle[2] = values[tc.VAR_DISTANCE]
+                vehicle[3] = values[tc.VAR_TIMELOSS]
+
+                if speed < HALTING_SPEED:
+                    vehicle[4] += step_length
+                    if not vehicle[6]:
+                        vehicle[5] += 1
+                vehicle[6] = speed < HALTING_SPEED
+
+                # teleporting vehicles are not on an edge
+                if edge_id == "":
+                    continue
+
+                edge = dict_edges.setdefault(edge_id, [0.0, 0.0, 0.0])
+                edge[0] += co2
+                edge[1] += step_length
+                edge[2] += speed * step_length
+
+            for vehicle_id in traci.simulation.getArrivedIDList():
+                if vehicle_id in dict_vehicles:
+                    depart, co2, distance, time_loss, waiting_time, waiting_count, _ = dict_vehicles.pop(vehicle_id)
+                    # values of LIVE_TRIP_COLUMNS
+                    list_trips.append((vehicle_id, sim_time - depart, distance, 0.0, time_loss, waiting_count, waiting_time, co2))
+
+            if timeout is not None and time.time() - start_time > timeout:
+                raise subprocess.TimeoutExpired(sumo_command, timeout)
+
+        # length of the edges (of their first lane)
+        edge_ids = list(dict_edges)
+        edge_lengths = np.array([traci.lane.getLength(f"{edge_id}_0") for edge_id in edge_ids])
+
+    finally:
+        traci.close()
+
+    trip_columns = {column: np.array([trip[i] for trip in list_trips]).astype(TRIPINFO_COLUMNS[column][2])
+                    for i, column in enumerate(LIVE_TRIP_COLUMNS)}
+
+    edge_values = np.array([dict_edges[edge_id] for edge_id in edge_ids], dtype=np.float64).reshape(-1, 3)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # edge length / mean speed, NaN if the vehicles did not move on the edge
+        edge_traveltime = np.where(edge_values[:, 2] > 0, edge_lengths * edge_values[:, 1] / edge_values[:, 2], np.nan)
+
+    edge_columns = {"edge_id": np.array(edge_ids).astype(str), "edge_CO2_abs": edge_values[:, 0], "edge_traveltime": edge_traveltime}
+
+    return trip_columns, edge_columns
@@ -0,0 +1,108 @@
+import gzip
+import numpy as np
+import xml.parsers.expat
+
+
+""" Extraction of the SUMO outputs (tripinfo and edgeData) in typed columnar arrays, saved as .npz """
+
+
+# column -> (element, attribute, dtype); the names of the columns are the ones of the CSV outputs
+# of xml2csv.py (e.g., "emissions_CO2_abs" is the attribute CO2_abs of the child emissions of a tripinfo).
+# Add here the other attributes to collect, e.g. ("emissions", "NOx_abs", np.float64)
+TRIPINFO_COLUMNS = {"tripinfo_id": ("tripinfo", "id", str),
+                    "tripinfo_duration": ("tripinfo", "duration", np.float64),
+                    "tripinfo_routeLength": ("tripinfo", "routeLength", np.float64),
+                    "tripinfo_stopTime": ("tripinfo", "stopTime", np.float64),
+                    "tripinfo_timeLoss": ("tripinfo", "timeLoss", np.float64),
+                    "tripinfo_waitingCount": ("tripinfo", "waitingCount", np.int64),
+                    "tripinfo_waitingTime": ("tripinfo", "waitingTime", np.float64),
+                    "emissions_CO2_abs": ("emissions", "CO2_abs", np.float64)}
+
+EDGE_DATA_COLUMNS = {"edge_id": ("edge", "id", str),
+                     "edge_CO2_abs": ("edge", "CO2_abs", np.float64),
+                     "edge_traveltime": ("edge", "traveltime", np.float64)}
+
+# value of the missing attributes
+MISSING_VALUES = {str: "", np.float64: "nan", np.int64: "-1"}
+
+
+def extract_xml_columns(xml_filename, row_tag, columns):
+    """
+    Extracts columns from a SUMO output file in a single streaming pass (expat), one row per
+    row_tag element. Only the attributes in columns are kept: those of the row_tag element
+    and those of its children (e.g., the emissions of a tripinfo).
+
+    Parameters:
+    xml_filename (str): SUMO output file (plain or .gz).
+    row_tag (str): Element of a row (e.g., "tripinfo" or "edge").
+    columns (dict): column -> (element, attribute, dtype), see TRIPINFO_COLUMNS.
+
+    Returns:
+    dict: column -> np.array of dtype (the missing attributes are "", NaN or -1).
+    """
+    values = {column: [] for column in columns}
+
+    # element -> [(attribute, values of the column, missing value)]
+    element_to_columns = {}
+    for column, (element, attribute, dtype) in columns.items():
+        element_to_columns.setdefault(element, []).append((attribute, values[column], MISSING_VALUES[dtype]))
+
+    row_columns = [column_values for list_columns in element_to_columns.values() for _, column_values, _ in list_columns]
+    row_missing = [missing for list_columns in element_to_columns.values() for _, _, missing in list_columns]
+    depth_row = [None]
+    depth = [0]
+
+    def start_element(name, attrs):
+        depth[0] += 1
+
+        if name == row_tag:
+            # a new row: the missing attributes keep their default value
+            depth_row[0] = depth[0]
+            for column_values, missing in zip(row_columns, row_missing):
+                column_values.append(missing)
+
+        if depth_row[0] is not None and name in element_to_columns:
+            for attribute, column_values, missing in element_to_columns[name]:
+                if attribute in attrs:
+                    column_values[-1] = attrs[attribute]
+
+    def end_element(name):
+        if depth_row[0] == depth[0]:
+            depth_row[0] = None
+        depth[0] -= 1
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+
+    open_function = gzip.open if xml_filename.endswith(".gz") else open
+    with open_function(xml_filename, "rb") as f:
+        parser.ParseFile(f)
+
+    return {column: np.array(values[column]).astype(dtype) for column, (_, _, dtype) in columns.items()}
+
+
+def extract_tripinfo(xml_filename, columns=TRIPINFO_COLUMNS):
+    # one row per vehicle (tripinfo-output)
+    return extract_xml_columns(xml_filename, "tripinfo", columns)
+
+
+def extract_edge_data(xml_filename, columns=EDGE_DATA_COLUMNS):
+    # one row per edge and interval (edgeData)
+    return extract_xml_columns(xml_filename, "edge", columns)
+
+
+def save_columns(columns, filename):
+    # compressed .npz with an array per column
+    np.savez_compressed(filename, **columns)
+
+
+def load_columns(filename):
+    """
+    Loads the columns saved by save_columns.
+
+    Returns:
+    dict: column -> np.array (e.g., pd.DataFrame(load_columns(filename)) gives the table of the CSV outputs).
+    """
+    with np.load(filename) as data:
+        return {column: data[column] for column in data.files}
@@ -7,10 +7,12 @@ import pandas as pd
 import geopandas as gpd
 import sumolib
 from tqdm.notebook import tqdm
-from routing_utils import from_sumo_to_igraph_network, get_shortest_path
+from routing_utils import (from_sumo_to_igraph_network, edge_endpoints, vertices_reachable, 
+                           network_coordinate_table, table_coordinates)
+from route_store import (ROUTE_STORE_SUFFIX, xml_tag, write_route_file, route_file_checksum, iter_route_file, route_file_to_store, 
+                         route_store_routes, load_route_store, find_route_file, 
+                         store_to_route_file, stack_route_stores, gather_routes)
 from math import sqrt, sin, cos, pi, asin
-import xml
-from xml.dom import minidom
 from itertools import groupby
 from skmob.measures.evaluation import common_part_of_commuters
 from scipy.stats import pearsonr
@@ -27,34 +29,24 @@ load_route_file_in_dict
 
 '''
 
-def create_dict_tile_edges(road_network, tessellation, exclude_roundabouts=False):
+def create_dict_tile_edges(road_network, tessellation, exclude_roundabouts=False, coordinate_table=None):
     
-    lng_list, lat_list, edge_id_list = [], [], []
+    # GPS coordinates of the from node of each edge (see routing_utils.load_coordinate_table)
+    if coordinate_table is None:
+        coordinate_table = network_coordinate_table(road_network)
 
-    edges_in_roundabouts = []
+    edge_id_list = coordinate_table["edge_ids"]
+    lng_list, lat_list = coordinate_table["edges"].values["lon_from"], coordinate_table["edges"].values["lat_from"]
 
     if exclude_roundabouts:
-        for r in road_network.getRoundabouts():
-            for e in r.getEdges():
-                edges_in_roundabouts.append(e)
-    
-    for edge in road_network.getEdges():
-
-        edge_id = edge.getID()
-
-        if edge_id not in edges_in_roundabouts:
-
-            lng, lat = gps_coordinate_of_edge_from(road_network, edge_id)
-
-            edge_id_list.append(edge_id)
-            lng_list.append(lng)
-            lat_list.append(lat)
-
+        edges_in_roundabouts = [e for r in road_network.getRoundabouts() for e in r.getEdges()]
+        mask = ~np.isin(edge_id_list, np.array(edges_in_roundabouts, dtype=str))
+        edge_id_list, lng_list, lat_list = edge_id_list[mask], lng_list[mask], lat_list[mask]
 
     edge_coords = gpd.points_from_xy(lng_list, lat_list)
     
     gpd_edges = gpd.GeoDataFrame(geometry=edge_coords)
-    gpd_edges['edge_ID'] = edge_id_list
+    gpd_edges['edge_ID'] = edge_id_list.tolist()
     
     sj = gpd.sjoin(tessellation, gpd_edges)
     sj = sj.drop(["index_right", "geometry"], axis=1)
@@ -64,43 +56,45 @@ def create_dict_tile_edges(road_network, tessellation, exclude_roundabouts=False
     return res
 
 
-def gps_coordinate_of_edge_from(net, edge_id):
+def gps_coordinate_of_edge_from(net, edge_id, coordinate_table=None):
 
-    x, y = net.getEdge(edge_id).getFromNode().getCoord()
-    lon, lat = net.convertXY2LonLat(x, y)
+    if coordinate_table is None:
+        coordinate_table = network_coordinate_table(net)
 
-    return lon, lat
+    coords = coordinate_table["edges"][edge_id]
 
+    return coords["lon_from"], coords["lat_from"]
 
 
-def create_dict_tile_nodes(road_network, tessellation, exclude_roundabouts=False):
-    
-    lng_list, lat_list, node_id_list = [], [], []
+def gps_coordinate_of_edge_avg(net, edge_id, coordinate_table=None):
 
-    nodes_in_roundabouts = []
+    if coordinate_table is None:
+        coordinate_table = network_coordinate_table(net)
 
-    if exclude_roundabouts:
-        for r in road_network.getRoundabouts():
-            for n in r.getNodes():
-                nodes_in_roundabouts.append(n)
+    coords = coordinate_table["edges"][edge_id]
 
-    for node in road_network.getNodes():
+    return coords["lon_avg"], coords["lat_avg"]
 
-        node_id = node.getID()
 
-        if node_id not in nodes_in_roundabouts:
 
-            lng, lat = gps_coordinate_of_node(road_network, node_id)
+def create_dict_tile_nodes(road_network, tessellation, exclude_roundabouts=False, coordinate_table=None):
+    
+    # GPS coordinates of the nodes (see routing_utils.load_coordinate_table)
+    if coordinate_table is None:
+        coordinate_table = network_coordinate_table(road_network)
 
-            node_id_list.append(node_id)
-            lng_list.append(lng)
-            lat_list.append(lat)
+    node_id_list = coordinate_table["node_ids"]
+    lng_list, lat_list = coordinate_table["nodes"].values["lon"], coordinate_table["nodes"].values["lat"]
 
+    if exclude_roundabouts:
+        nodes_in_roundabouts = [n for r in road_network.getRoundabouts() for n in r.getNodes()]
+        mask = ~np.isin(node_id_list, np.array(nodes_in_roundabouts, dtype=str))
+        node_id_list, lng_list, lat_list = node_id_list[mask], lng_list[mask], lat_list[mask]
 
     node_coords = gpd.points_from_xy(lng_list, lat_list)
 
     gpd_nodes = gpd.GeoDataFrame(geometry=node_coords)
-    gpd_nodes['node_ID'] = node_id_list
+    gpd_nodes['node_ID'] = node_id_list.tolist()
 
     sj = gpd.sjoin(tessellation, gpd_nodes)
     sj = sj.drop(["index_right", "geometry"], axis=1)
@@ -110,12 +104,40 @@ def create_dict_tile_nodes(road_network, tessellation, exclude_roundabouts=False
     return res
     
     
-def gps_coordinate_of_node(net, node_id):
+def gps_coordinate_of_node(net, node_id, coordinate_table=None):
+
+    if coordinate_table is None:
+        coordinate_table = network_coordinate_table(net)
+
+    coords = coordinate_table["nodes"][node_id]
+
+    return coords["lon"], coords["lat"]
+
 
-    x, y = net.getNode(node_id).getCoord()
-    lon, lat = net.convertXY2LonLat(x, y)
+def gps_coordinates_of_nodes(net, node_ids, coordinate_table=None):
+    """
+    Same as gps_coordinate_of_node for a list of nodes.
 
-    return lon, lat
+    Returns:
+    tuple: (lon, lat) float64 arrays.
+    """
+    if coordinate_table is None:
+        coordinate_table = network_coordinate_table(net)
+
+    return table_coordinates(coordinate_table["nodes"], node_ids)
+
+
+def gps_coordinates_of_edges_avg(net, edge_ids, coordinate_table=None):
+    """
+    Average of the GPS coordinates of the from and to nodes of a list of edges.
+
+    Returns:
+    tuple: (lon, lat) float64 arrays.
+    """
+    if coordinate_table is None:
+        coordinate_table = network_coordinate_table(net)
+
+    return table_coordinates(coordinate_table["edges"], edge_ids, point="avg")
 
 
 
@@ -128,7 +150,15 @@ def weighted_choice(choices, weights, n_samples=1):
 
 
 def create_traffic_demand_from_matrix(od_matrix, dict_mapping, n_vehicles, road_network, node_mode=True, threshold_km=1.2,
-                                      max_tries=100, random_seed=None, allow_self_tiles=True, show_progress=True):
+                                      max_tries=100, random_seed=None, allow_self_tiles=True, show_progress=True, G=None, 
+                                      vectorized=True, coordinate_table=None):
+    
+    # the per-vehicle sampler (vectorized=False) reproduces the demands generated with previous versions
+    if vectorized:
+        return create_traffic_demand_from_matrix_vectorized(od_matrix, dict_mapping, n_vehicles, road_network, node_mode=node_mode, 
+                                                            threshold_km=threshold_km, max_tries=max_tries, random_seed=random_seed, 
+                                                            allow_self_tiles=allow_self_tiles, show_progress=show_progress, G=G, 
+                                                            coordinate_table=coordinate_table)
     
     if random_seed is not None:
         np.random.seed(random_seed)
@@ -137,6 +167,10 @@ def create_traffic_demand_from_matrix(od_matrix, dict_mapping, n_vehicles, road_
     if show_progress:
          pbar = tqdm(total=n_vehicles) 
 
+    # GPS coordinates of the elements (see routing_utils.load_coordinate_table)
+    if coordinate_table is None:
+        coordinate_table = network_coordinate_table(road_network)
+
     # n_vehicles pairs in the form of (edge_start, edge_end)
     od_list, choices_list = [], []
 
@@ -153,8 +187,9 @@ def create_traffic_demand_from_matrix(od_matrix, dict_mapping, n_vehicles, road_
     weights = od_matrix.flatten()
 
 
-    # Convert the sumo network into an Igraph network
-    G = from_sumo_to_igraph_network(road_network)
+    # Convert the sumo network into an Igraph network (if not provided, e.g., by load_igraph_network)
+    if G is None:
+        G = from_sumo_to_igraph_network(road_network)
 
 
     # Generate a list of random indices based on weights
@@ -200,11 +235,11 @@ def create_traffic_demand_from_matrix(od_matrix, dict_mapping, n_vehicles, road_
 
                 # Compute element distance
                 if node_mode:
-                    lon_o, lat_o = gps_coordinate_of_node(road_network, element_start)
-                    lon_d, lat_d = gps_coordinate_of_node(road_network, element_end)
+                    lon_o, lat_o = gps_coordinate_of_node(road_network, element_start, coordinate_table)
+                    lon_d, lat_d = gps_coordinate_of_node(road_network, element_end, coordinate_table)
                 else:
-                    lon_o, lat_o = gps_coordinate_of_edge_avg(road_network, element_start)
-                    lon_d, lat_d = gps_coordinate_of_edge_avg(road_network, element_end)
+                    lon_o, lat_o = gps_coordinate_of_edge_avg(road_network, element_start, coordinate_table)
+                    lon_d, lat_d = gps_coordinate_of_edge_avg(road_network, element_end, coordinate_table)
 
                 d_km = distance_earth_km({"lat":lat_o, "lon":lon_o}, {"lat":lat_d, "lon":lon_d})
 
@@ -240,11 +275,11 @@ def create_traffic_demand_from_matrix(od_matrix, dict_mapping, n_vehicles, road_
 
                         # Compute element distance
                         if node_mode:
-                            lon_o, lat_o = gps_coordinate_of_node(road_network, element_start)
-                            lon_d, lat_d = gps_coordinate_of_node(road_network, element_end)
+                            lon_o, lat_o = gps_coordinate_of_node(road_network, element_start, coordinate_table)
+                            lon_d, lat_d = gps_coordinate_of_node(road_network, element_end, coordinate_table)
                         else:
-                            lon_o, lat_o = gps_coordinate_of_edge_avg(road_network, element_start)
-                            lon_d, lat_d = gps_coordinate_of_edge_avg(road_network, element_end)
+                            lon_o, lat_o = gps_coordinate_of_edge_avg(road_network, element_start, coordinate_table)
+                            lon_d, lat_d = gps_coordinate_of_edge_avg(road_network, element_end, coordinate_table)
 
                         d_km = distance_earth_km({"lat":lat_o, "lon":lon_o}, {"lat":lat_d, "lon":lon_d})
 
@@ -271,6 +306,160 @@ def create_traffic_demand_from_matrix(od_matrix, dict_mapping, n_vehicles, road_
 
 
 
+def create_traffic_demand_from_matrix_vectorized(od_matrix, dict_mapping, n_vehicles, road_network, node_mode=True, threshold_km=1.2,
+                                                 max_tries=100, random_seed=None, allow_self_tiles=True, show_progress=True, G=None, 
+                                                 coordinate_table=None):
+    """
+    Vectorized version of create_traffic_demand_from_matrix, with the same sampling scheme: 
+    for each vehicle, a pair of tiles is drawn according to the OD matrix, then up to max_tries 
+    pairs of elements of the two tiles are drawn uniformly; a pair is valid if the elements are 
+    at least threshold_km apart and connected. After max_tries invalid pairs, the pairs of the 
+    two tiles are scanned in random order and, if none is valid, a new pair of tiles is drawn.
+
+    The vehicles still without an OD are processed together at each pass: the tiles and the 
+    elements are drawn in blocks, the distances are computed on the precomputed coordinates 
+    of the elements, and the connectivity is checked with the reachability index of the graph 
+    (see routing_utils.reachability_index). 
+    The random draws differ from the per-vehicle sampler, so the same seed gives a different 
+    (but reproducible) demand.
+
+    Returns:
+    tuple: (od_list, choices_list) as in create_traffic_demand_from_matrix.
+    """
+    if random_seed is not None:
+        np.random.seed(random_seed)
+        print(f"seed set to: {random_seed}")
+
+    size = od_matrix.shape[0]
+
+    for i in range(size):
+        if str(i) not in dict_mapping.keys():
+            od_matrix[i] = 0
+            od_matrix[:, i] = 0
+
+    # Convert the sumo network into an Igraph network (if not provided, e.g., by load_igraph_network)
+    if G is None:
+        G = from_sumo_to_igraph_network(road_network)
+
+    # elements of all the tiles in a single table, tile i -> elements[tile_offset[i]:tile_offset[i+1]]
+    tile_elements = [dict_mapping.get(str(i), []) for i in range(size)]
+    tile_size = np.array([len(element_list) for element_list in tile_elements], dtype=np.int64)
+    tile_offset = np.r_[0, np.cumsum(tile_size)]
+    elements = [element for element_list in tile_elements for element in element_list]
+
+    if node_mode:
+        lon, lat = gps_coordinates_of_nodes(road_network, elements, coordinate_table)
+    else:
+        lon, lat = gps_coordinates_of_edges_avg(road_network, elements, coordinate_table)
+
+    # outgoing / incoming igraph edges of each element: element k -> out_edges[out_offset[k]:out_offset[k+1]]
+    out_edges, in_edges = [], []
+    for element in elements:
+        if node_mode:
+            out_edges.append([e.replace("_from","") for e in G["vertices_to_subvertices"][element] if "_from" in e])
+            in_edges.append([e.replace("_to","") for e in G["vertices_to_subvertices"][element] if "_to" in e])
+        else:
+            out_edges.append([element])
+            in_edges.append([element])
+    n_out = np.array([len(edge_list) for edge_list in out_edges], dtype=np.int64)
+    n_in = np.array([len(edge_list) for edge_list in in_edges], dtype=np.int64)
+    out_offset, in_offset = np.r_[0, np.cumsum(n_out)], np.r_[0, np.cumsum(n_in)]
+    out_edges = G["edge_sumo_ig"].positions(np.array([e for edge_list in out_edges for e in edge_list], dtype=str))
+    in_edges = G["edge_sumo_ig"].positions(np.array([e for edge_list in in_edges for e in edge_list], dtype=str))
+
+    def connected(ind_start, ind_end):
+        # all the (outgoing edge of the start, incoming edge of the end) pairs of each pair of elements
+        n_pairs = n_out[ind_start]*n_in[ind_end]
+        pair = np.repeat(np.arange(len(ind_start)), n_pairs)
+        local = np.arange(len(pair)) - np.repeat(np.cumsum(n_pairs) - n_pairs, n_pairs)
+        ef = out_edges[out_offset[ind_start][pair] + local // n_in[ind_end][pair]]
+        et = in_edges[in_offset[ind_end][pair] + local % n_in[ind_end][pair]]
+        return np.bincount(pair, weights=edges_connected(G, ef, et), minlength=len(ind_start)) > 0
+
+    def valid_pairs(ind_start, ind_end):
+        d_km = distances_earth_km(lon[ind_start], lat[ind_start], lon[ind_end], lat[ind_end])
+        valid = d_km >= threshold_km
+        valid[valid] = connected(ind_start[valid], ind_end[valid])
+        return valid
+
+    # tiles without elements cannot be chosen
+    has_elements = tile_size > 0
+    weights = (od_matrix * np.outer(has_elements, has_elements)).flatten().astype(np.float64)
+    weights = weights/sum(weights)
+
+    def draw_tile_pairs(n):
+        inds = np.random.choice(len(weights), p=weights, size=n)
+        if not allow_self_tiles:
+            self_tiles = np.flatnonzero(inds // size == inds % size)
+            while len(self_tiles) > 0:
+                inds[self_tiles] = np.random.choice(len(weights), p=weights, size=len(self_tiles))
+                self_tiles = self_tiles[inds[self_tiles] // size == inds[self_tiles] % size]
+        return inds
+
+    if show_progress:
+        pbar = tqdm(total=n_vehicles)
+
+    od_ind = np.full((n_vehicles, 2), -1, dtype=np.int64)
+    tile_pair = draw_tile_pairs(n_vehicles)
+    tries = np.zeros(n_vehicles, dtype=np.int64)
+    pending = np.arange(n_vehicles)
+
+    while len(pending) > 0:
+
+        # one pair of elements for each vehicle without an OD
+        tile_start, tile_end = tile_pair[pending] // size, tile_pair[pending] % size
+        ind_start = tile_offset[tile_start] + np.random.randint(0, tile_size[tile_start])
+        ind_end = tile_offset[tile_end] + np.random.randint(0, tile_size[tile_end])
+
+        valid = valid_pairs(ind_start, ind_end)
+        od_ind[pending[valid], 0], od_ind[pending[valid], 1] = ind_start[valid], ind_end[valid]
+        tries[pending[~valid]] += 1
+        n_done = valid.sum()
+
+        # max_tries reached: scan the pairs of the two tiles in random order
+        for v in pending[~valid][tries[pending[~valid]] == max_tries]:
+            tile_start, tile_end = tile_pair[v] // size, tile_pair[v] % size
+            perm_start = tile_offset[tile_start] + np.random.permutation(tile_size[tile_start])
+            perm_end = tile_offset[tile_end] + np.random.permutation(tile_size[tile_end])
+            all_start, all_end = np.repeat(perm_start, len(perm_end)), np.tile(perm_end, len(perm_start))
+
+            far = np.flatnonzero(distances_earth_km(lon[all_start], lat[all_start], lon[all_end], lat[all_end]) >= threshold_km)
+            found = []
+            for i in range(0, len(far), 256):
+                found = far[i:i+256][connected(all_start[far[i:i+256]], all_end[far[i:i+256]])]
+                if len(found) > 0:
+                    break
+
+            if len(found) > 0:
+                od_ind[v] = all_start[found[0]], all_end[found[0]]
+                n_done += 1
+            else:
+                # no valid pair: new pair of tiles
+                tile_pair[v] = draw_tile_pairs(1)[0]
+                tries[v] = 0
+
+        pending = pending[od_ind[pending, 0] < 0]
+
+        if show_progress:
+            pbar.update(int(n_done))
+
+    od_list = [[elements[i], elements[j]] for i, j in od_ind.tolist()]
+    choices_list = [(int(ind // size), int(ind % size)) for ind in tile_pair.tolist()]
+
+    return od_list, choices_list
+
+
+def edges_connected(G, edges_from, edges_to):
+    """
+    Vectorized are_edges_connected on arrays of igraph edges: whether each edge of edges_to 
+    is reachable from the corresponding edge of edges_from (reachability index of the graph).
+    """
+    edges_from, edges_to = np.asarray(edges_from, dtype=np.int64), np.asarray(edges_to, dtype=np.int64)
+    edge_source, edge_target = edge_endpoints(G)
+    
+    return (edges_from == edges_to) | vertices_reachable(G, edge_target[edges_from], edge_source[edges_to])
+
+
 def are_nodes_connected(G, origin_node, dest_node):
     
     edges_from = [e.replace("_from","") for e in G["vertices_to_subvertices"][origin_node] if "_from" in e]
@@ -279,20 +468,17 @@ def are_nodes_connected(G, origin_node, dest_node):
     if len(edges_from) == 0 or len(edges_to) == 0:
         return False
 
-    for ef in edges_from:
-        for et in edges_to:
-            if are_edges_connected(G, ef, et):
-                #print("Connected", ef, et, sp)
-                return True
-                
-    return False
+    # an edge from the origin to the destination, or a path from the end of an outgoing edge 
+    # to the start of an incoming edge (reachability index)
+    edges_from = [G["edge_sumo_ig"][ef] for ef in edges_from]
+    edges_to = [G["edge_sumo_ig"][et] for et in edges_to]
+
+    return bool(edges_connected(G, np.repeat(edges_from, len(edges_to)), np.tile(edges_to, len(edges_from))).any())
 
 
 def are_edges_connected(G, ex, ey):
     
-    sp = get_shortest_path(G, ex, ey, attribute="traveltime")
-    
-    return len(sp["sumo"])>0
+    return bool(edges_connected(G, [G["edge_sumo_ig"][ex]], [G["edge_sumo_ig"][ey]])[0])
     
     
 def distance_earth_km(src, dest):
@@ -305,188 +491,152 @@ def distance_earth_km(src, dest):
     return 6371.01 * ds
 
 
+def distances_earth_km(lon_src, lat_src, lon_dest, lat_dest):
+    """
+    Same as distance_earth_km on arrays of coordinates.
+    """
+    lat1, lat2 = np.asarray(lat_src)*pi/180, np.asarray(lat_dest)*pi/180
+    lon1, lon2 = np.asarray(lon_src)*pi/180, np.asarray(lon_dest)*pi/180
+    dlat, dlon = lat1-lat2, lon1-lon2
+
+    ds = 2 * np.arcsin(np.sqrt(np.sin(dlat/2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon/2.0) ** 2))
+    return 6371.01 * ds
+
+
 
 def create_xml_flows(dict_flows={}, filename=None, node_mode=True, lane_best=False):
-    
-    # xml creation
-    root = minidom.Document()
-    xml = root.createElement("routes")
-    xml.setAttribute("xmlns:xsi", "http://www.w3.org/2001/XMLSchema-instance")
-    xml.setAttribute("xsi:noNamespaceSchemaLocation", "http://sumo.dlr.de/xsd/routes_file.xsd")
-    root.appendChild(xml)
-
-    #vehicle type(s)
-    xml_element = root.createElement("vType")
-    xml_element.setAttribute("id", "type1")
-    xml_element.setAttribute("accel", "2.6")
-    xml_element.setAttribute("decel", "4.5")
-    xml_element.setAttribute("sigma", "0.5")
-    xml_element.setAttribute("length", "5")
-    xml_element.setAttribute("maxSpeed", "70")
-    xml.appendChild(xml_element)
-
-    valid_list = []
-    invalid_list = []
 
     # _______ FLOW ________
 
     # flows e.g. <flow id="flow_x" type="type1" begin="0" end="0" 
     # number="1" from="edge_start" to="edge_end" via="e_i e_j e_k"/>
 
-    # sort the dict
-    dict_flows_time_sorted = dict(sorted(dict_flows.items(), key=lambda item: item[1]['time']))
+    def flow_elements():
 
+        # sorted by departure time
+        for traj_id, flow in sorted(dict_flows.items(), key=lambda item: item[1]['time']):
 
-    for traj_id in dict_flows_time_sorted.keys():
+            element_list = flow['element']
+            element_list = [e for e in element_list if str(e)!="-1"]
 
-        element_list = dict_flows_time_sorted[traj_id]['element']
-        element_list = [e for e in element_list if str(e)!="-1"]
+            #remove consecutive duplicates
+            element_list = [x[0] for x in groupby(element_list)]
 
-        #remove consecutive duplicates
-        element_list = [x[0] for x in groupby(element_list)]
+            intermediate_list = str(element_list[1:-1]).replace(",","").replace("'","")[1:-1]
+            start_element = element_list[0]
+            end_element = element_list[-1]
 
-        intermediate_list = str(element_list[1:-1]).replace(",","").replace("'","")[1:-1]
-        start_element = element_list[0]
-        end_element = element_list[-1]
+            departure_time = flow['time']
 
-        departure_time = dict_flows_time_sorted[traj_id]['time']
+            dt = 10
+            flow_num = 1
+            col = "blue"
 
-        dt = 10
-        flow_num = 1
-        via = "false"
-        col = "blue"
+            attributes = [("type", "type1"), ("begin", departure_time), ("end", departure_time+dt), 
+                          ("number", flow_num), ("color", col)]
 
-        xml_element = root.createElement("flow")
-        xml_element.setAttribute("type", "type1")
-        xml_element.setAttribute("begin", str(departure_time))
-        xml_element.setAttribute("end", str(departure_time+dt))
-        xml_element.setAttribute("number", str(flow_num))
-        xml_element.setAttribute("color", col)
-        
-        if lane_best:
-            xml_element.setAttribute("departLane", "best")
+            if lane_best:
+                attributes.append(("departLane", "best"))
 
-        if node_mode:
-            xml_element.setAttribute("fromJunction", start_element)
-            xml_element.setAttribute("toJunction", end_element)
-        else:
-            xml_element.setAttribute("from", start_element)
-            xml_element.setAttribute("to", end_element)
+            if node_mode:
+                attributes += [("fromJunction", start_element), ("toJunction", end_element)]
+            else:
+                attributes += [("from", start_element), ("to", end_element)]
 
-        if len(element_list)>2:
-            if via:
-                xml_element.setAttribute("via", intermediate_list)
-        xml_element.setAttribute("id", traj_id)
-        xml.appendChild(xml_element)
+            if len(element_list)>2:
+                attributes.append(("via", intermediate_list))
 
-    xml_str = root.toprettyxml(indent="\t")
+            attributes.append(("id", traj_id))
 
-    with open(filename, "w") as f:
-        f.write(xml_str)
-        
+            yield xml_tag("flow", attributes)
+
+    write_route_file(filename, flow_elements())
         
         
-import gzip
-
-def create_xml_vehicles(dict_vehicles, filename, lane_best=True, compress=False, text_comment=""):
-    
-    # xml creation
-    root = minidom.Document()
-    xml = root.createElement("routes")
-    xml.setAttribute("xmlns:xsi", "http://www.w3.org/2001/XMLSchema-instance")
-    xml.setAttribute("xsi:noNamespaceSchemaLocation", "http://sumo.dlr.de/xsd/routes_file.xsd")
-    root.appendChild(xml)
-
-    #vehicle type(s)
-    element = root.createElement("vType")
-    element.setAttribute("id", "type1")
-    element.setAttribute("accel", "2.6")
-    element.setAttribute("decel", "4.5")
-    element.setAttribute("sigma", "0.5")
-    element.setAttribute("length", "5")
-    element.setAttribute("maxSpeed", "70")
-    xml.appendChild(element)
-    
-    # Adding comment at the beginning of the file
-    if text_comment != "":
-        comment = root.createComment(text_comment)
-        root.insertBefore(comment, xml)
-
-    # sort the dict by departure time
-    dict_vehicles_time_sorted = dict(sorted(dict_vehicles.items(), 
-                                            key=lambda item: item[1]['time']))
-
-
-    for traj_id in dict_vehicles_time_sorted.keys():
-
-            edge_list = dict_vehicles_time_sorted[traj_id]['edges']
-            start_second = str(dict_vehicles_time_sorted[traj_id]['time'])
-
-            try:
-                col = str(dict_vehicles_time_sorted[traj_id]['color'])
-            except:
-                col = "blue"
-            
-            element = root.createElement("vehicle")
-            element.setAttribute("color", col)
-            element.setAttribute("id", traj_id)
-            element.setAttribute("type", "type1")
-            
+
+def create_xml_vehicles(dict_vehicles, filename, lane_best=True, compress=False, text_comment="", checksum=False):
+
+    def vehicle_elements():
+
+        # sorted by departure time
+        for traj_id, vehicle in sorted(dict_vehicles.items(), key=lambda item: item[1]['time']):
+
+            edge_list = vehicle['edges']
+
+            attributes = [("color", vehicle.get('color', "blue")), ("id", traj_id), ("type", "type1")]
+
             if lane_best:
-                element.setAttribute("departLane", "best")
-                
-            element.setAttribute("depart", start_second)
-            
-            route_element = root.createElement("route")
-            
+                attributes.append(("departLane", "best"))
+
+            attributes.append(("depart", vehicle['time']))
+
             if type(edge_list) is list:
-                edge_list = str(edge_list).replace("'","").replace("[","").replace("]","").replace(",","")
-                
-            route_element.setAttribute("edges", edge_list)
-            
-            element.appendChild(route_element)
+                edge_list = " ".join(map(str, edge_list))
 
-            xml.appendChild(element)
+            yield xml_tag("vehicle", attributes, empty=False) + xml_tag("route", [("edges", edge_list)], indent="\t\t") + "\t</vehicle>\n"
 
-    xml_str = root.toprettyxml(indent="\t")
+    # SHA-1 of the text written (None if checksum is False), see route_file_checksum
+    return write_route_file(filename+".gz" if compress else filename, vehicle_elements(), compress=compress, 
+                            text_comment=text_comment, checksum=checksum)
 
-    if compress:
-        with gzip.open(filename+".gz", "wt") as f:
-            f.write(xml_str)
-    
-    else:  
-        with open(filename, "w") as f:
-            f.write(xml_str)
 
 
 
+def route_vehicle_id(v_id, original_name=False):
+    # vehicle IDs in the dictionaries of the route files (see load_route_file_in_dict)
+    if original_name:
+        return v_id.replace(".0","")
+    return int(v_id.split("_")[-1].replace(".0",""))
+
+
+def load_route_file_in_dict(filename, original_name=False, columnar=False):
+    """
+    Loads the vehicles of a SUMO route file or of a route store (see route_store.py).
+
+    Args:
+    filename (str): Path of the route file (gzipped if the name contains ".gz") or of the route store (.rou.npz).
+    original_name (bool): If True, the vehicle IDs are the ones of the file (without ".0"), 
+        otherwise the integer suffix of the IDs (e.g., "vehicle_12" -> 12).
+    columnar (bool): If True, returns the columnar result of load_route_file_columnar.
+
+    Returns:
+    dict: vehicle ID -> {"edges": list of edges, "time": departure time}.
+    """
+    if columnar:
+        return load_route_file_columnar(filename, original_name=original_name)
+
+    if filename.endswith(ROUTE_STORE_SUFFIX):
+        route_store = load_route_store(filename)
+        return {route_vehicle_id(v_id, original_name): {"edges":edges, "time":dep_time} 
+                for v_id, dep_time, edges in zip(route_store["vehicle_ids"].tolist(), route_store["time"].tolist(), 
+                                                 route_store_routes(route_store))}
 
-def load_route_file_in_dict(filename, original_name=False):
-    
-    if ".gz" in filename:    
-        with gzip.open(filename, 'rt') as f:
-            xml_content = f.read()
-        route_nav_xml = xml.dom.minidom.parseString(xml_content)
-    else:
-        route_nav_xml = xml.dom.minidom.parse(filename)
-        
     dict_path_nav = {}
 
-    for v in route_nav_xml.getElementsByTagName('vehicle'):
-        if original_name:
-            v_id = v.attributes['id'].value.replace(".0","")
-        else:
-            v_id = int(v.attributes['id'].value.split("_")[-1].replace(".0",""))
-        
-        str_edges = v.getElementsByTagName('route')[0].attributes['edges'].value.split(" ")
-        
-        dep_time = float(v.attributes['depart'].value)
-        
-        dict_path_nav[v_id] = {"edges":str_edges, "time":dep_time}
+    for v_id, depart, edges in iter_route_file(filename):
+        dict_path_nav[route_vehicle_id(v_id, original_name)] = {"edges":edges.split(" "), "time":float(depart)}
         
     return dict_path_nav
 
 
+def load_route_file_columnar(filename, original_name=False):
+    """
+    Loads the vehicles of a SUMO route file or of a route store as arrays, with the routes integer-encoded.
+
+    Returns:
+    dict: the arrays of the route store (see route_store.encode_routes), with the 'vehicle_ids' 
+    as in load_route_file_in_dict.
+    """
+    if filename.endswith(ROUTE_STORE_SUFFIX):
+        route_store = load_route_store(filename)
+    else:
+        route_store = route_file_to_store(filename)
+
+    route_store["vehicle_ids"] = np.array([route_vehicle_id(v_id, original_name) for v_id in route_store["vehicle_ids"].tolist()], 
+                                          dtype=str if original_name else np.int64)
+
+    return route_store
+
 
 def pearson_cpc_matrices(m1, m2):
     
@@ -539,158 +689,271 @@ def invalid_routes_in_demand(dict_mobility_demand, road_network_path):
     
     
     
-def create_mixed_route_demands(navigator, path_base_demand, path_demand_navigator, path_dict_set_vehicles, result_folder, 
-                               n_rep_min=0, n_rep_max=9, percentages=list(np.arange(0, 101, 10)), lane_best=True, compress=True):
-    
-    suffix_comp = ""
+def mixed_demand_filename(navigator, pct, rep):
+    # name of the route file of a mixed demand (utils_result parses pct and rep from it)
+    return f"{navigator}_{pct}_dua_{int(100-pct)}_rep_{rep}.rou.xml"
+
+
+def write_mixed_route_demand(mixed_demand, filename, lane_best=True, compress=True, checksum=False):
+    """
+    Writes a mixed demand (route store, see assemble_mixed_demand) as a SUMO route file.
+
+    With checksum=True, the file is read back and its SHA-1 is compared with the one of the 
+    text written (instead of reloading and comparing all the routes).
+
+    Returns:
+    str: The path of the route file.
+    """
+    digest = store_to_route_file(mixed_demand, filename, lane_best=lane_best, compress=compress, checksum=checksum)
+
     if compress:
-        suffix_comp=".gz"
-    
-    # Create the output folder
-    if not os.path.exists(result_folder):
-        os.makedirs(result_folder, exist_ok=True)
+        filename += ".gz"
+
+    if checksum:
+        assert route_file_checksum(filename) == digest, f"Error creation demand {filename}"
+
+    return filename
+
+
+def load_mixing_routes(path_base_demand, paths_demand_navigators):
+    """
+    Loads the routes of the non-routed (base) vehicles and of the vehicles routed by each navigator, 
+    stacked over a common vocabulary of the edges (see route_store.stack_route_stores).
+
+    Args:
+    path_base_demand (str): Route file (or route store) of the base demand.
+    paths_demand_navigators (list): Route files (or route stores) of the navigators.
+
+    Returns:
+    dict: The stacked routes, where row 0 of 'rows' is the base demand and row k the k-th navigator, 
+    with the 'vehicle_ids' (int) and the departure times ('time') of the base demand.
+    """
+    store_base = load_route_file_columnar(path_base_demand)
+    stores_navigators = [load_route_file_columnar(path) for path in paths_demand_navigators]
+
+    mixing_routes = stack_route_stores([store_base] + stores_navigators, store_base["vehicle_ids"])
+    mixing_routes["vehicle_ids"] = store_base["vehicle_ids"]
+    mixing_routes["time"] = np.asarray(store_base["time"])
+    mixing_routes["vehicle_sorter"] = np.argsort(store_base["vehicle_ids"], kind="stable")
+    mixing_routes["vehicle_suffixes"] = store_base["vehicle_ids"].astype(str)
+
+    return mixing_routes
+
+
+def vehicle_positions(mixing_routes, list_id_vehicles):
+    # positions in the base demand of the vehicles (the ones not in the base demand are ignored)
+    vehicle_ids, sorter = mixing_routes["vehicle_ids"], mixing_routes["vehicle_sorter"]
+    list_id_vehicles = np.asarray(list_id_vehicles, dtype=vehicle_ids.dtype)
+
+    if len(vehicle_ids) == 0 or len(list_id_vehicles) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    pos = sorter[np.searchsorted(vehicle_ids, list_id_vehicles, sorter=sorter).clip(max=len(vehicle_ids)-1)]
+
+    return pos[vehicle_ids[pos] == list_id_vehicles]
+
+
+def route_edge_counts(mixing_routes, rows):
+    # number of times each edge of the vocabulary of mixing_routes is traversed by the routes of rows
+    edges, _ = gather_routes(mixing_routes["edges"], mixing_routes["offsets"], rows)
+    return np.bincount(edges, minlength=len(mixing_routes["edge_ids"]))
+
+
+def iter_nested_assignments(mixing_routes, dict_set_vehicles, percentages, n_rep_min, n_rep_max, n_navigators=1):
+    """
+    Assignment vectors (see mixed_demand_from_assignment) of nested mixes: for each repetition, 
+    the percentages are taken in increasing order and each mix is derived from the previous one 
+    by flipping only the newly routed vehicles, which also update the counts of the edges traversed.
+
+    With several navigators (interplay), the new vehicles are assigned round-robin, continuing 
+    from the vehicles already routed, so that each navigator routes the same number of vehicles (up to one).
+
+    Yields:
+    tuple: (pct, rep, assignment, edge counts), the arrays are updated in place after each yield.
+    """
+    n_vehicles = len(mixing_routes["vehicle_ids"])
+    edge_counts_base = route_edge_counts(mixing_routes, mixing_routes["rows"][0])
+
+    for rep in range(n_rep_min, n_rep_max+1):
+
+        assignment = np.zeros(n_vehicles, dtype=np.int64)
+        edge_counts = edge_counts_base.copy()
+        n_routed = 0
+
+        for pct in sorted([p for p in percentages if 0<p<100]):
+
+            positions = vehicle_positions(mixing_routes, dict_set_vehicles[str(pct)][str(rep)])
+
+            # newly routed vehicles, in the order of the list
+            _, first = np.unique(positions, return_index=True)
+            positions = positions[np.sort(first)]
+            new_positions = positions[assignment[positions] == 0]
+
+            if n_routed + len(new_positions) != len(positions):
+                raise ValueError(f"The vehicles routed at {pct}% (rep {rep}) do not include the ones of the lower percentages, "
+                                 "nested mixes need nested sets (see create_dict_set_vehicles)")
+
+            assignment[new_positions] = (n_routed + np.arange(len(new_positions))) % n_navigators + 1
+            n_routed += len(new_positions)
+
+            rows_new = mixing_routes["rows"][assignment[new_positions], new_positions]
+            if (rows_new < 0).any():
+                raise KeyError(mixing_routes["vehicle_ids"][new_positions[np.argmax(rows_new < 0)]])
+
+            edge_counts -= route_edge_counts(mixing_routes, mixing_routes["rows"][0, new_positions])
+            edge_counts += route_edge_counts(mixing_routes, rows_new)
+
+            yield pct, rep, assignment, edge_counts
+
+
+def iter_mixed_route_demands(navigator, path_base_demand, path_demand_navigator, path_dict_set_vehicles, 
+                             n_rep_min=0, n_rep_max=9, percentages=list(np.arange(0, 101, 10)), nested=False):
+    """
+    Generates the mixed route demands lazily: each (pct, rep) demand is assembled only when 
+    it is requested, e.g., right before its simulation.
+
+    With nested=True, the vehicles routed at each percentage must include the ones routed at the 
+    lower percentages (create_dict_set_vehicles with nested=True): the mixes are generated repetition 
+    by repetition, each derived from the previous percentage (see iter_nested_assignments), and carry 
+    the 'edge_counts' of the edges traversed.
+
+    Yields:
+    tuple: (pct, rep, mixed demand as in assemble_mixed_demand), 0% and 100% first (only rep 0 
+    since they are deterministic), then the other percentages.
+    """
         
-    # Load the route demand for NON routed vehicles
-    dict_demand_base = load_route_file_in_dict(path_base_demand)
-    
-    # Load the route demand for ROUTED vehicles
-    dict_demand_navigator = load_route_file_in_dict(path_demand_navigator)
+    # Load the routes of the NON routed vehicles and of the ROUTED vehicles
+    mixing_routes = load_mixing_routes(path_base_demand, [path_demand_navigator])
+    n_vehicles = len(mixing_routes["vehicle_ids"])
     
     # Load the dict associating the vehicle to route for each % and rep
     with open(path_dict_set_vehicles) as json_file:
         dict_set_vehicles = json.load(json_file)
     
-    
-    # Create 0% (only 1 rep since it is deterministic)
     if 0 in percentages:
-        dict_demand_0pct = assemble_mixed_demand(navigator, dict_demand_base, dict_demand_navigator, [])
-        filename_save = f"{navigator}_0_dua_100_rep_0.rou.xml"
-        create_xml_vehicles(dict_demand_0pct, result_folder+filename_save, lane_best=lane_best, compress=compress);
-        
-        ## TEST
-        test_0pct = load_route_file_in_dict(result_folder+filename_save+suffix_comp)
-        assert test_0pct == dict_demand_base, "Error creation demand 0%"
-        
+        yield 0, 0, assemble_mixed_demand(navigator, mixing_routes, [])
     
-    # Create 100% (only 1 rep since it is deterministic)
     if 100 in percentages:
-        dict_demand_100pct = assemble_mixed_demand(navigator, dict_demand_base, dict_demand_navigator, list(dict_demand_base.keys()))
-        filename_save = f"{navigator}_100_dua_0_rep_0.rou.xml"
-        create_xml_vehicles(dict_demand_100pct, result_folder+filename_save, lane_best=lane_best, compress=compress);
-        
-        ## TEST
-        test_100pct = load_route_file_in_dict(result_folder+filename_save+suffix_comp)
-        assert test_100pct == dict_demand_navigator, "Error creation demand 100%"
-    
+        yield 100, 0, assemble_mixed_demand(navigator, mixing_routes, mixing_routes["vehicle_ids"])
+
+    if nested:
+        for pct, rep, assignment, edge_counts in iter_nested_assignments(mixing_routes, dict_set_vehicles, percentages, n_rep_min, n_rep_max):
+            mixed_demand = mixed_demand_from_assignment(mixing_routes, assignment, ["duarouter", navigator])
+            mixed_demand["edge_counts"] = edge_counts.copy()
+            yield pct, rep, mixed_demand
+        return
     
-    # Create the other percentages
     for pct in [p for p in percentages if 0<p<100]:
-        
-        str_pct = str(pct)
-        str_pct_inv = str(int(100-pct))
-
         for rep in range(n_rep_min, n_rep_max+1):
         
             list_id_routed_vehicles = dict_set_vehicles[str(pct)][str(rep)]
-            
-            dict_demand_xpct = assemble_mixed_demand(navigator, dict_demand_base, dict_demand_navigator, list_id_routed_vehicles)
 
-            filename_save = f"{navigator}_{str_pct}_dua_{str_pct_inv}_rep_{rep}.rou.xml"
-            create_xml_vehicles(dict_demand_xpct, result_folder+filename_save, lane_best=lane_best, compress=compress);
+            assert len(set(list_id_routed_vehicles)) == int(np.round(n_vehicles*(pct/100))), f"Error {pct}% rep {rep}"
             
-            ## TEST x%
-            count_routed, count_non_routed = 0, 0
-            
-            test_Xpct = load_route_file_in_dict(result_folder+filename_save+suffix_comp)
-            for vid in test_Xpct:
-                if vid in list_id_routed_vehicles:
-                    count_routed+=1
-                    assert test_Xpct[vid] == dict_demand_navigator[vid], f"Error creation demand {pct}% rep {rep}"
-                else:
-                    count_non_routed+=1
-                    assert test_Xpct[vid] == dict_demand_base[vid], f"Error creation demand {pct}% rep {rep}"
-                    
-            
-            assert count_routed+count_non_routed == len(dict_demand_base), f"Error SUM {pct}%"
-            
-            assert count_routed == int(np.round(len(dict_demand_base)*(pct/100))), f"Error {pct}% {count_routed} {int(np.round(len(dict_demand_base)*(pct/100)))}"
-                
+            yield pct, rep, assemble_mixed_demand(navigator, mixing_routes, list_id_routed_vehicles)
 
+
+def create_mixed_route_demands(navigator, path_base_demand, path_demand_navigator, path_dict_set_vehicles, result_folder, 
+                               n_rep_min=0, n_rep_max=9, percentages=list(np.arange(0, 101, 10)), lane_best=True, compress=True, 
+                               checksum=False, nested=False):
     
+    # Create the output folder
+    os.makedirs(result_folder, exist_ok=True)
+
+    for pct, rep, mixed_demand in iter_mixed_route_demands(navigator, path_base_demand, path_demand_navigator, path_dict_set_vehicles, 
+                                                           n_rep_min=n_rep_min, n_rep_max=n_rep_max, percentages=percentages, 
+                                                           nested=nested):
+        write_mixed_route_demand(mixed_demand, result_folder+mixed_demand_filename(navigator, pct, rep), 
+                                 lane_best=lane_best, compress=compress, checksum=checksum)
+                
+
     
-def assemble_mixed_demand(nav_name, dict_demand_base, dict_demand_navigator, list_id_routed):
-    
-        
-    list_id_routed = set(list_id_routed)
-    
-    dict_demand_tmp = {}
     
-    for vid in dict_demand_base:
+def assemble_mixed_demand(nav_name, mixing_routes, list_id_routed):
+    """
+    Mixed demand where the vehicles in list_id_routed follow the routes of the navigator 
+    (row 1 of mixing_routes, see load_mixing_routes) and the others the routes of the base demand.
+    """
+    assignment = np.zeros(len(mixing_routes["vehicle_ids"]), dtype=np.int64)
+    assignment[vehicle_positions(mixing_routes, list_id_routed)] = 1
 
-        dep_time = dict_demand_base[vid]['time']
+    return mixed_demand_from_assignment(mixing_routes, assignment, ["duarouter", nav_name])
 
-        if vid in list_id_routed:
-            vid_demand = f"{nav_name}_{vid}"
-            edge_list = dict_demand_navigator[vid]["edges"]
-        else:
-            vid_demand = f"duarouter_{vid}"
-            edge_list = dict_demand_base[vid]["edges"]
 
-        dict_demand_tmp[vid_demand] = {'edges':str(edge_list).replace(",","").replace("'","")[1:-1], 
-                                   'time': dep_time} 
-        
-    return dict_demand_tmp
+def mixed_demand_from_assignment(mixing_routes, assignment, list_names):
+    """
+    Gathers the route of each vehicle from the demand given by the assignment vector 
+    (0: base demand, k: k-th navigator of mixing_routes).
 
+    Args:
+    mixing_routes (dict): Stacked routes (see load_mixing_routes).
+    assignment (np.ndarray): Demand of each vehicle of the base demand.
+    list_names (list): Name of each demand, the prefix of the vehicle IDs (e.g., "duarouter_12").
 
+    Returns:
+    dict: Route store of the mixed demand (vehicles in the order of the base demand).
+    """
+    rows = mixing_routes["rows"][assignment, np.arange(len(assignment))]
 
+    if (rows < 0).any():
+        raise KeyError(mixing_routes["vehicle_ids"][np.argmax(rows < 0)])
 
+    edges, offsets = gather_routes(mixing_routes["edges"], mixing_routes["offsets"], rows)
+    prefixes = np.array([f"{name}_" for name in list_names], dtype=str)
 
+    return {"vehicle_ids": np.char.add(prefixes[assignment], mixing_routes["vehicle_suffixes"]),
+            "time": mixing_routes["time"],
+            "edge_ids": mixing_routes["edge_ids"],
+            "edges": edges,
+            "offsets": offsets,
+            "comment": np.array("", dtype=str)}
 
-def create_mixed_route_demands_interplay(interplay_name, list_navs_interplay, path_base_demand, path_folder_routed_navs, path_dict_set_vehicles, result_folder, n_rep_min=0, n_rep_max=9, percentages=list(np.arange(0, 101, 10)), lane_best=True, compress=True):
-    
-    suffix_comp = ""
-    if compress:
-        suffix_comp=".gz"
-    
-    # Create the output folder
-    if not os.path.exists(result_folder):
-        os.makedirs(result_folder, exist_ok=True)
-        
-    # Load the route demand for NON routed vehicles
-    dict_demand_base = load_route_file_in_dict(path_base_demand)
-    
-    # Load the route demands for ROUTED vehicles with interplay navs
-    dict_demands_navigator_interplay = {}
+
+
+
+
+
+def iter_mixed_route_demands_interplay(interplay_name, list_navs_interplay, path_base_demand, path_folder_routed_navs, path_dict_set_vehicles, 
+                                       n_rep_min=0, n_rep_max=9, percentages=list(np.arange(0, 101, 10)), compress=True, nested=False, 
+                                       seed=None):
+    """
+    Generates lazily the mixed route demands of the interplay of the navigators (see iter_mixed_route_demands):
+    the routed vehicles are split evenly among the navigators of list_navs_interplay.
+    With nested=True, the vehicles keep their navigator as the percentage grows (100% is drawn as usual).
+    With a seed, the split of each (pct, rep) is drawn from np.random.default_rng([seed, pct, rep]), 
+    so that the same inputs always give the same mixed demands.
+    """
     
+    # Route files of the ROUTED vehicles with interplay navs
+    paths_demand_navigators = []
+
     for navigator in list_navs_interplay:
-        path_demand_navigator = f"{path_folder_routed_navs}{navigator}.rou.xml{suffix_comp}"
+        path_demand_navigator = find_route_file(f"{path_folder_routed_navs}{navigator}", xml_suffix=f".rou.xml{'.gz' if compress else ''}")
         print(path_demand_navigator)
-        dict_tmp_demand_navigator = load_route_file_in_dict(path_demand_navigator)
-        dict_demands_navigator_interplay[navigator] = dict_tmp_demand_navigator
-
+        paths_demand_navigators.append(path_demand_navigator)
+        
+    # Load the routes of the NON routed vehicles and of the ROUTED vehicles
+    mixing_routes = load_mixing_routes(path_base_demand, paths_demand_navigators)
+    n_vehicles = len(mixing_routes["vehicle_ids"])
     
     # Load the dict associating the vehicle to route for each % and rep
     with open(path_dict_set_vehicles) as json_file:
         dict_set_vehicles = json.load(json_file)
     
-    
-    # Create 0% (only 1 rep since it is deterministic)
+    # 0% (only 1 rep since it is deterministic)
     if 0 in percentages:
-        dict_demand_0pct = assemble_mixed_demand(interplay_name, dict_demand_base, {}, [])
-        filename_save = f"{interplay_name}_0_dua_100_rep_0.rou.xml"
-        create_xml_vehicles(dict_demand_0pct, result_folder+filename_save, lane_best=lane_best, compress=compress);
-        
-        ## TEST
-        test_0pct = load_route_file_in_dict(result_folder+filename_save+suffix_comp)
-        assert test_0pct == dict_demand_base, "Error creation demand 0%"
+        yield 0, 0, assemble_mixed_demand(interplay_name, mixing_routes, [])
+
+    if nested:
+        for pct, rep, assignment, edge_counts in iter_nested_assignments(mixing_routes, dict_set_vehicles, percentages, n_rep_min, n_rep_max, 
+                                                                         n_navigators=len(list_navs_interplay)):
+            mixed_demand = mixed_demand_from_assignment(mixing_routes, assignment, ["duarouter"] + list(list_navs_interplay))
+            mixed_demand["edge_counts"] = edge_counts.copy()
+            yield pct, rep, mixed_demand
+
+        percentages = [p for p in percentages if p in [0, 100]]
 
-    # --- --- --- ---
-    
-    # Create the other percentages
     for pct in [p for p in percentages if p>0]:
-        
-        str_pct = str(pct)
-        str_pct_inv = str(int(100-pct))
 
         if pct == 100:
             rep_range = [0, 1]
@@ -702,101 +965,47 @@ def create_mixed_route_demands_interplay(interplay_name, list_navs_interplay, pa
             if pct != 100:
                 list_id_routed_vehicles = dict_set_vehicles[str(pct)][str(rep)]
             else:
-                list_id_routed_vehicles = list(dict_demand_base.keys())
+                list_id_routed_vehicles = mixing_routes["vehicle_ids"].tolist()
 
-            dict_demand_xpct = assemble_mixed_demand_interplay(dict_demand_base, dict_demands_navigator_interplay, list_id_routed_vehicles)
+            assert len(set(list_id_routed_vehicles)) == int(np.round(n_vehicles*(pct/100))), f"Error {pct}% rep {rep}"
 
-            filename_save = f"{interplay_name}_{str_pct}_dua_{str_pct_inv}_rep_{rep}.rou.xml"
-            create_xml_vehicles(dict_demand_xpct, result_folder+filename_save, lane_best=lane_best, compress=compress);
-            
-            ## TEST x%
-            count_routed, count_non_routed = 0, 0
-            
-            test_Xpct = load_route_file_in_dict(result_folder+filename_save+suffix_comp)
-            for vid in test_Xpct:
-                if vid in list_id_routed_vehicles:
-                    count_routed+=1
-                    #assert test_Xpct[vid] == dict_demand_navigator[vid], f"Error creation demand {pct}% rep {rep}"
-                else:
-                    count_non_routed+=1
-                    assert test_Xpct[vid] == dict_demand_base[vid], f"Error creation demand {pct}% rep {rep}"
-
-            # test fraction interplay
-            n_expected_per_nav = (len(dict_demand_base)*pct/100)/len(list_navs_interplay)
-            for nav in list_navs_interplay:
-                cnt = 0
-                for vid in dict_demand_xpct:
-                    if nav in vid:
-                        cnt+=1
-                        
-            assert cnt == n_expected_per_nav, f"Error interplay nav={nav} {cnt} {n_expected_per_nav}"
-            
-            assert count_routed+count_non_routed == len(dict_demand_base), f"Error SUM {pct}%"
-            
-            assert count_routed == int(np.round(len(dict_demand_base)*(pct/100))), f"Error {pct}% {count_routed} {int(np.round(len(dict_demand_base)*(pct/100)))}"
-    
+            rng = None if seed is None else np.random.default_rng([seed, int(pct), int(rep)])
 
+            yield pct, rep, assemble_mixed_demand_interplay(mixing_routes, list_navs_interplay, list_id_routed_vehicles, rng=rng)
 
-def assemble_mixed_demand_interplay(dict_demand_base, dict_demands_navigator_interplay, list_id_routed):
 
-    # list of navigators
-    list_navigators = list(dict_demands_navigator_interplay.keys())
+def create_mixed_route_demands_interplay(interplay_name, list_navs_interplay, path_base_demand, path_folder_routed_navs, path_dict_set_vehicles, result_folder, n_rep_min=0, n_rep_max=9, percentages=list(np.arange(0, 101, 10)), lane_best=True, compress=True, checksum=False, nested=False):
     
-    # random order permutation
-    permuted_list_id = np.random.permutation(list_id_routed)
-    
-    # just to check if a vehicle is routed or not
-    list_id_routed_check = set(list_id_routed)
-    
-    # dict that associates to each navigator in the interplay set the list of vehicles routed with it
-    dict_navigators_ids = {}
-    s_tmp = set()
+    # Create the output folder
+    os.makedirs(result_folder, exist_ok=True)
 
-    intervals_interplay_ids = generate_intervals(len(list_id_routed), len(list_navigators))
-    
-    for ind, nav in enumerate(list_navigators):
-        left_interval_nav = intervals_interplay_ids[ind][0]
-        right_interval_nav = intervals_interplay_ids[ind][1]
-        dict_navigators_ids[nav] = set(permuted_list_id[left_interval_nav:right_interval_nav])
-        s_tmp.update(dict_navigators_ids[nav])
-    
-    assert len(s_tmp) == len(list_id_routed), "ERROR dict_navigators_ids"
-    
-    dict_demand_tmp = {}
+    for pct, rep, mixed_demand in iter_mixed_route_demands_interplay(interplay_name, list_navs_interplay, path_base_demand, path_folder_routed_navs, 
+                                                                     path_dict_set_vehicles, n_rep_min=n_rep_min, n_rep_max=n_rep_max, 
+                                                                     percentages=percentages, compress=compress, nested=nested):
+        write_mixed_route_demand(mixed_demand, result_folder+mixed_demand_filename(interplay_name, pct, rep), 
+                                 lane_best=lane_best, compress=compress, checksum=checksum)
     
-    for vid in dict_demand_base:
-    
-        dep_time = dict_demand_base[vid]['time']
-    
-        if vid in list_id_routed_check:
-            # which navigator?
-            navigator_to_assign = [nav for nav in dict_navigators_ids if vid in dict_navigators_ids[nav]][0]
-            
-            vid_demand = f"{navigator_to_assign}_{vid}"
-            edge_list = dict_demands_navigator_interplay[navigator_to_assign][vid]["edges"]
-        else:
-            vid_demand = f"duarouter_{vid}"
-            edge_list = dict_demand_base[vid]["edges"]
-    
-        dict_demand_tmp[vid_demand] = {'edges':str(edge_list).replace(",","").replace("'","")[1:-1], 
-                                   'time': dep_time} 
 
 
-    ## test correctness
-    for vid in dict_demand_tmp:
+def assemble_mixed_demand_interplay(mixing_routes, list_navigators, list_id_routed, rng=None):
+    """
+    Mixed demand where the vehicles in list_id_routed are split evenly (in random order) among 
+    the navigators (rows 1, 2, ... of mixing_routes) and the others follow the routes of the base demand.
+    The random order is drawn from rng (a np.random.Generator), or from the global state of np.random.
+    """
     
-        vid_int = int(vid.split("_")[1])
-        edges_assigned = dict_demand_tmp[vid]["edges"].split(" ")
-        
-        if vid_int in list_id_routed_check:
-            edges_gt = dict_demands_navigator_interplay[vid.split("_")[0]][vid_int]["edges"]
-        else:
-            edges_gt = dict_demand_base[vid_int]["edges"]
-            
-        assert edges_assigned == edges_gt, f"ERROR {vid} {edges_assigned} {edges_gt}"
+    # random order permutation
+    permuted_list_id = (np.random if rng is None else rng).permutation(list_id_routed)
+
+    # navigator of each vehicle (0: non-routed)
+    assignment = np.zeros(len(mixing_routes["vehicle_ids"]), dtype=np.int64)
 
+    intervals_interplay_ids = generate_intervals(len(list_id_routed), len(list_navigators))
     
-    return dict_demand_tmp
+    for ind, (left_interval_nav, right_interval_nav) in enumerate(intervals_interplay_ids):
+        assignment[vehicle_positions(mixing_routes, permuted_list_id[left_interval_nav:right_interval_nav])] = ind+1
+
+    return mixed_demand_from_assignment(mixing_routes, assignment, ["duarouter"] + list(list_navigators))
 
 
 
@@ -868,17 +1077,37 @@ def apply_duarouter(route_file_path, road_network_path, weight, output_demand_fi
     os.remove(output_demand_filename.split(".rou")[0]+".rou.alt"+output_demand_filename.split(".rou")[1])
 
     
-def create_dict_set_vehicles(N, n_rep_min, n_rep_max, percentages):
+def create_dict_set_vehicles(N, n_rep_min, n_rep_max, percentages, nested=False):
+    """
+    Draws the vehicles routed by the navigators for each percentage (0 < pct < 100) and repetition.
+
+    Args:
+    N (int): Number of vehicles (IDs 0, ..., N-1).
+    n_rep_min, n_rep_max (int): Repetitions (included).
+    percentages (list): Adoption rates.
+    nested (bool): If True, a single permutation is drawn for each repetition and the vehicles 
+        routed at each percentage are its first pct*N/100 elements, so that they include the ones 
+        routed at the lower percentages (see iter_mixed_route_demands with nested=True).
+
+    Returns:
+    dict: str(pct) -> str(rep) -> list of the IDs of the routed vehicles.
+    """
 
     dict_set_vehicles = {}
 
+    if nested:
+        permutations_rep = {rep: np.random.permutation(np.arange(N)) for rep in range(n_rep_min, n_rep_max+1)}
+
     for pct in percentages:
         if pct not in [0, 100]:
             dict_set_vehicles[str(pct)] = {}
             for rep in range(n_rep_min, n_rep_max+1):
                 max_ind = int((pct * N)/100)
-                permutation_array = np.random.permutation(np.arange(N))[:max_ind]
+                if nested:
+                    permutation_array = permutations_rep[rep][:max_ind]
+                else:
+                    permutation_array = np.random.permutation(np.arange(N))[:max_ind]
                 # take the pct elements 
                 dict_set_vehicles[str(pct)][str(rep)] = [int(x) for x in permutation_array]
                 
-    return dict_set_vehicles
\ No newline at end of file
+    return dict_set_vehicles
@@ -9,6 +9,8 @@ from multiprocessing import Pool
 from scipy.stats import entropy
 import sumolib
 from datetime import datetime
+from simulation_jobs import load_manifest
+from sumo_outputs import load_columns
 
 
 def get_formatted_date():
@@ -35,12 +37,25 @@ def pct_and_rep_from_sim_info(f):
     
     with open(f, 'r') as file:
         data = json.load(file)
-        pct = int(data["route_filename"].split("/")[-1].split("_")[1])
-        rep = int(data["route_filename"].split("/")[-1].split("_")[5].split(".")[0])
+
+    # pct and rep of the mix saved by launcher_traffico2
+    if "pct" in data.get("mix", {}):
+        return int(data["mix"]["pct"]), int(data["mix"]["rep"])
+
+    pct = int(data["route_filename"].split("/")[-1].split("_")[1])
+    rep = int(data["route_filename"].split("/")[-1].split("_")[5].split(".")[0])
         
     return pct, rep
 
 
+def load_sim_table(output_folder, name):
+    # output of a simulation (e.g., "trips_info"): columnar .npz, or .csv.gz of the older simulations
+    if os.path.exists(f"{output_folder}/{name}.npz"):
+        return pd.DataFrame(load_columns(f"{output_folder}/{name}.npz"))
+
+    return pd.read_csv(f"{output_folder}/{name}.csv.gz", compression="zip")
+
+
 def compute_measures_parallel(city, list_navigators, list_bases, list_N, list_pct, road_network_edge_list, folder_output_results):
     pool = Pool()  # Create a pool of processes
     for navigator in list_navigators:
@@ -74,16 +89,25 @@ def process_and_save(city, navigator, base, list_N, list_pct, road_network_edge_
         sim_outputs_folder = f"{sim_output_folder}{city}/N{N}_{navigator}_{base}/"
         output_folders_list = [sim_outputs_folder+f for f in os.listdir(sim_outputs_folder) if ".ipynb" not in f]
 
+        # skip the simulations whose inputs changed after they ran (see simulation_jobs.add_to_manifest)
+        manifest = load_manifest(sim_outputs_folder)
+        stale_folders = set(sim_outputs_folder+entry["folder"] for entry in manifest["simulations"].values() if entry["status"] == "stale")
+        output_folders_list = [f for f in output_folders_list if f not in stale_folders]
+
         #print(city, navigator, base, len(output_folders_list))
 
         for output_folder in output_folders_list:
+            # skip the simulations that did not end (killed or failed, log.json is written last)
+            if not os.path.exists(output_folder+"/log.json"):
+                continue
+
             # retrieve the routed percentage and number of rep
             pct, rep = pct_and_rep_from_sim_info(output_folder+"/log.json")
 
             if pct in list_pct:
 
                 # info trips
-                df_trips = pd.read_csv(f"{output_folder}/trips_info.csv.gz", compression="zip")
+                df_trips = load_sim_table(output_folder, "trips_info")
     
                 # info simulation
                 with open(f"{output_folder}/log.json", 'r') as file:
@@ -129,7 +153,7 @@ def process_and_save(city, navigator, base, list_N, list_pct, road_network_edge_
 
 
                 # Entropy CO2 emissions edges
-                df_edges = pd.read_csv(f"{output_folder}/edge_emissions.csv.gz", compression="zip")
+                df_edges = load_sim_table(output_folder, "edge_emissions")
                 df_edges["is_internal"] = df_edges["edge_id"].apply(lambda x: x[0]==":")
                 
                 df_edges_co2 = df_edges[df_edges["is_internal"]==False]
@@ -1,17 +1,17 @@
 import warnings
 warnings.filterwarnings("ignore")
 
-import sumolib
 import json
 import numpy as np
 
 import gzip
 
-from routing_utils import from_sumo_to_igraph_network, get_shortest_path_nodes
+from routing_utils import load_igraph_network, attach_igraph_network, get_shortest_path_nodes, get_shortest_paths_nodes, apply_randomization_my_duarouter, distort_weights
 from tqdm import tqdm
 
 import os
 import argparse
+import multiprocessing as mp
 
 
 def save_dict_to_gzipped_json(data, filename):
@@ -24,35 +24,6 @@ def load_dict_from_gzipped_json(filename):
     return data
 
 
-def apply_randomization_my_duarouter(G, w, default_attribute="", tmp_attribute=""):
-    """
-    Apply random noise to the edge weights of a graph.
-
-    Args:
-    - G: The graph object.
-    - w: The randomization factor for the random noise.
-    - default_attribute: The name of the default edge attribute representing the original edge weights (optional).
-    - tmp_attribute: The name of the temporary edge attribute to store the distorted edge weights (optional).
-
-    Returns:
-    None
-    """
-
-    # Get the list of edges in the graph
-    edge_list = G.es()
-    
-    # Apply random noise to each edge weight
-    rand_noise_list = np.random.uniform(1, w, size=len(edge_list))
-    for ind, e in enumerate(edge_list):
-        # Check if the edge is not a "connection" (optional)
-        if e["id"] != "connection":
-            # Apply the random noise to the edge weight
-            e[tmp_attribute] = e[default_attribute] * rand_noise_list[ind]
-
-            
-            
-
-
 # ARGUMENTS
 
 parser = argparse.ArgumentParser()
@@ -66,10 +37,18 @@ parser.add_argument('-d', '--demand-file', type=str, required=True)
 parser.add_argument('--ind-from', type=int, required=True)
 parser.add_argument('--ind-to', type=int, required=True)
 parser.add_argument('--seed', type=int, default=-1)
+parser.add_argument('--backend', type=str, default="igraph", choices=["igraph", "scipy"])
+parser.add_argument('--shared-network', type=str, default=None, help="Name of the shared memory block with the network (see share_igraph_network)")
+parser.add_argument('--njobs', type=int, default=1, help="Number of worker processes sharing the loaded graph")
+parser.add_argument('--chunk-size', type=int, default=100, help="Number of vehicles per task of the worker processes")
 
 
 args = parser.parse_args()
 
+# the shared network has no igraph structure (arrays only)
+if args.shared_network is not None and args.backend != "scipy":
+    parser.error("--shared-network requires --backend scipy")
+
 city = args.city
 
 N_max = args.N
@@ -84,6 +63,11 @@ road_network_path = args.road_file
 
 attribute = "traveltime"
 
+backend = args.backend
+
+njobs = args.njobs
+chunk_size = args.chunk_size
+
 if args.seed > 0:
     random_seed = args.seed
 else:
@@ -99,11 +83,13 @@ if not os.path.exists(result_folder):
 
 # ### Load the road network
 
-# Read the road network from a file using SUMO library
-road_network = sumolib.net.readNet(road_network_path, withInternal=False)
-
-# Convert the road network to an igraph representation
-G = from_sumo_to_igraph_network(road_network)
+# Convert the road network to an igraph representation 
+# (cached on disk after the first conversion, skipping sumolib), 
+# or attach to the network shared by the launcher (arrays only, routed with the scipy backend)
+if args.shared_network is not None:
+    G = attach_igraph_network(args.shared_network)
+else:
+    G = load_igraph_network(road_network_path)
 
 
 # Load the Mobility Demand 
@@ -120,26 +106,94 @@ default_attribute = attribute
 # tmp traveltime
 tmp_attribute = f"tmp_{attribute}"
 
-# Copy the tmp attribute
-G.es[tmp_attribute] = G.es[default_attribute] 
+# Copy the tmp attribute (the scipy backend uses an array of weights instead)
+if backend != "scipy":
+    G.es[tmp_attribute] = G.es[default_attribute] 
+
+# Default weights and connections as arrays (to distort the weights of each vehicle at once)
+base_weights = np.array(G.es[default_attribute], dtype=np.float64)
+connection_mask = np.array(G.es["id"]) == "connection"
+
 
-for vid in tqdm(np.arange(ind_from, ind_to)):
+def route_vehicles(list_vid):
+    """
+    Compute the MYDUA path of a range of vehicles.
+
+    Args:
+    list_vid (array): IDs of the vehicles to route.
+
+    Returns:
+    dict: vehicle ID -> list of SUMO edges of the path.
+    """
+    dict_paths = {}
+
+    if w == 1:
+        # No distortion (e.g., IGfastest): the weights are the default ones for every vehicle, 
+        # so all the trips are routed in a single batch grouped by origin
+        od_list = [dict_demand[f"vehicle_{vid}"]["element"] for vid in list_vid]
+        
+        for vid, res in zip(list_vid, get_shortest_paths_nodes(G, od_list, default_attribute, backend=backend)):
+            dict_paths[int(vid)] = res["sumo"]
+
+        return dict_paths
+
+    for vid in list_vid:
     
-    # Retrieve the source and destination nodes for the current vehicle from the demand dictionary
-    from_node, to_node = dict_demand[f"vehicle_{vid}"]["element"]
+        # Retrieve the source and destination nodes for the current vehicle from the demand dictionary
+        from_node, to_node = dict_demand[f"vehicle_{vid}"]["element"]
     
-    if random_seed is not None:
-        hash_value = hash((random_seed, vid)) % 2**32
-        np.random.seed(hash_value)
+        if random_seed is not None:
+            hash_value = hash((random_seed, vid)) % 2**32
+            np.random.seed(hash_value)
     
-    # Apply random distortion to the edge weights of the graph using the specified parameters
-    apply_randomization_my_duarouter(G, w, default_attribute=default_attribute, tmp_attribute=tmp_attribute)
+        if backend == "scipy":
+            # The distorted weights are passed to the scipy backend as an array
+            rand_noise_list = np.random.uniform(1, w, size=len(base_weights))
+            weights_vid = distort_weights(base_weights, connection_mask, rand_noise_list)
+            path_mydua_w = get_shortest_path_nodes(G, from_node, to_node, weights_vid, backend=backend)["sumo"]
+        else:
+            # Apply random distortion to the edge weights of the graph using the specified parameters
+            # (each worker process distorts the tmp attribute of its own copy of the graph)
+            apply_randomization_my_duarouter(G, w, default_attribute=default_attribute, tmp_attribute=tmp_attribute, 
+                                             base_weights=base_weights, connection_mask=connection_mask)
+        
+            # Compute the shortest path using the distorted edge weights and store the result
+            path_mydua_w = get_shortest_path_nodes(G, from_node, to_node, tmp_attribute)["sumo"]
     
-    # Compute the shortest path using the distorted edge weights and store the result
-    path_mydua_w = get_shortest_path_nodes(G, from_node, to_node, tmp_attribute)["sumo"]
+        # Store the computed path for the current vehicle in the dictionary
+        dict_paths[int(vid)] = path_mydua_w
+
+    return dict_paths
+
+
+def init_worker():
+    # without a seed, the forked workers would inherit the same random state
+    if random_seed is None:
+        np.random.seed()
+
+
+if njobs > 1 and "fork" not in mp.get_all_start_methods():
+    print("Process pool requires the 'fork' start method, routing in a single process.")
+    njobs = 1
+
+# Chunks of vehicles (the per-vehicle seeding makes the paths independent of the split);
+# with w == 1 in a single process all the trips are routed in one batch
+if w == 1 and njobs == 1:
+    list_chunks = [np.arange(ind_from, ind_to)]
+else:
+    list_chunks = np.array_split(np.arange(ind_from, ind_to), max(1, int(np.ceil((ind_to-ind_from)/chunk_size))))
+
+if njobs > 1:
+    # The graph is loaded once and shared (copy-on-write) with the forked workers
+    with mp.get_context("fork").Pool(njobs, initializer=init_worker) as pool:
+        for dict_paths in tqdm(pool.imap_unordered(route_vehicles, list_chunks), total=len(list_chunks)):
+            dict_path_mydua.update(dict_paths)
     
-    # Store the computed path for the current vehicle in the dictionary
-    dict_path_mydua[int(vid)] = path_mydua_w
+    # same order of the vehicles as in the single-process mode
+    dict_path_mydua = {int(vid): dict_path_mydua[int(vid)] for vid in np.arange(ind_from, ind_to)}
+else:
+    for list_vid in tqdm(list_chunks):
+        dict_path_mydua.update(route_vehicles(list_vid))
 
     
 result_filename = result_folder+f"paths_mydua_{city}_N{N_max}_w{str(w).replace('.','p')}_{ind_from}_{ind_to}.json.gz"